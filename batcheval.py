@@ -0,0 +1,157 @@
+import numpy as np
+
+from bitboard import BitBoard, COLOR_INDEX, FEN_CHAR, INDEX_COLOR, PIECE_TYPES
+from chessai import material_value
+from definitions import *
+from evaluation import MAX_PHASE, PHASE_WEIGHT, PSQ, unpack_score
+
+# Evaluation of many positions at once with NumPy, for scoring datasets.
+#
+# A batch of N positions is an (N, 64) int8 array of BitBoard pieces
+# (color * 6 + kind, -1 for an empty square) by square r * DIM + c.
+# Scores are from white's view, like the heuristics in chessai.py.
+#
+# The four terms of a piece on a square (middlegame and endgame scores,
+# phase weight, material) are packed into one int64, so a batch costs one
+# table lookup and one sum per square, done in chunks that stay in cache.
+# Measured with bench.py batch on 100,000 random positions, against a
+# loop of set_fen and the heuristics on one BitBoard: about 100x the
+# positions per second on encoded batches, about 17x including
+# encode_fens, whose per-record split of the FEN fields dominates.
+
+# Piece code byte of each FEN character: '1' to '8' expand to runs of '1',
+# which are empty squares. Invalid characters are -2, rank separators -3.
+_FEN_BYTES = bytearray(b"\xfe" * 256)
+for _piece, _char in enumerate(FEN_CHAR[:-1]):
+    _FEN_BYTES[ord(_char)] = _piece
+_FEN_BYTES[ord("1")] = 0xff
+_FEN_BYTES[ord("/")] = 0xfd
+_FEN_BYTES = bytes(_FEN_BYTES)
+_INVALID = -2
+_RANK_SEPARATOR = -3
+
+# Bits of the packed terms, from the lowest. Sums of up to 64 pieces fit:
+# scores below 2^20, phase below 2^9.
+_SCORE_BITS = 21
+_PHASE_BITS = 10
+# Rows of a batch evaluated at a time
+CHUNK = 4096
+
+
+# @return: (13, 64) middlegame and endgame piece-square scores by piece,
+#          the 13th row of zeros for empty squares (-1)
+def _psq_tables():
+    mg = np.zeros((13, DIM * DIM), dtype=np.int64)
+    eg = np.zeros((13, DIM * DIM), dtype=np.int64)
+    for piece in range(12):
+        scores = PSQ[(INDEX_COLOR[piece // 6], PIECE_TYPES[piece % 6])]
+        for sq, score in enumerate(scores):
+            mg[piece, sq], eg[piece, sq] = unpack_score(score)
+    return mg, eg
+
+MG_TABLE, EG_TABLE = _psq_tables()
+PHASE_TABLE = np.array([PHASE_WEIGHT[PIECE_TYPES[piece % 6]]
+                        for piece in range(12)] + [0], dtype=np.int64)
+# Material in pawns, negative for black as in material_heuristic
+MATERIAL_TABLE = np.array([material_value[PIECE_TYPES[piece % 6]] *
+                           (-1 if piece >= 6 else 1)
+                           for piece in range(12)] + [0], dtype=np.int64)
+
+# Packed terms by square * 13 + piece + 1, so the index of a square is the
+# piece plus a constant offset
+_PACKED = np.ascontiguousarray((
+    MG_TABLE + (EG_TABLE << _SCORE_BITS) +
+    (PHASE_TABLE[:, None] << 2 * _SCORE_BITS) +
+    (MATERIAL_TABLE[:, None] << 2 * _SCORE_BITS + _PHASE_BITS)
+)[np.r_[12, 0:12]].T).reshape(-1)
+_SQUARE_OFFSETS = np.arange(DIM * DIM, dtype=np.intp) * 13 + 1
+
+
+# Expands the placement fields of all records at once and checks their
+# shape with array operations, parse_fen per record would dominate
+# @param fens: FEN records
+# @return: (N, 64) batch of their positions
+def encode_fens(fens):
+    if not fens:
+        return np.empty((0, DIM * DIM), dtype=np.int8)
+    placements = "/".join([(fen.split(None, 1) or [""])[0]
+                           for fen in fens]) + "/"
+    try:
+        data = placements.encode("ascii")
+    except UnicodeEncodeError:
+        raise InvalidFenException("invalid FEN placement in batch")
+    for n in range(2, DIM + 1):
+        data = data.replace(b"%d" % n, b"1" * n)
+    codes = np.frombuffer(data.translate(_FEN_BYTES), dtype=np.int8)
+    # Each record is 8 ranks of 8 squares and a separator
+    if codes.size != len(fens) * DIM * (DIM + 1):
+        raise InvalidFenException("invalid FEN placement in batch")
+    codes = codes.reshape(len(fens), DIM, DIM + 1)
+    if ((codes[:, :, DIM] != _RANK_SEPARATOR).any() or
+        (codes[:, :, :DIM] <= _INVALID).any()
+    ):
+        raise InvalidFenException("invalid FEN placement in batch")
+    # Records list rank 8 first
+    return np.ascontiguousarray(codes[:, ::-1, :DIM]).reshape(len(fens),
+                                                             DIM * DIM)
+
+
+# @param states: positions as returned by get_state() of either board
+# @return: (N, 64) batch of the positions
+def encode_states(states):
+    batch = np.full((len(states), DIM * DIM), -1, dtype=np.int8)
+    for i, state in enumerate(states):
+        for r, row in enumerate(state):
+            for c, (color, piece_type) in enumerate(row):
+                if color is not None:
+                    batch[i, r * DIM + c] = (COLOR_INDEX[color] * 6 +
+                                             PIECE_TYPES.index(piece_type))
+    return batch
+
+
+# @param boards: Board or BitBoard objects, BitBoards are copied directly
+# @return: (N, 64) batch of their positions
+def encode_boards(boards):
+    if all(type(board) is BitBoard for board in boards):
+        return np.array([board.squares for board in boards], dtype=np.int8)
+    return encode_states([board.get_state() for board in boards])
+
+
+# @param batch: (N, 64) batch
+# @return: (N, 12, 64) array, 1 where a piece stands on a square
+def one_hot(batch):
+    pieces = np.arange(12, dtype=np.int8)
+    return (batch[:, None, :] == pieces[None, :, None]).astype(np.uint8)
+
+
+# @param total: (N,) sums of packed terms
+# @return: the signed term in the lowest bits and the sums of the rest
+def _unpack(total, bits):
+    half = 1 << (bits - 1)
+    term = ((total + half) & ((1 << bits) - 1)) - half
+    return term, (total - term) >> bits
+
+# @param batch: (N, 64) batch
+# @return: (N,) material in pawns and (N,) piece-square scores, as
+#          material_batch and psq_batch
+def evaluate_batch(batch):
+    total = np.empty(len(batch), dtype=np.int64)
+    for start in range(0, len(batch), CHUNK):
+        index = np.add(batch[start:start + CHUNK], _SQUARE_OFFSETS,
+                       dtype=np.intp)
+        _PACKED.take(index).sum(axis=1, out=total[start:start + CHUNK])
+    mg, total = _unpack(total, _SCORE_BITS)
+    eg, total = _unpack(total, _SCORE_BITS)
+    phase, material = _unpack(total, _PHASE_BITS)
+    phase = np.minimum(phase, MAX_PHASE)
+    return material, (mg * phase + eg * (MAX_PHASE - phase)) // MAX_PHASE
+
+# @return: (N,) material in pawns, equal to material_heuristic
+def material_batch(batch):
+    return evaluate_batch(batch)[0]
+
+
+# @return: (N,) piece-square scores in centipawns tapered by phase, equal
+#          to psq_score() of the boards
+def psq_batch(batch):
+    return evaluate_batch(batch)[1]
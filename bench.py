@@ -0,0 +1,562 @@
+from chesslogic import *
+from bitboard import BitBoard
+from chessai import (HEURISTICS, MATE_BOUND, MinMaxPlayer, MonteCarlo,
+                     NegaMax, PLAYOUT_POLICIES, material_heuristic)
+import argparse
+import contextlib
+import io
+import os
+import sys
+import gc
+import math
+import random
+import time
+import tracemalloc
+
+# Benchmarks for the board implementations
+
+
+def make_move(board, move):
+    board.make_move(move)
+
+
+def unmake_move(board):
+    board.unmake_move()
+
+
+# @param board_type: Board or BitBoard
+# @param plies: length of the game played without unmaking
+# @return: moves of a reproducible random game
+def sample_game(board_type, plies, seed=1):
+    board = board_type()
+    rand = random.Random(seed)
+    moves = []
+    for _ in range(plies):
+        legal = sorted(board.generate_legal_moves(), key=str)
+        if not legal:
+            break
+        moves.append(rand.choice(legal))
+        board.move_piece(*moves[-1])
+    return moves
+
+
+# @param board_type: Board or BitBoard
+# @param pairs: number of make/unmake pairs to time
+# @return: blocks and bytes still allocated per make (the undo record and
+#          anything else kept until unmake), peak bytes of a make/unmake
+#          pair, and microseconds per pair
+def allocations(board_type, pairs):
+    moves = sample_game(board_type, 60)
+    board = board_type()
+    # Warm up caches and lazily created objects
+    for move in moves:
+        make_move(board, move)
+    for move in moves:
+        unmake_move(board)
+
+    gc.disable()
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    for move in moves:
+        make_move(board, move)
+    retained = tracemalloc.take_snapshot().compare_to(start, "filename")
+    blocks = sum(stat.count_diff for stat in retained) / len(moves)
+    size = sum(stat.size_diff for stat in retained) / len(moves)
+
+    last = moves[-1]
+    unmake_move(board)
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    make_move(board, last)
+    unmake_move(board)
+    peak = tracemalloc.get_traced_memory()[1] - current
+    tracemalloc.stop()
+    gc.enable()
+
+    start_time = time.perf_counter()
+    for _ in range(pairs):
+        make_move(board, last)
+        unmake_move(board)
+    elapsed = time.perf_counter() - start_time
+    return blocks, size, peak, elapsed / pairs * 1e6
+
+
+def run_allocations(args):
+    for board_type in (Board, BitBoard):
+        blocks, size, peak, usec = allocations(board_type, args.pairs)
+        print(f"{board_type.__name__:9} retained per make: {blocks:6.1f} blocks "
+              f"{size:8.1f} bytes  peak per pair: {peak:6d} bytes  "
+              f"{usec:7.1f} us per pair")
+
+
+# @param board_type: Board or BitBoard
+# @param boards: number of boards kept alive together
+# @return: bytes allocated per board, at the start position and after a
+#          game of plies moves
+def board_memory(board_type, boards, plies):
+    moves = sample_game(board_type, plies)
+    gc.collect()
+    tracemalloc.start()
+    start = tracemalloc.take_snapshot()
+    alive = [board_type() for _ in range(boards)]
+    new_size = tracemalloc.take_snapshot().compare_to(start, "filename")
+    for board in alive:
+        for move in moves:
+            make_move(board, move)
+    played_size = tracemalloc.take_snapshot().compare_to(start, "filename")
+    tracemalloc.stop()
+    return (sum(stat.size_diff for stat in new_size) / boards,
+            sum(stat.size_diff for stat in played_size) / boards)
+
+
+def run_memory(args):
+    for board_type in (Board, BitBoard):
+        new, played = board_memory(board_type, args.boards, args.plies)
+        print(f"{board_type.__name__:9} bytes per board: {new:8.0f} new "
+              f"{played:8.0f} after {args.plies} plies")
+
+
+SEARCH_POSITIONS = [
+    START_POSITION + " w KQkq - 0 1",
+    "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+    "r1bqkbnr/pppp1ppp/2n5/4p3/2B1P3/5Q2/PPPP1PPP/RNB1K1NR w KQkq - 2 3",
+    "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+]
+
+
+# @return: score of a searcher from the root player's view, mates as inf
+def root_score(searcher):
+    score = searcher.score
+    if isinstance(searcher, NegaMax) and abs(score) >= MATE_BOUND:
+        return math.copysign(math.inf, score)
+    return score
+
+
+# Searches each position to a fixed depth with plain minimax and with
+# alpha-beta negamax (without quiescence, which minimax lacks). Scores must
+# match, node counts show the pruning.
+def run_search(args):
+    correct = True
+    for fen in SEARCH_POSITIONS:
+        results = []
+        for searcher_type in (MinMaxPlayer, NegaMax):
+            board = BitBoard.from_fen(fen)
+            with contextlib.redirect_stdout(io.StringIO()):
+                if searcher_type is NegaMax:
+                    searcher = NegaMax(board, board.white_turn,
+                                       material_heuristic, args.depth,
+                                       quiescence = False)
+                else:
+                    searcher = MinMaxPlayer(board, board.white_turn,
+                                            material_heuristic, args.depth)
+                start = time.perf_counter()
+                if searcher_type is NegaMax:
+                    searcher.search(args.depth)
+                else:
+                    searcher.get_ai_move()
+                elapsed = time.perf_counter() - start
+            results.append((searcher.nodes, elapsed, root_score(searcher)))
+        (minmax_nodes, minmax_time, minmax_score), \
+        (negamax_nodes, negamax_time, negamax_score) = results
+        status = "ok" if minmax_score == negamax_score else "SCORE MISMATCH"
+        correct = correct and minmax_score == negamax_score
+        print(f"{fen[:40]:40} depth {args.depth} score {negamax_score}\n"
+              f"    minmax  nodes {minmax_nodes:9} time {minmax_time:7.2f}s\n"
+              f"    negamax nodes {negamax_nodes:9} time {negamax_time:7.2f}s "
+              f"{minmax_nodes / negamax_nodes:6.1f}x fewer nodes {status}")
+    if not correct:
+        sys.exit(1)
+
+
+# Searches each position iteratively up to depth with NegaMax, without
+# and with a transposition table, and prints the table counters
+def run_hash(args):
+    for fen in SEARCH_POSITIONS:
+        print(fen)
+        for hash_mb in (0, args.hash):
+            board = BitBoard.from_fen(fen)
+            with contextlib.redirect_stdout(io.StringIO()):
+                searcher = NegaMax(board, board.white_turn, material_heuristic,
+                                   hash_mb = hash_mb)
+            start = time.perf_counter()
+            searcher.iterative_search(args.depth)
+            elapsed = time.perf_counter() - start
+            print(f"    hash {hash_mb:4} MB nodes {searcher.nodes:8} "
+                  f"time {elapsed:6.2f}s "
+                  f"score {root_score(searcher)}")
+            if searcher.table is not None:
+                print(f"        {searcher.table} "
+                      f"usage {searcher.table.usage()}/1000")
+
+
+# Positions with hanging pieces or pending exchanges
+QUIESCENCE_POSITIONS = [
+    "r1bqkb1r/pppp1ppp/2n2n2/4p2Q/2B1P3/8/PPPP1PPP/RNB1K1NR w KQkq - 4 4",
+    "rnb1kbnr/pppp1ppp/8/4p1q1/3PP3/8/PPP2PPP/RNBQKBNR w KQkq - 1 3",
+    "r1bqk2r/pppp1ppp/2n2n2/2b1p3/2B1P3/3P1N2/PPP2PPP/RNBQK2R w KQkq - 1 5",
+    "r2qkbnr/ppp2ppp/2np4/4p3/2B1P1b1/2N2N2/PPPP1PPP/R1BQK2R w KQkq - 2 5",
+] + SEARCH_POSITIONS[1:]
+
+
+# Searches each position with NegaMax at depth - 1 and depth with
+# quiescence and at depth without it, and compares the chosen moves to a
+# search with quiescence at depth + 1
+def run_quiescence(args):
+    agree = {}
+    for fen in QUIESCENCE_POSITIONS:
+        print(fen)
+        reference = None
+        for depth, quiescence in ((args.depth + 1, True),
+                                  (args.depth, False),
+                                  (args.depth - 1, True),
+                                  (args.depth, True)):
+            board = BitBoard.from_fen(fen)
+            with contextlib.redirect_stdout(io.StringIO()):
+                searcher = NegaMax(board, board.white_turn, material_heuristic,
+                                   hash_mb = args.hash,
+                                   quiescence = quiescence)
+            start = time.perf_counter()
+            move, _ = searcher.iterative_search(depth)
+            elapsed = time.perf_counter() - start
+            name = f"depth {depth} {'quiescence' if quiescence else 'plain':10}"
+            if reference is None:
+                reference = move
+                name += " (reference)"
+            else:
+                agree[name] = agree.get(name, 0) + (move == reference)
+            print(f"    {name:33} nodes {searcher.nodes:8} "
+                  f"time {elapsed:6.2f}s score {root_score(searcher)} "
+                  f"move {move}")
+    for name, count in agree.items():
+        print(f"{name} agrees with the reference in {count} of "
+              f"{len(QUIESCENCE_POSITIONS)} positions")
+
+
+# Runs Monte Carlo tree searches of each position with each playout policy,
+# in one process and in a pool of workers, and prints playouts per second
+def run_mcts(args):
+    for fen in SEARCH_POSITIONS:
+        print(fen)
+        for policy in sorted(PLAYOUT_POLICIES):
+            for workers in sorted({1, args.workers}):
+                board = BitBoard.from_fen(fen)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    searcher = MonteCarlo(board, board.white_turn,
+                                          material_heuristic, policy = policy,
+                                          workers = workers,
+                                          batch = workers * args.batch)
+                move = searcher.search(args.playouts)
+                searcher.close()
+                print(f"    {policy:6} workers {workers:2} playouts "
+                      f"{searcher.playout_count:6} playouts/sec "
+                      f"{searcher.playouts_per_second:7.0f} move {move}")
+
+
+# Searches each position with NegaMax to a fixed depth with 1, 2, 4 ...
+# worker processes and prints the speedup over one process
+def run_threads(args):
+    totals = {}
+    for fen in SEARCH_POSITIONS:
+        print(fen)
+        for threads in args.threads:
+            board = BitBoard.from_fen(fen)
+            with contextlib.redirect_stdout(io.StringIO()):
+                searcher = NegaMax(board, board.white_turn, material_heuristic,
+                                   hash_mb = args.hash, threads = threads)
+            start = time.perf_counter()
+            searcher.iterative_search(args.depth)
+            elapsed = time.perf_counter() - start
+            searcher.close()
+            totals[threads] = totals.get(threads, 0) + elapsed
+            print(f"    threads {threads:2} nodes {searcher.nodes:8} "
+                  f"time {elapsed:6.2f}s score {root_score(searcher)}")
+    base = totals[args.threads[0]]
+    for threads, elapsed in totals.items():
+        print(f"threads {threads:2} total time {elapsed:6.2f}s "
+              f"speedup {base / elapsed:5.2f}x")
+
+
+SELECTIVE_OPTIONS = [
+    ("full width", {}),
+    ("null move", {"null_move": True}),
+    ("lmr", {"lmr": True}),
+    ("futility", {"futility": True}),
+    ("all", {"null_move": True, "lmr": True, "futility": True}),
+]
+
+# Searches each position to a fixed depth full width and with each
+# selective search option, and compares node counts and the chosen moves to
+# a full width search one ply deeper
+def run_selective(args):
+    nodes = {}
+    agree = {}
+    for fen in QUIESCENCE_POSITIONS:
+        print(fen)
+        reference = None
+        for name, options in ([("reference", {})] + SELECTIVE_OPTIONS):
+            board = BitBoard.from_fen(fen)
+            with contextlib.redirect_stdout(io.StringIO()):
+                searcher = NegaMax(board, board.white_turn,
+                                   HEURISTICS[args.eval], hash_mb = args.hash,
+                                   **options)
+            depth = args.depth + 1 if reference is None else args.depth
+            start = time.perf_counter()
+            move, _ = searcher.iterative_search(depth)
+            elapsed = time.perf_counter() - start
+            if reference is None:
+                reference = move
+            else:
+                nodes[name] = nodes.get(name, 0) + searcher.nodes
+                agree[name] = agree.get(name, 0) + (move == reference)
+            print(f"    {name:10} depth {depth} nodes {searcher.nodes:8} "
+                  f"time {elapsed:6.2f}s score {root_score(searcher)} "
+                  f"move {move}")
+    base = nodes["full width"]
+    for name, _ in SELECTIVE_OPTIONS:
+        print(f"{name:10} nodes {nodes[name]:9} ({base / nodes[name]:5.2f}x "
+              f"fewer) agrees with the reference in {agree[name]} of "
+              f"{len(QUIESCENCE_POSITIONS)} positions")
+
+
+# Plays a NegaMax move in each position and times the next one after the
+# opponent's reply, without and with pondering while the opponent thinks
+# for think seconds. The opponent is a searcher of the same depth.
+def run_ponder(args):
+    totals = {False: 0, True: 0}
+    hits = 0
+    for fen in SEARCH_POSITIONS:
+        print(fen)
+        for ponder in (False, True):
+            board = BitBoard.from_fen(fen)
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                player = NegaMax(board, board.white_turn, material_heuristic,
+                                 depth = args.depth, hash_mb = args.hash)
+                opponent = NegaMax(BitBoard.from_fen(fen), not board.white_turn,
+                                   material_heuristic, depth = args.depth,
+                                   hash_mb = args.hash)
+                player.ponder = ponder
+                move = player.get_ai_move()
+                board.make_move(move)
+                opponent.board.make_move(move)
+                reply = opponent.get_ai_move()
+            if reply is None:
+                print("    game over after the first move")
+                break
+            player.start_pondering()
+            time.sleep(args.think)
+            board.make_move(reply)
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(output):
+                move = player.get_ai_move()
+            elapsed = time.perf_counter() - start
+            player.close()
+            hit = "ponder hit" in output.getvalue()
+            hits += hit
+            totals[ponder] += elapsed
+            print(f"    {'ponder' if ponder else 'plain':6} time {elapsed:6.2f}s "
+                  f"move {move}{' (ponder hit)' if hit else ''}")
+    print(f"plain total {totals[False]:6.2f}s ponder total "
+          f"{totals[True]:6.2f}s ponder hits {hits}")
+
+
+# Times the heuristics on the positions of a sample game, and the
+# incrementally kept piece-square score alone
+def run_eval(args):
+    evaluators = dict(HEURISTICS, psq_score=lambda board: board.psq_score())
+    for board_type in (Board, BitBoard):
+        moves = sample_game(board_type, args.plies)
+        board = board_type()
+        for move in moves:
+            make_move(board, move)
+        for name, evaluate in evaluators.items():
+            start = time.perf_counter()
+            for _ in range(args.repeat):
+                evaluate(board)
+            elapsed = time.perf_counter() - start
+            print(f"{board_type.__name__:9} {name:9} "
+                  f"{elapsed / args.repeat * 1e6:7.2f} us per evaluation")
+
+
+# @return: FEN records of the positions of random games
+def random_positions(count, seed=1):
+    rand = random.Random(seed)
+    board = BitBoard()
+    fens = []
+    while len(fens) < count:
+        legal = sorted(board.generate_legal_moves(), key=str)
+        if not legal or board.moves_counter >= 200:
+            board.set_fen(START_POSITION)
+            continue
+        board.make_move(rand.choice(legal))
+        fens.append(board.fen())
+    return fens
+
+
+# Scores positions with material_heuristic and psq_score one BitBoard at a
+# time, and as a NumPy batch (batcheval.py). Scores must match.
+def run_batch(args):
+    import batcheval
+    fens = random_positions(args.positions)
+    board = BitBoard()
+    start = time.perf_counter()
+    scores = []
+    for fen in fens:
+        board.set_fen(fen)
+        scores.append((material_heuristic(board), board.psq_score()))
+    loop_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    batch = batcheval.encode_fens(fens)
+    encode_time = time.perf_counter() - start
+    start = time.perf_counter()
+    material, psq = batcheval.evaluate_batch(batch)
+    eval_time = time.perf_counter() - start
+    correct = list(zip(material.tolist(), psq.tolist())) == scores
+    for name, elapsed in (("loop", loop_time),
+                          ("batch with encoding", encode_time + eval_time),
+                          ("batch encoded", eval_time)):
+        print(f"{name:19} {len(fens) / elapsed:10.0f} positions/sec "
+              f"{loop_time / elapsed:6.1f}x")
+    print("ok" if correct else "SCORE MISMATCH")
+    if not correct:
+        sys.exit(1)
+
+
+PERFT_SUITE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                           "tests", "perft.epd")
+
+
+# @param path: file with lines 'FEN ;D1 nodes ;D2 nodes ...'
+# @return: list of (fen, {depth: nodes}) tuples
+def read_perft_suite(path):
+    suite = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            fen, *counts = line.split(";")
+            expected = {}
+            for count in counts:
+                depth, nodes = count.split()
+                expected[int(depth[1:])] = int(nodes)
+            suite.append((fen.strip(), expected))
+    return suite
+
+
+# Runs the perft suite up to max_nodes per position
+# @return: True if all node counts match
+def run_perft(args):
+    correct = True
+    for board_type in args.boards:
+        total_nodes, total_time = 0, 0
+        for fen, expected in read_perft_suite(args.suite):
+            board = board_type.from_fen(fen)
+            for depth in sorted(expected):
+                if expected[depth] > args.max_nodes:
+                    break
+                start = time.perf_counter()
+                nodes = board.perft(depth)
+                elapsed = time.perf_counter() - start
+                total_nodes += nodes
+                total_time += elapsed
+                status = "ok" if nodes == expected[depth] else \
+                         f"FAILED expected {expected[depth]}"
+                correct = correct and nodes == expected[depth]
+                print(f"{board_type.__name__:9} {fen[:40]:40} depth {depth} "
+                      f"nodes {nodes:9} nps {nodes / elapsed:9.0f} {status}")
+        print(f"{board_type.__name__:9} total nodes {total_nodes} "
+              f"nps {total_nodes / total_time:.0f}")
+    if not correct:
+        sys.exit(1)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    alloc_parser = subparsers.add_parser("alloc", help="allocations per "
+                                         "make/unmake pair")
+    alloc_parser.add_argument("-n", "--pairs", type=int, default=20000)
+    alloc_parser.set_defaults(func=run_allocations)
+
+    memory_parser = subparsers.add_parser("memory", help="bytes per board")
+    memory_parser.add_argument("-n", "--boards", type=int, default=200)
+    memory_parser.add_argument("-p", "--plies", type=int, default=40)
+    memory_parser.set_defaults(func=run_memory)
+
+    search_parser = subparsers.add_parser("search", help="alpha-beta against "
+                                          "minimax nodes and scores")
+    search_parser.add_argument("-d", "--depth", type=int, default=3)
+    search_parser.set_defaults(func=run_search)
+
+    hash_parser = subparsers.add_parser("hash", help="searches without and "
+                                        "with a transposition table")
+    hash_parser.add_argument("-d", "--depth", type=int, default=4)
+    hash_parser.add_argument("--hash", type=int, default=16, metavar="MB")
+    hash_parser.set_defaults(func=run_hash)
+
+    quiescence_parser = subparsers.add_parser("quiescence", help="searches "
+                                              "with and without quiescence")
+    quiescence_parser.add_argument("-d", "--depth", type=int, default=2)
+    quiescence_parser.add_argument("--hash", type=int, default=16,
+                                   metavar="MB")
+    quiescence_parser.set_defaults(func=run_quiescence)
+
+    selective_parser = subparsers.add_parser("selective", help="null move, "
+                                             "late move reductions and "
+                                             "futility pruning")
+    selective_parser.add_argument("-d", "--depth", type=int, default=4)
+    selective_parser.add_argument("-e", "--eval", choices=sorted(HEURISTICS),
+                                  default="pst")
+    selective_parser.add_argument("--hash", type=int, default=16,
+                                  metavar="MB")
+    selective_parser.set_defaults(func=run_selective)
+
+    eval_parser = subparsers.add_parser("eval", help="cost of an evaluation")
+    eval_parser.add_argument("-p", "--plies", type=int, default=30)
+    eval_parser.add_argument("-n", "--repeat", type=int, default=20000)
+    eval_parser.set_defaults(func=run_eval)
+
+    batch_parser = subparsers.add_parser("batch", help="NumPy batch "
+                                         "evaluation against a board loop")
+    batch_parser.add_argument("-n", "--positions", type=int, default=100000)
+    batch_parser.set_defaults(func=run_batch)
+
+    threads_parser = subparsers.add_parser("threads", help="parallel search "
+                                           "scaling")
+    threads_parser.add_argument("-d", "--depth", type=int, default=4)
+    threads_parser.add_argument("-t", "--threads", type=int, nargs="+",
+                                default=[1, 2, 4, 8])
+    threads_parser.add_argument("--hash", type=int, default=16, metavar="MB")
+    threads_parser.set_defaults(func=run_threads)
+
+    ponder_parser = subparsers.add_parser("ponder", help="move time after "
+                                          "the opponent's reply with and "
+                                          "without pondering")
+    ponder_parser.add_argument("-d", "--depth", type=int, default=4)
+    ponder_parser.add_argument("-t", "--think", type=float, default=5,
+                               help="seconds the opponent thinks")
+    ponder_parser.add_argument("--hash", type=int, default=16, metavar="MB")
+    ponder_parser.set_defaults(func=run_ponder)
+
+    mcts_parser = subparsers.add_parser("mcts", help="monte carlo playouts "
+                                        "per second")
+    mcts_parser.add_argument("-n", "--playouts", type=int, default=1000)
+    mcts_parser.add_argument("-w", "--workers", type=int,
+                             default=os.cpu_count())
+    mcts_parser.add_argument("-b", "--batch", type=int, default=4,
+                             help="playouts per worker and iteration")
+    mcts_parser.set_defaults(func=run_mcts)
+
+    perft_parser = subparsers.add_parser("perft", help="perft suite node "
+                                         "counts and nodes/sec")
+    perft_parser.add_argument("-s", "--suite", default=PERFT_SUITE)
+    perft_parser.add_argument("-n", "--max-nodes", type=int, default=100000,
+                              help="skip depths with more expected nodes")
+    perft_parser.add_argument("-bb", "--bitboard", action="store_const",
+                              dest="boards", const=[BitBoard],
+                              default=[Board, BitBoard])
+    perft_parser.set_defaults(func=run_perft)
+
+    args = parser.parse_args()
+    args.func(args)
@@ -0,0 +1,875 @@
+from definitions import *
+from evaluation import PSQ, PHASE_WEIGHT, tapered_score
+from exceptions import *
+
+
+# Bitboard implementation of the chess rules.
+# Same public API as chesslogic.Board - search "API START".
+#
+# Squares are ints 0..63 (a1 = 0, h1 = 7, a8 = 56), i.e. r * DIM + c.
+# A piece is an int: color * 6 + kind, kinds ordered as Board.piece_types.
+
+WHITE, BLACK = 0, 1
+PAWN_KIND, ROOK_KIND, KNIGHT_KIND, BISHOP_KIND, QUEEN_KIND, KING_KIND = range(6)
+EMPTY = -1
+
+PIECE_TYPES = [Pawn, Rook, Knight, Bishop, Queen, King]
+KIND = dict((piece_type, kind) for kind, piece_type in enumerate(PIECE_TYPES))
+COLOR_INDEX = {Colors.White: WHITE, Colors.Black: BLACK}
+INDEX_COLOR = (Colors.White, Colors.Black)
+PIECE_TEXT = "PRNBQK"
+FEN_PIECE = dict((c, piece) for piece, c in enumerate("PRNBQKprnbqk"))
+# FEN character of each piece, EMPTY (-1) is the last one
+FEN_CHAR = "PRNBQKprnbqk."
+
+
+# Iterate over square indices of set bits
+def iter_bits(bits):
+    while bits:
+        lsb = bits & -bits
+        yield lsb.bit_length() - 1
+        bits ^= lsb
+
+
+# @return: bitboards of a table of squares per square
+def _square_bits(table):
+    return tuple(sum(1 << target for target in targets) for targets in table)
+
+
+KNIGHT_ATTACKS = _square_bits(KNIGHT_TARGETS)
+KING_ATTACKS = _square_bits(KING_TARGETS)
+# Squares attacked by a pawn of a color standing on a square
+PAWN_ATTACKS = (_square_bits(PAWN_CAPTURES[Colors.White]),
+                _square_bits(PAWN_CAPTURES[Colors.Black]))
+
+# RAYS[direction][square] for each direction in ALL_DIRECTIONS
+RAYS = tuple(_square_bits(rays) for rays in RAY_SQUARES)
+# Rays towards higher square indices find their first blocker on the lsb
+POSITIVE_RAY = tuple(d[0] * DIM + d[1] > 0 for d in ALL_DIRECTIONS)
+
+RANK_1 = 0xFF
+RANK_3 = RANK_1 << 2 * DIM
+RANK_6 = RANK_1 << 5 * DIM
+RANK_8 = RANK_1 << DIM_ZERO * DIM
+# All 64 squares, bounds complements and shifts of Python's unbounded ints
+FULL = (1 << DIM * DIM) - 1
+
+# Castling rights bits and the squares whose change clears them
+WHITE_KINGSIDE, WHITE_QUEENSIDE, BLACK_KINGSIDE, BLACK_QUEENSIDE = 1, 2, 4, 8
+CASTLE_MASK = [0xF] * (DIM * DIM)
+CASTLE_MASK[4] &= ~(WHITE_KINGSIDE | WHITE_QUEENSIDE)
+CASTLE_MASK[7] &= ~WHITE_KINGSIDE
+CASTLE_MASK[0] &= ~WHITE_QUEENSIDE
+CASTLE_MASK[60] &= ~(BLACK_KINGSIDE | BLACK_QUEENSIDE)
+CASTLE_MASK[63] &= ~BLACK_KINGSIDE
+CASTLE_MASK[56] &= ~BLACK_QUEENSIDE
+CASTLE_MASK = tuple(CASTLE_MASK)
+
+# (right, king square, king target, rook square, rook target,
+#  squares that must be empty, squares the king passes)
+CASTLING = (
+    (WHITE_KINGSIDE, 4, 6, 7, 5, (1 << 5) | (1 << 6), (4, 5, 6)),
+    (WHITE_QUEENSIDE, 4, 2, 0, 3, (1 << 1) | (1 << 2) | (1 << 3), (4, 3, 2)),
+    (BLACK_KINGSIDE, 60, 62, 63, 61, (1 << 61) | (1 << 62), (60, 61, 62)),
+    (BLACK_QUEENSIDE, 60, 58, 56, 59, (1 << 57) | (1 << 58) | (1 << 59),
+     (60, 59, 58)),
+)
+CASTLING_BY_TARGET = dict(((entry[1], entry[2]), entry) for entry in CASTLING)
+
+# Zobrist keys by piece index and by castling rights bits
+ZOBRIST = tuple(ZOBRIST_PIECES[(INDEX_COLOR[piece // 6], PIECE_TYPES[piece % 6])]
+                for piece in range(12))
+CASTLING_KEYS = tuple(zobrist_castling(rights) for rights in range(16))
+
+# Piece-square scores and phase weights by piece index
+PIECE_SQUARE = tuple(PSQ[(INDEX_COLOR[piece // 6], PIECE_TYPES[piece % 6])]
+                     for piece in range(12))
+PHASE = tuple(PHASE_WEIGHT[PIECE_TYPES[piece % 6]] for piece in range(12))
+
+# BETWEEN[a][b]: squares strictly between two aligned squares, else 0
+BETWEEN = tuple(_square_bits(row) for row in SQUARES_BETWEEN)
+
+
+# FEN ranks seen in loaded positions: (first square, rank field) ->
+# ((piece, bits) pairs, squares, Zobrist key, piece-square score, phase).
+# Positions share most ranks, so bulk loading mostly skips the per square
+# work.
+_RANK_CACHE = {}
+_RANK_CACHE_SIZE = 1 << 16
+
+
+def _rank_entry(first_sq, rank):
+    pieces = {}
+    squares = []
+    key = 0
+    psq = phase = 0
+    for sq, char in enumerate(expand_fen_rank(rank), first_sq):
+        piece = FEN_PIECE[char] if char != "." else EMPTY
+        if piece != EMPTY:
+            pieces[piece] = pieces.get(piece, 0) | 1 << sq
+            key ^= ZOBRIST[piece][sq]
+            psq += PIECE_SQUARE[piece][sq]
+            phase += PHASE[piece]
+        squares.append(piece)
+    if len(_RANK_CACHE) >= _RANK_CACHE_SIZE:
+        _RANK_CACHE.clear()
+    entry = _RANK_CACHE[(first_sq, rank)] = (tuple(pieces.items()),
+                                             tuple(squares), key, psq, phase)
+    return entry
+
+
+# @return: first set square of bits along ray direction d
+def first_blocker(d, bits):
+    if POSITIVE_RAY[d]:
+        return (bits & -bits).bit_length() - 1
+    return bits.bit_length() - 1
+
+
+# @param sq: square of a sliding piece
+# @param occupied: bitboard of all pieces
+# @param rays: indices of directions to slide in
+# @return: bitboard of attacked squares (stops at and includes blockers)
+def slider_attacks(sq, occupied, rays):
+    attacks = 0
+    for d in rays:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            ray ^= RAYS[d][first_blocker(d, blockers)]
+        attacks |= ray
+    return attacks
+
+
+class BitBoard:
+    piece_types = PIECE_TYPES
+    player_colors = { True: Colors.White, False: Colors.Black }
+
+    # @param white_turn: Whose turn is it, unless the position has it
+    # @param position: a board position in FEN format
+    def __init__(self, white_turn = True, position = None):
+        self.white_turn = white_turn
+        self.passant_square = None
+        self.key = 0
+        self.moves_record = [None] * 64
+        self.record_count = 0
+        self.game_status = BoardStatus.Normal
+        # Plies since the start of the game and since the last capture or
+        # pawn move (FEN fullmove number and halfmove clock)
+        self.moves_counter = 0
+        self.halfmove_clock = 0
+
+        # One bitboard per piece, occupancy per color and for both colors
+        self.bitboards = [0] * 12
+        self.occupancy = [0, 0]
+        self.occupied = 0
+        # Piece on each square for captures and printing
+        self.squares = [EMPTY] * (DIM * DIM)
+        self.castling = 0
+        # Piece-square score of the pieces (white minus black, packed as in
+        # evaluation.pack_score) and game phase
+        self.psq = 0
+        self.phase = 0
+
+        self.start_position = position if position else START_POSITION
+        self.set_fen(self.start_position, white_turn)
+
+    @classmethod
+    def from_fen(cls, fen):
+        return cls(position=fen)
+
+    def __str__(self):
+        cols = "abcdefgh"
+        rows = "".join([str(n) for n in range(1, DIM+1)])
+        output_str = "   "
+        for c in cols:
+            output_str += c + "  "
+        output_str += "\n"
+
+        for r, row_num in zip(range(DIM_ZERO, -1, -1), rows[::-1]):
+            output_str += row_num + " "
+            row = [self._piece_text(self.squares[r * DIM + c])
+                   for c in range(DIM)]
+            output_str += "|" + "|".join(row) + "|\n"
+        return output_str
+
+    @staticmethod
+    def _piece_text(piece):
+        if piece == EMPTY:
+            return "  "
+        return ("w" if piece < 6 else "b") + PIECE_TEXT[piece % 6]
+
+    @property
+    def passant_pawn(self):
+        if self.passant_square is None:
+            return None
+        return SQUARE_COORDS[self.passant_square]
+
+    # @param placement: FEN placement field
+    # @return: Zobrist key of the pieces
+    def _set_pieces(self, placement):
+        ranks = placement.split("/")
+        if len(ranks) != DIM:
+            raise InvalidFenException(f"invalid FEN placement {placement}")
+        bitboards = [0] * 12
+        board_squares = []
+        key = 0
+        psq = phase = 0
+        for first_sq, rank in zip(range(0, DIM * DIM, DIM), reversed(ranks)):
+            entry = _RANK_CACHE.get((first_sq, rank))
+            if entry is None:
+                entry = _rank_entry(first_sq, rank)
+            for piece, bits in entry[0]:
+                bitboards[piece] |= bits
+            board_squares += entry[1]
+            key ^= entry[2]
+            psq += entry[3]
+            phase += entry[4]
+        self.psq = psq
+        self.phase = phase
+        self.bitboards = bitboards
+        self.squares = board_squares
+        self.occupancy = [bitboards[0] | bitboards[1] | bitboards[2] |
+                          bitboards[3] | bitboards[4] | bitboards[5],
+                          bitboards[6] | bitboards[7] | bitboards[8] |
+                          bitboards[9] | bitboards[10] | bitboards[11]]
+        self.occupied = self.occupancy[0] | self.occupancy[1]
+        return key
+
+    # Loads a FEN record into the board and clears the moves record.
+    # Reuses the board, the fast way to load many positions.
+    # @param fen: FEN record. Without castling field kings and rooks on
+    #             their home squares may castle.
+    # @param white_turn: Whose turn is it if the record has no side to move
+    def set_fen(self, fen, white_turn = True):
+        fields = fen.split()
+        if not fields:
+            raise InvalidFenException("empty FEN")
+        check_fen_placement(fields[0])
+        pieces_key = self._set_pieces(fields[0])
+        (fen_white_turn, castling, passant,
+         halfmove, fullmove) = parse_fen_fields(fen, fields)
+        if fen_white_turn is not None:
+            white_turn = fen_white_turn
+        self.white_turn = white_turn
+        # Castling needs king and rook on their home squares
+        self.castling = 0
+        for right, king_sq, _, rook_sq, _, _, _ in CASTLING:
+            color = WHITE if king_sq < DIM else BLACK
+            if (self.squares[king_sq] == color * 6 + KING_KIND and
+                self.squares[rook_sq] == color * 6 + ROOK_KIND
+            ):
+                self.castling |= right
+        if castling is not None:
+            self.castling &= castling
+        self.passant_square = None
+        if passant:
+            pawn_sq = passant[0] * DIM + passant[1] + (-DIM if white_turn else DIM)
+            enemy_pawn = (BLACK if white_turn else WHITE) * 6 + PAWN_KIND
+            if 0 <= pawn_sq < DIM * DIM and self.squares[pawn_sq] == enemy_pawn:
+                self.passant_square = pawn_sq
+        self.halfmove_clock = halfmove
+        self.moves_counter = 2 * (fullmove - 1) + (0 if white_turn else 1)
+        self.record_count = 0
+        self.game_status = None
+        self.key = (pieces_key ^ CASTLING_KEYS[self.castling] ^
+                    self._passant_key() ^
+                    (ZOBRIST_WHITE_TURN if white_turn else 0))
+
+    # @return: FEN record of the position
+    def fen(self):
+        squares = "".join([FEN_CHAR[piece] for piece in self.squares])
+        passant = self._passant_target()
+        return make_fen(squares, self.white_turn, self.castling,
+                        SQUARE_COORDS[passant] if passant is not None else None,
+                        self.halfmove_clock, self.moves_counter // 2 + 1)
+
+    # @return: key of en passant file if a pawn can capture en passant
+    def _passant_key(self):
+        if self.passant_square is None:
+            return 0
+        color = self.squares[self.passant_square] // 6
+        attackers = PAWN_ATTACKS[color][self._passant_target()]
+        if attackers & self.bitboards[(color ^ 1) * 6 + PAWN_KIND]:
+            return ZOBRIST_PASSANT[self.passant_square % DIM]
+        return 0
+
+    def _compute_key(self):
+        key = ZOBRIST_WHITE_TURN if self.white_turn else 0
+        for sq, piece in enumerate(self.squares):
+            if piece != EMPTY:
+                key ^= ZOBRIST[piece][sq]
+        return key ^ CASTLING_KEYS[self.castling] ^ self._passant_key()
+
+    def _king_square(self, color):
+        king = self.bitboards[color * 6 + KING_KIND]
+        if not king:
+            raise NoKingError(f"No {INDEX_COLOR[color]} king on board - "
+                              "cannot continue")
+        return king.bit_length() - 1
+
+    # @param sq: square index
+    # @param attacker: color index of the attacking side
+    # @param occupied: occupancy to use for sliding pieces (default current)
+    # @return: True if any piece of attacker attacks the square
+    def _square_attacked(self, sq, attacker, occupied = None):
+        bitboards = self.bitboards
+        offset = attacker * 6
+        if PAWN_ATTACKS[attacker ^ 1][sq] & bitboards[offset + PAWN_KIND]:
+            return True
+        if KNIGHT_ATTACKS[sq] & bitboards[offset + KNIGHT_KIND]:
+            return True
+        if KING_ATTACKS[sq] & bitboards[offset + KING_KIND]:
+            return True
+        return self._sliders_attack(sq, attacker, occupied)
+
+    def _sliders_attack(self, sq, attacker, occupied = None):
+        bitboards = self.bitboards
+        offset = attacker * 6
+        if occupied is None:
+            occupied = self.occupied
+        queens = bitboards[offset + QUEEN_KIND]
+        straight = bitboards[offset + ROOK_KIND] | queens
+        if straight and slider_attacks(sq, occupied, STRAIGHT_RAYS) & straight:
+            return True
+        diagonal = bitboards[offset + BISHOP_KIND] | queens
+        if diagonal and slider_attacks(sq, occupied, DIAGONAL_RAYS) & diagonal:
+            return True
+        return False
+
+    def _in_check(self, color):
+        return self._square_attacked(self._king_square(color), color ^ 1)
+
+    # @return: square of the en passant capture target or None
+    def _passant_target(self):
+        if self.passant_square is None:
+            return None
+        return self.passant_square + (DIM if self.passant_square >= 32 else -DIM)
+
+    # @param sq: square of a piece
+    # @return: bitboard of squares it attacks (pawns: capture squares)
+    def _attacks(self, sq, piece):
+        kind = piece % 6
+        if kind == KNIGHT_KIND:
+            return KNIGHT_ATTACKS[sq]
+        if kind == KING_KIND:
+            return KING_ATTACKS[sq]
+        if kind == PAWN_KIND:
+            return PAWN_ATTACKS[piece // 6][sq]
+        if kind == ROOK_KIND:
+            return slider_attacks(sq, self.occupied, STRAIGHT_RAYS)
+        if kind == BISHOP_KIND:
+            return slider_attacks(sq, self.occupied, DIAGONAL_RAYS)
+        return slider_attacks(sq, self.occupied, ALL_RAYS)
+
+    # @param color: color index of the player
+    # @param origins: bitboard restricting the moving pieces
+    # @param captures_only: only captures (en passant too) and promotions
+    # @return: list of pseudo-legal (origin, target, promotion) square moves
+    #          castling moves require empty squares only
+    def _pseudo_moves(self, color, origins = ~0, captures_only = False):
+        moves = []
+        append = moves.append
+        bitboards = self.bitboards
+        own = self.occupancy[color]
+        enemy = self.occupancy[color ^ 1]
+        empty = ~self.occupied & FULL
+        offset = color * 6
+        # Squares pieces may move to
+        targets = enemy if captures_only else ~own
+
+        # Pawns
+        pawns = bitboards[offset + PAWN_KIND] & origins
+        if pawns:
+            if color == WHITE:
+                step, double_rank, last_rank = DIM, RANK_3, RANK_8
+                single = (pawns << DIM) & empty
+                double = ((single & double_rank) << DIM) & empty
+            else:
+                step, double_rank, last_rank = -DIM, RANK_6, RANK_1
+                single = (pawns >> DIM) & empty
+                double = ((single & double_rank) >> DIM) & empty
+            if captures_only:
+                single &= last_rank
+                double = 0
+            for target in iter_bits(single):
+                if (1 << target) & last_rank:
+                    for promotion in PROMOTE:
+                        append((target - step, target, promotion))
+                else:
+                    append((target - step, target, None))
+            for target in iter_bits(double):
+                append((target - 2 * step, target, None))
+            passant_target = self._passant_target()
+            for origin in iter_bits(pawns):
+                attacks = PAWN_ATTACKS[color][origin]
+                for target in iter_bits(attacks & enemy):
+                    if (1 << target) & last_rank:
+                        for promotion in PROMOTE:
+                            append((origin, target, promotion))
+                    else:
+                        append((origin, target, None))
+                if (passant_target is not None and
+                    attacks & (1 << passant_target)
+                ):
+                    append((origin, passant_target, None))
+
+        # Pieces
+        for kind in (KNIGHT_KIND, BISHOP_KIND, ROOK_KIND, QUEEN_KIND, KING_KIND):
+            piece = offset + kind
+            for origin in iter_bits(bitboards[piece] & origins):
+                for target in iter_bits(self._attacks(origin, piece) & targets):
+                    append((origin, target, None))
+
+        # Castling
+        king = bitboards[offset + KING_KIND] & origins
+        if king and self.castling and not captures_only:
+            for right, king_sq, king_target, _, _, between, _ in CASTLING:
+                if (self.castling & right and
+                    king >> king_sq & 1 and
+                    not self.occupied & between
+                ):
+                    append((king_sq, king_target, None))
+        return moves
+
+    # Undo records are tuples on a preallocated stack
+    def _push_record(self, record):
+        if self.record_count == len(self.moves_record):
+            self.moves_record.extend([None] * len(self.moves_record))
+        self.moves_record[self.record_count] = record
+        self.record_count += 1
+
+    def _pop_record(self):
+        if self.record_count == 0:
+            raise RevertException("cannot revert start position")
+        self.record_count -= 1
+        record = self.moves_record[self.record_count]
+        self.moves_record[self.record_count] = None
+        return record
+
+    # @param move: (origin, target, promotion) of square indices
+    # @return: None. Performs move and pushes an undo record
+    def _make(self, origin, target, promotion):
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        squares = self.squares
+        piece = squares[origin]
+        color = piece // 6
+        kind = piece % 6
+        captured_sq = target
+        captured = squares[target]
+        if (kind == PAWN_KIND and captured == EMPTY and
+            (origin - target) % DIM != 0
+        ):
+            # En passant
+            captured_sq = self.passant_square
+            captured = squares[captured_sq]
+        self._push_record((origin, target, piece, captured, captured_sq,
+                           promotion, self.castling, self.passant_square,
+                           self.key, self.halfmove_clock, self.psq,
+                           self.phase))
+        if kind == PAWN_KIND or captured != EMPTY:
+            self.halfmove_clock = 0
+        else:
+            self.halfmove_clock += 1
+        key = (self.key ^ CASTLING_KEYS[self.castling] ^ self._passant_key() ^
+               ZOBRIST[piece][origin] ^ ZOBRIST_WHITE_TURN)
+        psq = self.psq - PIECE_SQUARE[piece][origin]
+
+        if captured != EMPTY:
+            key ^= ZOBRIST[captured][captured_sq]
+            psq -= PIECE_SQUARE[captured][captured_sq]
+            self.phase -= PHASE[captured]
+            bit = 1 << captured_sq
+            bitboards[captured] ^= bit
+            occupancy[color ^ 1] ^= bit
+            squares[captured_sq] = EMPTY
+
+        move_bits = (1 << origin) | (1 << target)
+        bitboards[piece] ^= move_bits
+        occupancy[color] ^= move_bits
+        squares[origin] = EMPTY
+        squares[target] = piece
+        if promotion:
+            promoted = color * 6 + KIND[promotion]
+            bitboards[piece] ^= 1 << target
+            bitboards[promoted] |= 1 << target
+            squares[target] = promoted
+            key ^= ZOBRIST[promoted][target]
+            psq += PIECE_SQUARE[promoted][target]
+            self.phase += PHASE[promoted]
+        elif kind == KING_KIND and abs(target - origin) == 2:
+            _, _, _, rook_sq, rook_target, _, _ = \
+                CASTLING_BY_TARGET[(origin, target)]
+            rook = squares[rook_sq]
+            rook_bits = (1 << rook_sq) | (1 << rook_target)
+            bitboards[rook] ^= rook_bits
+            occupancy[color] ^= rook_bits
+            squares[rook_sq] = EMPTY
+            squares[rook_target] = rook
+            key ^= ZOBRIST[rook][rook_sq] ^ ZOBRIST[rook][rook_target]
+            psq += PIECE_SQUARE[rook][rook_target] - PIECE_SQUARE[rook][rook_sq]
+        if not promotion:
+            key ^= ZOBRIST[piece][target]
+            psq += PIECE_SQUARE[piece][target]
+        self.psq = psq
+
+        self.occupied = occupancy[0] | occupancy[1]
+        self.castling &= CASTLE_MASK[origin] & CASTLE_MASK[target]
+        if kind == PAWN_KIND and abs(target - origin) == 2 * DIM:
+            self.passant_square = target
+        else:
+            self.passant_square = None
+        self.key = key ^ CASTLING_KEYS[self.castling] ^ self._passant_key()
+
+    def _revert(self):
+        (origin, target, piece, captured, captured_sq, promotion,
+         self.castling, self.passant_square, self.key,
+         self.halfmove_clock, self.psq, self.phase) = self._pop_record()
+        bitboards = self.bitboards
+        occupancy = self.occupancy
+        squares = self.squares
+        color = piece // 6
+
+        bitboards[squares[target]] ^= 1 << target
+        bitboards[piece] |= 1 << origin
+        move_bits = (1 << origin) | (1 << target)
+        occupancy[color] ^= move_bits
+        squares[target] = EMPTY
+        squares[origin] = piece
+        if piece % 6 == KING_KIND and abs(target - origin) == 2:
+            _, _, _, rook_sq, rook_target, _, _ = \
+                CASTLING_BY_TARGET[(origin, target)]
+            rook = squares[rook_target]
+            rook_bits = (1 << rook_sq) | (1 << rook_target)
+            bitboards[rook] ^= rook_bits
+            occupancy[color] ^= rook_bits
+            squares[rook_target] = EMPTY
+            squares[rook_sq] = rook
+
+        if captured != EMPTY:
+            bit = 1 << captured_sq
+            bitboards[captured] |= bit
+            occupancy[color ^ 1] |= bit
+            squares[captured_sq] = captured
+        self.occupied = occupancy[0] | occupancy[1]
+
+    # @param color: color index of the king
+    # @return: bitboard of pieces giving check, and dictionary of pinned
+    #          piece squares to the bitboard of squares they may move to
+    def _check_king_threats(self, king_sq, color):
+        bitboards = self.bitboards
+        offset = (color ^ 1) * 6
+        own = self.occupancy[color]
+        checkers = ((PAWN_ATTACKS[color][king_sq] & bitboards[offset + PAWN_KIND]) |
+                    (KNIGHT_ATTACKS[king_sq] & bitboards[offset + KNIGHT_KIND]))
+        pinned = {}
+        queens = bitboards[offset + QUEEN_KIND]
+        for rays, sliders in (
+            (STRAIGHT_RAYS, bitboards[offset + ROOK_KIND] | queens),
+            (DIAGONAL_RAYS, bitboards[offset + BISHOP_KIND] | queens)
+        ):
+            for d in rays:
+                ray = RAYS[d][king_sq]
+                if not ray & sliders:
+                    continue
+                blockers = ray & self.occupied
+                first = first_blocker(d, blockers)
+                if sliders >> first & 1:
+                    checkers |= 1 << first
+                    continue
+                if not own >> first & 1:
+                    continue
+                blockers ^= 1 << first
+                if not blockers:
+                    continue
+                second = first_blocker(d, blockers)
+                if sliders >> second & 1:
+                    pinned[first] = BETWEEN[king_sq][second] | (1 << second)
+        return checkers, pinned
+
+    # @param color: color index of player to move
+    # @param captures_only: only captures (en passant too) and promotions
+    # @param kind: only moves of this piece kind, None for all
+    # @return: generator of legal (origin, target, promotion) square moves
+    def _legal_moves(self, color, captures_only = False, kind = None):
+        king_sq = self._king_square(color)
+        checkers, pinned = self._check_king_threats(king_sq, color)
+        enemy = color ^ 1
+        own = self.occupancy[color]
+        with_king = kind is None or kind == KING_KIND
+
+        # King moves, sliding attacks are seen through the king's square
+        without_king = self.occupied ^ (1 << king_sq)
+        king_targets = self.occupancy[enemy] if captures_only else ~own
+        if with_king:
+            for target in iter_bits(KING_ATTACKS[king_sq] & king_targets):
+                if not self._square_attacked(target, enemy, without_king):
+                    yield (king_sq, target, None)
+        if checkers & (checkers - 1) or kind == KING_KIND:
+            if not checkers and not captures_only:
+                yield from self._castling_moves(king_sq, enemy)
+            return
+
+        if checkers:
+            checker_sq = checkers.bit_length() - 1
+            allowed = checkers | BETWEEN[king_sq][checker_sq]
+        elif captures_only:
+            allowed = ~0
+        else:
+            allowed = ~0
+            if with_king:
+                yield from self._castling_moves(king_sq, enemy)
+
+        origins = own ^ (1 << king_sq)
+        if kind is not None:
+            origins &= self.bitboards[color * 6 + kind]
+        passant_target = self._passant_target()
+        for move in self._pseudo_moves(color, origins, captures_only):
+            origin, target, _ = move
+            if target == passant_target and self.squares[origin] % 6 == PAWN_KIND:
+                victim = self.passant_square
+                if not allowed & ((1 << target) | (1 << victim)):
+                    continue
+                # Both pawns may leave the line between king and a slider
+                occupied = (self.occupied ^ (1 << origin) ^ (1 << victim) |
+                            (1 << target))
+                if self._sliders_attack(king_sq, enemy, occupied):
+                    continue
+            elif not allowed >> target & 1:
+                continue
+            if origin in pinned and not pinned[origin] >> target & 1:
+                continue
+            yield move
+
+    # @return: generator of legal castling moves of a king not in check
+    def _castling_moves(self, king_sq, enemy):
+        for right, king_origin, king_target, _, _, between, passing in CASTLING:
+            if (self.castling & right and king_origin == king_sq and
+                not self.occupied & between and
+                not self._square_attacked(passing[1], enemy) and
+                not self._square_attacked(passing[2], enemy)
+            ):
+                yield (king_sq, king_target, None)
+
+    def _legal_move_exists(self, color):
+        for _ in self._legal_moves(color):
+            return True
+        return False
+
+    def _perft(self, depth, color):
+        moves = list(self._legal_moves(color))
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        for move in moves:
+            self._make(*move)
+            nodes += self._perft(depth - 1, color ^ 1)
+            self._revert()
+        return nodes
+
+    def piece_count(self, color, piece_type):
+        return self.bitboards[COLOR_INDEX[color] * 6 + KIND[piece_type]].bit_count()
+
+    # @return: piece-square score in centipawns from white's view, tapered
+    #          by game phase. Kept up to date by make/unmake.
+    def psq_score(self):
+        return tapered_score(self.psq, self.phase)
+
+    # @return: number of squares attacked by knights, bishops, rooks and
+    #          queens of color that do not hold own pieces
+    def mobility(self, color):
+        color = COLOR_INDEX[color]
+        bitboards = self.bitboards
+        own = self.occupancy[color]
+        count = 0
+        for kind in (KNIGHT_KIND, BISHOP_KIND, ROOK_KIND, QUEEN_KIND):
+            piece = color * 6 + kind
+            for sq in iter_bits(bitboards[piece]):
+                count += (self._attacks(sq, piece) & ~own).bit_count()
+        return count
+
+########################### API START ###########################
+
+    # @param color: current player
+    # @return: status of game (check, checkmate, stalemate)
+    def update_status(self, color):
+        opponent = COLOR_INDEX[color] ^ 1
+        self.game_status = BoardStatus.Normal
+        if self._in_check(opponent):
+            if self._legal_move_exists(opponent):
+                self.game_status = BoardStatus.Check
+            else:
+                self.game_status = BoardStatus.Checkmate
+        elif not self._legal_move_exists(opponent):
+            self.game_status = BoardStatus.Stalemate
+        return self.game_status
+
+    # @param color: Colors of the king
+    # @return: True if the king is attacked
+    def in_check(self, color):
+        return self._in_check(COLOR_INDEX[color])
+
+    # @return: number of pieces of both colors, kings included
+    def piece_total(self):
+        return self.occupied.bit_count()
+
+    # @return: list of (square, FEN character) of the pieces
+    def piece_squares(self):
+        return [(sq, FEN_CHAR[piece])
+                for piece, bitboard in enumerate(self.bitboards)
+                for sq in iter_bits(bitboard)]
+
+    # @return: castling rights bits in ZOBRIST_CASTLING order
+    def castling_rights(self):
+        return self.castling
+
+    # @return: True if the player to move may capture en passant
+    def passant_capture(self):
+        return self._passant_key() != 0
+
+    # @return: Board with (color, piece-type) tuples or (None, None)
+    def get_state(self):
+        board_state = [[] for _ in range(DIM)]
+        for sq, piece in enumerate(self.squares):
+            if piece == EMPTY:
+                board_state[sq // DIM].append((None, None))
+            else:
+                board_state[sq // DIM].append((INDEX_COLOR[piece // 6],
+                                               PIECE_TYPES[piece % 6]))
+        return board_state
+
+    # @return: type of the piece on coordinates or None
+    def piece_type_at(self, coords):
+        piece = self.squares[square_index(coords)]
+        return PIECE_TYPES[piece % 6] if piece != EMPTY else None
+
+    def revert_last_move(self):
+        try:
+            self._revert()
+            self.white_turn = not self.white_turn
+            self.moves_counter -= 1
+            self.game_status = None
+        except Exception as e:
+            print(e)
+
+    # Fast move functions for search. Status is not evaluated, call status()
+    # when needed.
+    # @param move: a legal (origin, target, promotion) move from
+    #              generate_legal_moves
+    def make_move(self, move):
+        origin, target, promotion = move
+        self._make(origin[0] * DIM + origin[1], target[0] * DIM + target[1],
+                   promotion)
+        self.white_turn = not self.white_turn
+        self.moves_counter += 1
+        self.game_status = None
+
+    def unmake_move(self):
+        self._revert()
+        self.white_turn = not self.white_turn
+        self.moves_counter -= 1
+        self.game_status = None
+
+    # Passes the turn without moving, for null-move pruning in the search.
+    # Not for a player in check. Undo with unmake_null_move.
+    def make_null_move(self):
+        self._push_record((self.passant_square, self.key,
+                           self.halfmove_clock))
+        self.key ^= self._passant_key() ^ ZOBRIST_WHITE_TURN
+        self.passant_square = None
+        self.halfmove_clock += 1
+        self.white_turn = not self.white_turn
+        self.moves_counter += 1
+        self.game_status = None
+
+    def unmake_null_move(self):
+        (self.passant_square, self.key,
+         self.halfmove_clock) = self._pop_record()
+        self.white_turn = not self.white_turn
+        self.moves_counter -= 1
+        self.game_status = None
+
+    # @return: status of the player to move, evaluated once per position
+    def status(self):
+        if self.game_status is None:
+            self.update_status(self.player_colors[not self.white_turn])
+        return self.game_status
+
+    # @param origin: start coordinate of move
+    # @param target: end coordinate
+    # @param promotion: type of promotion piece or None
+    def move_piece(self, origin, target, promotion) -> BoardStatus:
+        if not on_board(origin) or not on_board(target):
+            raise NotOnBoardException("coordinates not on board")
+        if origin == target:
+            raise SameSquareException("same square")
+        origin_sq, target_sq = square_index(origin), square_index(target)
+        origin_piece = self.squares[origin_sq]
+        if origin_piece == EMPTY:
+            raise NoPieceException(f"no piece in {origin}")
+        color = origin_piece // 6
+        if INDEX_COLOR[color] != BitBoard.player_colors[self.white_turn]:
+            raise WrongTurnException("not your piece")
+        target_piece = self.squares[target_sq]
+        if target_piece != EMPTY and target_piece // 6 == color:
+            raise SameColorException("same color")
+
+        targets = set(move[1] for move in
+                      self._pseudo_moves(color, 1 << origin_sq))
+        if target_sq not in targets:
+            raise IllegalMoveException(f"illegal move {origin, target}")
+        if origin_piece % 6 == PAWN_KIND and (1 << target_sq) & (RANK_1 | RANK_8):
+            if promotion not in PROMOTE:
+                raise MissingPromotionChoice("retry move with promotion choice")
+        else:
+            promotion = None
+
+        if origin_piece % 6 == KING_KIND and abs(target_sq - origin_sq) == 2:
+            passing = CASTLING_BY_TARGET[(origin_sq, target_sq)][6]
+            for sq in passing:
+                if self._square_attacked(sq, color ^ 1):
+                    raise KingThreatenedException("cannot castle under threat")
+        self._make(origin_sq, target_sq, promotion)
+        if self._in_check(color):
+            self._revert()
+            raise KingThreatenedException("king under threat")
+
+        self.white_turn = not self.white_turn
+        game_status = self.update_status(INDEX_COLOR[color])
+        self.moves_counter += 1
+        return game_status
+
+    # @param captures_only: only captures (en passant too) and promotions
+    # @param piece_type: only moves of this piece type, None for all
+    # @return: list of legal (origin, target, promotion) moves of current player
+    def generate_legal_moves(self, captures_only = False, piece_type = None):
+        color = WHITE if self.white_turn else BLACK
+        kind = KIND[piece_type] if piece_type is not None else None
+        return [(SQUARE_COORDS[origin], SQUARE_COORDS[target], promotion)
+                for origin, target, promotion in
+                self._legal_moves(color, captures_only, kind)]
+
+    # @param depth: number of plies
+    # @return: number of leaf nodes of the legal move tree
+    def perft(self, depth):
+        if depth == 0:
+            return 1
+        return self._perft(depth, WHITE if self.white_turn else BLACK)
+
+    # @param depth: number of plies, at least 1
+    # @return: dictionary of legal moves to their perft(depth - 1) counts
+    def divide(self, depth):
+        counts = {}
+        for move in self.generate_legal_moves():
+            self.make_move(move)
+            counts[move] = self.perft(depth - 1)
+            self.unmake_move()
+        return counts
+
+    def generate_moves(self):
+        color = WHITE if self.white_turn else BLACK
+        return [(SQUARE_COORDS[origin], SQUARE_COORDS[target], promotion)
+                for origin, target, promotion in self._pseudo_moves(color)]
+
+
+############################ API END ############################
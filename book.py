@@ -0,0 +1,174 @@
+from bitboard import BitBoard
+from definitions import *
+from exceptions import *
+from pgn import read_games, san_to_move
+import argparse
+import mmap
+import os
+import random
+import struct
+
+# Opening books in the Polyglot format: 16 byte (key, move, weight, learn)
+# entries, big endian, sorted by key. A book is memory-mapped and looked up
+# by binary search, so processes using the same book share its pages.
+#
+# Keys are the Zobrist keys of the boards (board.key), which follow the
+# Polyglot layout with this program's random numbers, so books must be
+# built with book.py.
+#
+# Moves are packed as Polyglot does: to file, to row, from file, from row
+# and promotion in 3 bits each, castling as the king taking its rook.
+
+ENTRY = struct.Struct(">QHHI")
+_KEY = struct.Struct(">Q")
+PROMOTION_CODES = {None: 0, Knight: 1, Bishop: 2, Rook: 3, Queen: 4}
+CODE_PROMOTIONS = dict((code, piece) for piece, code in PROMOTION_CODES.items())
+# Weights of a game's moves by the result for the player who made them
+RESULT_WEIGHTS = {"1-0": (2, 0), "0-1": (0, 2), "1/2-1/2": (1, 1)}
+
+
+# @param board: board of the position before the move
+# @return: move packed in 16 bits
+def encode_move(board, move):
+    origin, target, promotion = move
+    if (board.piece_type_at(origin) is King and
+        abs(target[1] - origin[1]) == 2
+    ):
+        target = Coords(target[0], DIM_ZERO if target[1] > origin[1] else 0)
+    return (target[1] | target[0] << 3 | origin[1] << 6 | origin[0] << 9 |
+            PROMOTION_CODES[promotion] << 12)
+
+# @return: (origin, target, promotion) move of a packed move
+def decode_move(board, code):
+    target = Coords(code >> 3 & 7, code & 7)
+    origin = Coords(code >> 9 & 7, code >> 6 & 7)
+    promotion = CODE_PROMOTIONS.get(code >> 12 & 7)
+    if (board.piece_type_at(origin) is King and origin[1] == 4 and
+        target[0] == origin[0] and target[1] in (0, DIM_ZERO)
+    ):
+        target = Coords(target[0], 6 if target[1] == DIM_ZERO else 2)
+    return origin, target, promotion
+
+
+class OpeningBook:
+    # @param path: book file built by build_book
+    def __init__(self, path):
+        self.file = open(path, "rb")
+        size = os.fstat(self.file.fileno()).st_size
+        self.count = size // ENTRY.size
+        # mmap cannot map an empty file
+        self.map = (mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+                    if self.count else b"")
+
+    def close(self):
+        if self.count:
+            self.map.close()
+        self.file.close()
+
+    # @return: index of the first entry with a key not below key
+    def _lower_bound(self, key):
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if _KEY.unpack_from(self.map, middle * ENTRY.size)[0] < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    # @param key: Zobrist key of a position
+    # @return: list of (packed move, weight) entries of the position
+    def entries(self, key):
+        entries = []
+        for i in range(self._lower_bound(key), self.count):
+            entry_key, move, weight, _ = ENTRY.unpack_from(self.map,
+                                                           i * ENTRY.size)
+            if entry_key != key:
+                break
+            entries.append((move, weight))
+        return entries
+
+    # @return: list of (legal move, weight) of the position of board
+    def moves(self, board):
+        legal = set(board.generate_legal_moves())
+        moves = []
+        for code, weight in self.entries(board.key):
+            move = decode_move(board, code)
+            if move in legal:
+                moves.append((move, weight))
+        return moves
+
+    # @param rand: random generator
+    # @return: a book move chosen by weight or None
+    def choose(self, board, rand = random):
+        moves = [(move, weight) for move, weight in self.moves(board) if weight]
+        if not moves:
+            return None
+        return rand.choices([move for move, _ in moves],
+                            [weight for _, weight in moves])[0]
+
+
+# Builds a book from games. Moves are weighted by the results of the games
+# they were played in: 2 for a win, 1 for a draw.
+# @param games: iterable of (headers, SAN moves, result) as pgn.read_games
+# @param max_plies: plies of each game added to the book
+# @param min_games: moves played in fewer games are left out
+# @return: number of games read and of entries written
+def build_book(games, path, max_plies = 20, min_games = 1):
+    weights = {}
+    counts = {}
+    board = BitBoard()
+    game_count = 0
+    for headers, moves, result in games:
+        game_count += 1
+        board.set_fen(headers.get("FEN", START_POSITION + " w KQkq - 0 1"))
+        white_weight, black_weight = RESULT_WEIGHTS.get(result, (0, 0))
+        for san in moves[:max_plies]:
+            try:
+                move = san_to_move(board, san)
+            except InvalidSanException:
+                break
+            entry = (board.key, encode_move(board, move))
+            weights[entry] = weights.get(entry, 0) + (
+                white_weight if board.white_turn else black_weight)
+            counts[entry] = counts.get(entry, 0) + 1
+            board.make_move(move)
+    entries = sorted((key, move, weight) for (key, move), weight in
+                     weights.items() if counts[(key, move)] >= min_games)
+    # Weights are 16 bit, scale all down if one is larger
+    scale = max([weight for _, _, weight in entries] + [0xFFFF]) / 0xFFFF
+    with open(path, "wb") as f:
+        for key, move, weight in entries:
+            f.write(ENTRY.pack(key, move, int(weight / scale), 0))
+    return game_count, len(entries)
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="build or probe an "
+                                     "opening book")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="build a book from "
+                                         "a PGN file")
+    build_parser.add_argument("pgn")
+    build_parser.add_argument("book")
+    build_parser.add_argument("-p", "--plies", type=int, default=20,
+                              help="plies of each game (default 20)")
+    build_parser.add_argument("-m", "--min-games", type=int, default=1,
+                              help="leave out moves played in fewer games")
+    probe_parser = subparsers.add_parser("probe", help="list the book moves "
+                                         "of a position")
+    probe_parser.add_argument("book")
+    probe_parser.add_argument("-f", "--fen", help="position (default start)")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        with open(args.pgn, encoding="utf-8", errors="replace") as f:
+            games, entries = build_book(read_games(f), args.book, args.plies,
+                                        args.min_games)
+        print(f"{games} games {entries} entries")
+    else:
+        board = BitBoard.from_fen(args.fen) if args.fen else BitBoard()
+        book = OpeningBook(args.book)
+        for move, weight in sorted(book.moves(board), key=lambda m: -m[1]):
+            print(move, weight)
+        book.close()
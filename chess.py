@@ -1,8 +1,14 @@
 from io import BufferedRandom, BufferedReader
-from chessai import MinMaxPlayer, RandomPlayer, material_heuristic
+from chessai import (HEURISTICS, MinMaxPlayer, MonteCarlo, NegaMax,
+                     PLAYOUT_POLICIES, RandomPlayer)
 from chesslogic import *
+from bitboard import BitBoard
+from book import OpeningBook
+from searchstats import StatsLog
+from tablebase import Tablebase
 import random
 import argparse
+import time
 
 # Terminal interface
 
@@ -20,6 +26,20 @@ def text_to_coords(coords_str):
     return Coords(r, c)
 
 
+def coords_to_text(coords):
+    return "abcdefgh"[coords[1]] + str(coords[0] + 1)
+
+
+# @param move: (origin, target, promotion) tuple
+# @return: move in 'e2e4' or 'a7a8q' form
+def move_to_text(move):
+    origin, target, promotion = move
+    text = coords_to_text(origin) + coords_to_text(target)
+    if promotion:
+        text += promotion(Colors.Black).text.lower()
+    return text
+
+
 def text_to_promotion(s):
     return None if s is None else CHAR_PROMOTE[s]
 
@@ -42,6 +62,21 @@ def ask_promote(board, file_moves):
             return CHAR_PROMOTE[choice]
 
 
+# Prints perft node counts of each root move (with divide) and nodes/sec
+def run_perft(board, depth, divide = False):
+    start = time.perf_counter()
+    if divide:
+        counts = board.divide(depth)
+        for move in sorted(counts, key=move_to_text):
+            print(f"{move_to_text(move)}: {counts[move]}")
+        nodes = sum(counts.values())
+    else:
+        nodes = board.perft(depth)
+    elapsed = time.perf_counter() - start
+    print(f"depth {depth} nodes {nodes} time {elapsed:.2f}s "
+          f"nps {nodes / elapsed if elapsed else 0:.0f}")
+
+
 def end_game(game_status):
     if game_status == BoardStatus.Check:
         print("check")
@@ -57,24 +92,101 @@ def end_game(game_status):
 if __name__=="__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("-t", "--test", help="path to test file")
-    parser.add_argument("-ai", "--ai", help="play against AI: r - random"
-                        "m - minmax"                    
+    parser.add_argument("-ai", "--ai", help="play against AI: r - random "
+                        "m - minmax n - negamax (alpha-beta) c - monte carlo tree search"
+    )
+    parser.add_argument("-d", "--depth", type=int, help="depth for recursive "
+                        "algorithms should be 1 or more (default 1, no limit "
+                        "with --movetime or --nodes)"
+    )
+    parser.add_argument("--movetime", type=int, metavar="MS",
+                        help="negamax, monte carlo: think at most MS milliseconds per move"
+    )
+    parser.add_argument("--nodes", type=int,
+                        help="negamax: search at most NODES positions per move"
+    )
+    parser.add_argument("-e", "--eval", choices=sorted(HEURISTICS),
+                        default="material", help="AI: evaluation of "
+                        "positions, material or piece-square tables with "
+                        "mobility (default material)"
+    )
+    parser.add_argument("--playouts", type=int,
+                        help="monte carlo: playouts per move (default 1000, "
+                        "no limit with --movetime)"
+    )
+    parser.add_argument("--policy", choices=sorted(PLAYOUT_POLICIES),
+                        default="random", help="monte carlo: playout policy"
+    )
+    parser.add_argument("--no-quiescence", action="store_false",
+                        dest="quiescence",
+                        help="negamax: score leaves without resolving captures"
+    )
+    parser.add_argument("--null-move", action="store_true",
+                        help="negamax: null move pruning"
     )
-    parser.add_argument("-d", "--depth", default=1, help="depth for recursive"
-                        "algorithms should be 1 or more (default 1)"
+    parser.add_argument("--lmr", action="store_true",
+                        help="negamax: late move reductions"
+    )
+    parser.add_argument("--futility", action="store_true",
+                        help="negamax: futility pruning and razoring"
+    )
+    parser.add_argument("--threads", type=int, default=1,
+                        help="AI: number of worker processes (default 1)"
+    )
+    parser.add_argument("--book", help="AI: opening book built with book.py")
+    parser.add_argument("--ponder", action="store_true",
+                        help="AI: search while the human thinks, negamax "
+                        "needs --hash"
+    )
+    parser.add_argument("--stats", action="store_true",
+                        help="AI: print search statistics of each move"
+    )
+    parser.add_argument("--stats-log", metavar="FILE",
+                        help="AI: append search statistics of each move to a "
+                        "JSON lines file, '-' for the terminal"
+    )
+    parser.add_argument("--profile", action="store_true",
+                        help="AI: time move generation, evaluation and "
+                        "legality checks in the statistics (slower)"
+    )
+    parser.add_argument("--tablebases", metavar="DIR",
+                        help="AI: endgame tablebases built with tablebase.py"
+    )
+    parser.add_argument("--hash", type=int, default=16, metavar="MB",
+                        help="transposition table size of the AI in MB, "
+                        "0 for none (default 16)"
     )
     parser.add_argument("-c", "--color",
                         help="color of human player: b - black, w - white"
     )
+    parser.add_argument("-bb", "--bitboard", action="store_true",
+                        help="use the bitboard board implementation"
+    )
+    parser.add_argument("-f", "--fen", help="start from a FEN position")
+    parser.add_argument("--perft", type=int, metavar="DEPTH",
+                        help="count leaf nodes of the move tree and exit"
+    )
+    parser.add_argument("--divide", action="store_true",
+                        help="with --perft: print counts of each root move"
+    )
+    args = parser.parse_args()
+
+    board_type = BitBoard if args.bitboard else Board
+    try:
+        board = board_type.from_fen(args.fen) if args.fen else board_type()
+    except InvalidFenException as e:
+        parser.error(e)
+    if args.perft:
+        run_perft(board, args.perft, args.divide)
+        exit()
 
     print(INTRO)
     print("move: 'e2 e4' or 'a7 a8 Q' revert: 'r' exit: '0'")
     print("help: 'python chess.py -h'")
-    args = parser.parse_args()
     
-    board = Board()
     computer_turn = False if board.white_turn else True
     ai_player = None
+    heuristic = HEURISTICS[args.eval]
     if args.ai:
         if args.color == "b" or args.color == "black":
             # TODO rewrite this to go according to current state
@@ -82,9 +194,36 @@ if __name__=="__main__":
     if args.ai == "r" or args.ai == "random":
         ai_player = RandomPlayer(board, False)
     if args.ai == "m" or args.ai == "minmax":
-        # TODO here add choice of heuristic as well
-        ai_player = MinMaxPlayer(board, computer_turn, material_heuristic,
-                                 depth = int(args.depth))
+        ai_player = MinMaxPlayer(board, computer_turn, heuristic,
+                                 depth = args.depth or 1, hash_mb = args.hash,
+                                 threads = args.threads)
+    if args.ai == "n" or args.ai == "negamax":
+        depth = args.depth
+        if depth is None and args.movetime is None and args.nodes is None:
+            depth = 1
+        ai_player = NegaMax(board, computer_turn, heuristic,
+                            depth = depth, hash_mb = args.hash,
+                            movetime = args.movetime, max_nodes = args.nodes,
+                            quiescence = args.quiescence,
+                            threads = args.threads,
+                            null_move = args.null_move, lmr = args.lmr,
+                            futility = args.futility)
+    if args.ai == "c" or args.ai == "mcts":
+        playouts = args.playouts
+        if playouts is None and args.movetime is None:
+            playouts = 1000
+        ai_player = MonteCarlo(board, computer_turn, heuristic,
+                               playouts = playouts, movetime = args.movetime,
+                               policy = args.policy, workers = args.threads)
+    if ai_player and args.book:
+        ai_player.book = OpeningBook(args.book)
+    if ai_player and args.tablebases:
+        ai_player.tablebase = Tablebase(args.tablebases)
+    if ai_player:
+        ai_player.ponder = args.ponder
+        ai_player.profile = args.profile
+        if args.stats_log:
+            ai_player.stats_log = StatsLog(args.stats_log)
 
     moves_input = []
     if args.test:
@@ -100,12 +239,15 @@ if __name__=="__main__":
         if ai_player and ai_player.is_white == board.white_turn:
             # TODO change so AI plays and returns status and move
             move = ai_player.get_ai_move()
+            if args.stats:
+                print(ai_player.stats)
             try:
                 origin, target, promotion = move
                 game_status = board.move_piece(origin, target, promotion)
                 print(board)
                 if end_game(game_status):
                     break
+                ai_player.start_pondering()
             except Exception as e:
                 print(e)
                 continue
@@ -153,3 +295,7 @@ if __name__=="__main__":
                     break         
             except ValueError as e:
                 print(e)
+    if ai_player:
+        ai_player.close()
+        if ai_player.stats_log:
+            ai_player.stats_log.close()
@@ -1,6 +1,15 @@
 from chesslogic import *
+from searchstats import SearchStats, profiled
+from tablebase import DRAW, MAX_PIECES
+from transposition import TranspositionTable, EXACT, LOWER, UPPER
+import contextlib
+import copy
+import io
+import multiprocessing
 import random
 import math
+import threading
+import time
 
 # Base class for AIs
 class BaseAI:
@@ -9,10 +18,160 @@ class BaseAI:
         self.board = board
         self.name = name
         self.is_white = is_white
+        # Worker processes of parallel searches, created on first use
+        self.pool = None
+        # Opening book consulted before searching (book.OpeningBook)
+        self.book = None
+        # Endgame tablebases consulted before searching and in the search
+        # (tablebase.Tablebase)
+        self.tablebase = None
+        # Search on the opponent's time, see start_pondering
+        self.ponder = False
+        self.ponder_thread = None
+        # Cleared to stop the background search
+        self.pondering = False
+        # Transposition table of searching players
+        self.table = None
+        # Statistics of the last move (searchstats.SearchStats), and the
+        # sink they are written to (searchstats.StatsLog)
+        self.stats = None
+        self.stats_log = None
+        # Time the parts of searches, see searchstats.profiled
+        self.profile = False
+        # Where the move being chosen comes from, see SearchStats.source
+        self.move_source = None
 
-    # Virtual function
+    # @return: move of the player to move, its statistics are left in stats
     def get_ai_move(self):
-        raise NotImplementedError("AI should implement get_ai_move function")
+        self.stop_pondering()
+        stats = SearchStats(self.name)
+        table = self.table
+        if table is not None:
+            probes, hits = table.probes, table.hits
+        self.move_source = "search"
+        start = time.perf_counter()
+        with (profiled(self, stats) if self.profile else
+              contextlib.nullcontext()):
+            move = self._select_move()
+        stats.time = time.perf_counter() - start
+        stats.move = move
+        stats.source = self.move_source
+        if table is not None:
+            stats.table_probes = table.probes - probes
+            stats.table_hits = table.hits - hits
+        if self.move_source in ("search", "ponder"):
+            self._fill_stats(stats)
+        stats.finish()
+        self.stats = stats
+        if self.stats_log is not None:
+            self.stats_log.write(stats)
+        return move
+
+    # Virtual function: chooses the move of get_ai_move
+    def _select_move(self):
+        raise NotImplementedError("AI should implement _select_move function")
+
+    # Virtual function: adds the counts of the last search to stats
+    def _fill_stats(self, stats):
+        pass
+
+    # Starts a background search after the AI's move is played, while the
+    # opponent thinks. It runs _ponder in a thread on a copy of the board,
+    # so the game board may change meanwhile. The main thread mostly waits
+    # for input then, so the thread gets the CPU. get_ai_move stops it and
+    # reuses its work.
+    def start_pondering(self):
+        self.stop_pondering()
+        if (not self.ponder or self.board.status() in
+            (BoardStatus.Checkmate, BoardStatus.Stalemate)
+        ):
+            return
+        board = type(self.board).from_fen(self.board.fen())
+        self.pondering = True
+        self.ponder_thread = threading.Thread(target=self._ponder,
+                                              args=(board,), daemon=True)
+        self.ponder_thread.start()
+
+    # Stops the background search and waits for it
+    def stop_pondering(self):
+        thread = self.ponder_thread
+        if thread is None:
+            return
+        self.pondering = False
+        while thread.is_alive():
+            self._interrupt_ponder()
+            thread.join(0.01)
+        self.ponder_thread = None
+
+    # Virtual function: the background search on board, returns soon after
+    # pondering is cleared. Players without pondering do nothing.
+    def _ponder(self, board):
+        pass
+
+    # Virtual function: makes a running _ponder return
+    def _interrupt_ponder(self):
+        pass
+
+    # @return: a move of the opening book for the position or None
+    def _book_move(self):
+        if self.book is None:
+            return None
+        move = self.book.choose(self.board)
+        if move is not None:
+            print("book move")
+            self.move_source = "book"
+        return move
+
+    # @return: a best move of the tablebases for the position or None
+    def _tablebase_move(self):
+        if self.tablebase is None:
+            return None
+        best = self.tablebase.best_move(self.board)
+        if best is None:
+            return None
+        print("tablebase move")
+        self.move_source = "tablebase"
+        return best[0]
+
+    # @return: pool of worker processes
+    def _get_pool(self, workers, initializer = None, initargs = ()):
+        if self.pool is None:
+            self.pool = multiprocessing.Pool(workers, initializer, initargs)
+        return self.pool
+
+    # Creates the worker processes of a parallel search, if the player has
+    # them, with the current parameters of the search
+    def start_workers(self):
+        pass
+
+    # Stops the background search and the worker processes
+    def close(self):
+        self.stop_pondering()
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool = None
+
+
+# Searcher of a worker process of a parallel search
+_worker_searcher = None
+
+# Creates the searcher of a worker process
+# @param args: constructor arguments after board and is_white
+def init_search_worker(searcher_type, args):
+    global _worker_searcher
+    with contextlib.redirect_stdout(io.StringIO()):
+        _worker_searcher = searcher_type(None, True, *args)
+
+# Searches a root move in a worker process
+# @param task: (board type, fen, move, depth, alpha, beta, seconds, nodes),
+#              seconds and nodes are the budget or None
+# @return: (score of the move for the root player or None if the budget
+#          ran out, nodes searched)
+def search_move_task(task):
+    board_type, fen, move, depth, alpha, beta, seconds, max_nodes = task
+    searcher = _worker_searcher
+    searcher.board = board_type.from_fen(fen)
+    return searcher._search_move(move, depth, alpha, beta, seconds, max_nodes)
 
 
 # Plays moves randomly
@@ -21,103 +180,1126 @@ class RandomPlayer(BaseAI):
         super().__init__(board, is_white, "random player")
         print("initialize random player")
 
-    def get_ai_move(self):
-        moves = self.board.generate_moves()
+    def _select_move(self):
+        moves = self.board.generate_legal_moves()
         return random.choice(moves)
 
 
+# With threads > 1 the root moves are searched in worker processes, each
+# with its own board and transposition table.
 class MinMaxPlayer(BaseAI):
-    def __init__(self, board, is_white, heuristic, depth = 1):
+    # @param hash_mb: size of the transposition table, 0 for none
+    # @param threads: number of worker processes, 1 searches in this one
+    def __init__(self, board, is_white, heuristic, depth = 1, hash_mb = 0,
+                 threads = 1):
         super().__init__(board, is_white, "minmax player")
         self.heuristic = heuristic
         self.depth = depth
+        self.hash_mb = hash_mb
+        self.threads = threads
+        self.table = TranspositionTable(hash_mb) if hash_mb else None
+        # Positions visited by the last search and its score
+        self.nodes = 0
+        self.score = None
         print("initialize minmax player\ndepth:", depth)
     
+    # @return: score of a position without legal moves from AI's view
+    def _end_score(self, maximize):
+        if self.board.status() == BoardStatus.Checkmate:
+            # Player to move is checkmated
+            return -math.inf if maximize else math.inf
+        return 0
+
     def _min_max_rec(self, maximize, depth, root_white):
+        self.nodes += 1
         if depth == 0:
+            if self.board.status() in (BoardStatus.Checkmate,
+                                       BoardStatus.Stalemate):
+                return self._end_score(maximize)
             h = self.heuristic(self.board)
             return h if root_white else -h
-        else:
-            moves = self.board.generate_moves()
-            best_score = -math.inf if maximize else math.inf
-            # TODO refactor this
-            for move in moves:
-                origin, target, promotion = move
-                try:
-                    game_status = self.board.move_piece(origin, target, promotion)
-                except:
-                    # TODO could pop illegal moves
-                    # TODO handle case where no moves
-                    continue
-                if game_status == BoardStatus.Checkmate:
-                    self.board.revert_last_move()
-                    if maximize:
-                        # AI wants to avoid being checkmated
-                        return -math.inf
-                    else:
-                        # AI wants to checkmate
-                        return math.inf
-                if game_status == BoardStatus.Stalemate:
-                    self.board.revert_last_move()
-                    return 0
-
-                score = self._min_max_rec(not maximize, depth - 1, root_white)
-                if ((maximize and score > best_score) or
-                    (not maximize and score < best_score)
-                ):
-                    best_score = score
-                self.board.revert_last_move()
+        # Scores are stored from the view of the player to move
+        table = self.table
+        if table is not None:
+            entry = table.probe(self.board.key)
+            if entry is not None and entry[1] >= depth:
+                return entry[2] if maximize else -entry[2]
+        moves = self.board.generate_legal_moves()
+        if not moves:
+            return self._end_score(maximize)
+        best_score = -math.inf if maximize else math.inf
+        for move in moves:
+            self.board.make_move(move)
+            score = self._min_max_rec(not maximize, depth - 1, root_white)
+            self.board.unmake_move()
+            if ((maximize and score > best_score) or
+                (not maximize and score < best_score)
+            ):
+                best_score = score
+        if table is not None:
+            table.store(self.board.key, depth,
+                        best_score if maximize else -best_score, EXACT, None)
         return best_score
 
+    # Searches a root move, the window and budget are ignored
+    # @return: (score of the move for the root player, nodes searched)
+    def _search_move(self, move, depth, alpha, beta, seconds, max_nodes):
+        self.nodes = 0
+        root_is_white = self.board.white_turn
+        self.board.make_move(move)
+        score = self._min_max_rec(False, depth - 1, root_is_white)
+        self.board.unmake_move()
+        return score, self.nodes
+
+    def start_workers(self):
+        if self.threads > 1:
+            self._worker_pool()
+
+    # @return: pool of the processes searching root moves
+    def _worker_pool(self):
+        return self._get_pool(self.threads, init_search_worker,
+                              (type(self), (self.heuristic, self.depth,
+                                            self.hash_mb)))
+
+    # @return: scores of the root moves searched in worker processes
+    def _parallel_scores(self, moves, depth):
+        pool = self._worker_pool()
+        fen = self.board.fen()
+        results = pool.map(search_move_task,
+                           [(type(self.board), fen, move, depth, None, None,
+                             None, None) for move in moves])
+        self.nodes += sum(nodes for _, nodes in results)
+        return [score for score, _ in results]
+
     # @param maximize: maximize on AI turn, minimize opponent turn
     # @param depth: depth of recursion. at least 1.
     def _min_max(self, depth):
         maximize = True
-        moves = self.board.generate_moves()
+        moves = self.board.generate_legal_moves()
         best_move = None
         best_score = -math.inf if maximize else math.inf
-        # TODO refactor this?
         root_is_white = self.board.white_turn
-        for move in moves:
-            origin, target, promotion = move
-            try:
-                self.board.move_piece(origin, target, promotion)
-            except ValueError as e:
-                print(e)
-                # TODO could pop illegal moves
-                continue
-            score = self._min_max_rec(not maximize, depth - 1, root_is_white)
-            if ((maximize and score > best_score) or
-                (not maximize and score < best_score)
-            ):
+        self.nodes = 1
+        if self.table is not None:
+            self.table.new_search()
+        if self.threads > 1:
+            scores = self._parallel_scores(moves, depth)
+        else:
+            scores = None
+        for i, move in enumerate(moves):
+            if scores is not None:
+                score = scores[i]
+            else:
+                self.board.make_move(move)
+                score = self._min_max_rec(not maximize, depth - 1,
+                                          root_is_white)
+                self.board.unmake_move()
+            if best_move is None or score > best_score:
                 best_score = score
                 best_move = move
-            self.board.revert_last_move()
+        self.score = best_score
         return best_move
 
-    def get_ai_move(self):
+    def _select_move(self):
+        move = self._book_move() or self._tablebase_move()
+        if move is not None:
+            return move
         print("calculating move...")
         return self._min_max(self.depth)
 
+    def _fill_stats(self, stats):
+        stats.nodes = self.nodes
+        stats.depth = self.depth
+        stats.score = self.score
+
+
+material_value = {Pawn: 1, Knight: 3, Bishop: 3, Rook: 5, Queen: 9, King: 0}
+# Piece values for move ordering, the king is the most valuable attacker
+order_value = {Pawn: 1, Knight: 3, Bishop: 3, Rook: 5, Queen: 9, King: 10}
+
+
+# Score of being checkmated at the root, mates closer to the root score higher
+MATE_SCORE = 100000
+# Scores beyond this are mate scores
+MATE_BOUND = MATE_SCORE - 1000
+# Depth limit of searches with only a time or node budget
+MAX_DEPTH = 64
+
+
+# Mate scores are stored relative to the position, not to the root
+def score_to_table(score, ply):
+    if score >= MATE_BOUND:
+        return score + ply
+    if score <= -MATE_BOUND:
+        return score - ply
+    return score
+
+def score_from_table(score, ply):
+    if score >= MATE_BOUND:
+        return score - ply
+    if score <= -MATE_BOUND:
+        return score + ply
+    return score
+
 
+# Alpha-beta negamax with principal variation search. Scores are from the
+# view of the player to move. Moves are ordered: captures by most valuable
+# victim / least valuable attacker (MVV-LVA), then killer moves (quiet
+# moves that caused a cutoff at the same ply), then quiet moves by history
+# score (cutoffs they caused anywhere, weighted by depth). With a
+# transposition table the stored best move of a position is tried first.
+#
+# Leaves are resolved by a quiescence search of captures and promotions, so
+# they are not scored in the middle of an exchange.
+#
+# Selective search, each part off unless turned on in the constructor:
+# - null move: the player to move passes, if a reduced search still fails
+#   high the position is cut off. Not in check nor with only pawns left,
+#   where passing may be better than any move (zugzwang).
+# - late move reductions: quiet moves late in the order are searched one
+#   ply shallower first, and again at full depth if they raise alpha.
+# - futility: near the leaves, quiet moves are skipped when the static score
+#   plus a margin cannot reach alpha, and positions far below alpha are
+#   razored to a quiescence search.
+#
+# get_ai_move deepens iteratively until the depth, time or node budget runs
+# out, and plays the best move of the last completed iteration.
+#
+# With threads > 1 the root is split: the first move is searched here, the
+# others with a null window around its score in worker processes, and those
+# that fail high again with an open window. Workers keep their own tables
+# between iterations. The node budget is checked per task, so the search
+# may overshoot it by up to threads tasks.
 class NegaMax(BaseAI):
-    pass
+    # Values of captured and promoted pieces in pawns, for delta pruning in
+    # the quiescence search
+    capture_values = material_value
+    # A capture must be able to raise the score to alpha minus this margin
+    # (in pawns)
+    delta_margin = 2
+    # Depth reduction of the null move search
+    null_move_reduction = 2
+    # Moves searched at full depth before reductions, and the least depth
+    # where moves are reduced
+    lmr_moves = 3
+    lmr_depth = 3
+    # Futility and razoring margins by remaining depth (in pawns)
+    futility_margins = (0, 2, 5)
+    razor_margins = (0, 3, 5)
 
+    # @param depth: maximal depth, None for no limit but the budgets
+    # @param hash_mb: size of the transposition table, 0 for none
+    # @param movetime: time budget of a move in milliseconds or None
+    # @param max_nodes: node budget of a move or None
+    # @param quiescence: resolve captures at the leaves
+    # @param threads: number of worker processes, 1 searches in this one
+    # @param null_move, lmr, futility: selective search, see above
+    # @param quiet: print nothing when created, for internal searchers
+    def __init__(self, board, is_white, heuristic, depth = 1, hash_mb = 0,
+                 movetime = None, max_nodes = None, quiescence = True,
+                 threads = 1, null_move = False, lmr = False,
+                 futility = False, quiet = False):
+        super().__init__(board, is_white, "negamax player")
+        self.heuristic = heuristic
+        self.pawn_value = pawn_value(heuristic)
+        self.depth = depth
+        self.movetime = movetime
+        self.max_nodes = max_nodes
+        self.quiescence = quiescence
+        self.hash_mb = hash_mb
+        self.threads = threads
+        self.null_move = null_move
+        self.lmr = lmr
+        self.futility = futility
+        self.table = TranspositionTable(hash_mb) if hash_mb else None
+        # Positions visited by the last search and its score
+        self.nodes = 0
+        self.score = None
+        # Budget of the running search, checked in _search
+        self.deadline = math.inf
+        self.node_limit = math.inf
+        # Depth of the last completed iteration
+        self.completed_depth = 0
+        # Beta cutoffs of the last search and those by the first move, and
+        # (depth, nodes, seconds) of its completed iterations
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.iterations = []
+        # Called with the searcher after each completed iteration of
+        # iterative_search, e.g. to report progress
+        self.on_iteration = None
+        # killers[ply]: two latest quiet moves that caused a cutoff
+        self.killers = []
+        # (origin, target) of quiet moves to their history score
+        self.history = {}
+        # Searcher of the background search sharing the table, the key of
+        # the position it searched and its (move, score)
+        self.ponder_searcher = None
+        self.ponder_key = None
+        self.ponder_result = None
+        if not quiet:
+            print("initialize negamax player\ndepth:", depth)
+
+    # @return: score of the position for the player to move
+    def _evaluate(self):
+        score = self.heuristic(self.board)
+        return score if self.board.white_turn else -score
+
+    # @return: score of a position without legal moves for the player to move
+    def _end_score(self, ply):
+        if self.board.status() == BoardStatus.Checkmate:
+            return -MATE_SCORE + ply
+        return 0
+
+    # @param value: tablebase value of the position, 1 + plies to mate
+    # @return: score of the player to move, mate scores as in _end_score
+    def _tablebase_score(self, value, ply):
+        if value == DRAW:
+            return 0
+        plies = value - 1
+        if plies % 2:
+            return MATE_SCORE - ply - plies
+        return -MATE_SCORE + ply + plies
+
+    # @return: captured piece type or None (en passant captures a pawn)
+    def _captured(self, move, moving_type):
+        origin, target, _ = move
+        victim = self.board.piece_type_at(target)
+        if victim is None and moving_type is Pawn and origin[1] != target[1]:
+            return Pawn
+        return victim
+
+    # @param moves: legal moves of the player to move
+    # @param ply: distance from the root
+    # @param best_move: move to try first (from the transposition table)
+    # @return: moves sorted best first
+    def _order_moves(self, moves, ply, best_move = None):
+        board = self.board
+        killers = self.killers[ply] if ply < len(self.killers) else ()
+        history = self.history
+        def order_key(move):
+            if move == best_move:
+                return 3000000
+            moving_type = board.piece_type_at(move[0])
+            victim = self._captured(move, moving_type)
+            if victim or move[2]:
+                gain = order_value[victim] if victim else 0
+                if move[2]:
+                    gain += order_value[move[2]]
+                return 2000000 + gain * 100 - order_value[moving_type]
+            if move in killers:
+                return 1000000
+            return history.get((move[0], move[1]), 0)
+        return sorted(moves, key=order_key, reverse=True)
+
+    # Remembers a quiet move that caused a beta cutoff
+    def _store_cutoff(self, move, depth, ply):
+        origin, target, promotion = move
+        moving_type = self.board.piece_type_at(origin)
+        if promotion or self._captured(move, moving_type):
+            return
+        while len(self.killers) <= ply:
+            self.killers.append([None, None])
+        killers = self.killers[ply]
+        if killers[0] != move:
+            killers[1] = killers[0]
+            killers[0] = move
+        key = (origin, target)
+        self.history[key] = self.history.get(key, 0) + depth * depth
 
+    # Counts a node, raises SearchAbortedException when a budget ran out
+    def _count_node(self):
+        self.nodes += 1
+        if self.nodes >= self.node_limit or (
+            not self.nodes & 31 and time.perf_counter() >= self.deadline
+        ):
+            raise SearchAbortedException("search budget exhausted")
+
+    # Searches captures and promotions until the position is quiet. The
+    # player to move may stand pat (keep the static score) instead of
+    # capturing, unless in check, where all evasions are searched.
+    # @param ply: distance from the root
+    # @return: score of the position for the player to move, exact if it is
+    #          inside (alpha, beta), else a bound
+    def _quiescence(self, alpha, beta, ply):
+        self._count_node()
+        board = self.board
+        status = board.status()
+        if status in (BoardStatus.Checkmate, BoardStatus.Stalemate):
+            return self._end_score(ply)
+        in_check = status == BoardStatus.Check
+        if in_check:
+            best_score = -math.inf
+            moves = board.generate_legal_moves()
+        else:
+            best_score = stand_pat = self._evaluate()
+            if stand_pat >= beta:
+                return stand_pat
+            if stand_pat > alpha:
+                alpha = stand_pat
+            moves = board.generate_legal_moves(captures_only = True)
+        values = self.capture_values
+        margin = self.delta_margin * self.pawn_value
+        for move in self._order_moves(moves, ply):
+            if not in_check:
+                # Delta pruning: skip captures that cannot reach alpha
+                victim = self._captured(move, board.piece_type_at(move[0]))
+                gain = values[victim] if victim else 0
+                if move[2]:
+                    gain += values[move[2]] - values[Pawn]
+                if stand_pat + gain * self.pawn_value + margin <= alpha:
+                    continue
+            board.make_move(move)
+            score = -self._quiescence(-beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                break
+        return best_score
+
+    # @return: True if the player to move has pieces besides pawns and king
+    def _has_pieces(self):
+        board = self.board
+        color = board.player_colors[board.white_turn]
+        return any(board.piece_count(color, piece_type)
+                   for piece_type in (Knight, Bishop, Rook, Queen))
+
+    # Razoring and null move pruning, before the moves of a position are
+    # searched
+    # @param static: static score of the position, the player to move is
+    #                not in check
+    # @return: score to cut the position off with or None
+    def _prune_node(self, depth, alpha, beta, ply, static, null_allowed):
+        board = self.board
+        if (self.futility and depth < len(self.razor_margins) and
+            static + self.razor_margins[depth] * self.pawn_value <= alpha
+        ):
+            score = (self._quiescence(alpha, alpha + 1, ply)
+                     if self.quiescence else static)
+            if score <= alpha:
+                return score
+        reduction = self.null_move_reduction
+        if (self.null_move and null_allowed and depth > reduction and
+            static >= beta and self._has_pieces()
+        ):
+            board.make_null_move()
+            records = board.record_count
+            try:
+                score = -self._search(depth - 1 - reduction, -beta, -beta + 1,
+                                      ply + 1, False)
+            except SearchAbortedException:
+                # Unwind the moves below the null move, the caller unwinds
+                # the moves above it
+                while board.record_count > records:
+                    board.unmake_move()
+                board.unmake_null_move()
+                raise
+            board.unmake_null_move()
+            if score >= beta:
+                # Mates found after passing are not proven
+                return beta if score >= MATE_BOUND else score
+        return None
+
+    # @param depth: remaining depth
+    # @param ply: distance from the root
+    # @param null_allowed: False right after a null move
+    # @return: score of the position for the player to move, exact if it is
+    #          inside (alpha, beta), else a bound
+    def _search(self, depth, alpha, beta, ply, null_allowed = True):
+        board = self.board
+        if depth == 0 and self.quiescence:
+            return self._quiescence(alpha, beta, ply)
+        self._count_node()
+        if (ply > 0 and self.tablebase is not None and
+            board.piece_total() <= MAX_PIECES
+        ):
+            value = self.tablebase.probe(board)
+            if value is not None:
+                return self._tablebase_score(value, ply)
+        if depth == 0:
+            if board.status() in (BoardStatus.Checkmate, BoardStatus.Stalemate):
+                return self._end_score(ply)
+            return self._evaluate()
+        table = self.table
+        table_move = None
+        if table is not None:
+            entry = table.probe(board.key)
+            if entry is not None:
+                _, entry_depth, score, bound, table_move, _ = entry
+                score = score_from_table(score, ply)
+                if entry_depth >= depth and (
+                    bound == EXACT or
+                    (bound == LOWER and score >= beta) or
+                    (bound == UPPER and score <= alpha)
+                ):
+                    return score
+        selective = self.null_move or self.lmr or self.futility
+        in_check = False
+        # Static score plus the futility margin, None if not pruning
+        futility_score = None
+        if selective:
+            in_check = board.in_check(board.player_colors[board.white_turn])
+            if not in_check and -MATE_BOUND < alpha and beta < MATE_BOUND:
+                static = self._evaluate()
+                score = self._prune_node(depth, alpha, beta, ply, static,
+                                         null_allowed)
+                if score is not None:
+                    return score
+                if self.futility and depth < len(self.futility_margins):
+                    futility_score = (static + self.futility_margins[depth] *
+                                      self.pawn_value)
+        moves = board.generate_legal_moves()
+        if not moves:
+            return self._end_score(ply)
+        original_alpha = alpha
+        best_score = -math.inf
+        best_move = None
+        for i, move in enumerate(self._order_moves(moves, ply, table_move)):
+            # Quiet moves after the first may be pruned or reduced
+            quiet = (selective and i > 0 and not in_check and not move[2] and
+                     self._captured(move, board.piece_type_at(move[0])) is None)
+            board.make_move(move)
+            if quiet and board.in_check(board.player_colors[board.white_turn]):
+                quiet = False
+            if quiet and futility_score is not None and futility_score <= alpha:
+                board.unmake_move()
+                if futility_score > best_score:
+                    best_score = futility_score
+                continue
+            if i == 0:
+                score = -self._search(depth - 1, -beta, -alpha, ply + 1)
+            else:
+                # Null window search, search again if it may raise alpha
+                if (quiet and self.lmr and i >= self.lmr_moves and
+                    depth >= self.lmr_depth
+                ):
+                    score = -self._search(depth - 2, -alpha - 1, -alpha,
+                                          ply + 1)
+                    if score > alpha:
+                        score = -self._search(depth - 1, -alpha - 1, -alpha,
+                                              ply + 1)
+                else:
+                    score = -self._search(depth - 1, -alpha - 1, -alpha,
+                                          ply + 1)
+                if alpha < score < beta:
+                    score = -self._search(depth - 1, -beta, -alpha, ply + 1)
+            board.unmake_move()
+            if score > best_score:
+                best_score = score
+                best_move = move
+            if score > alpha:
+                alpha = score
+            if alpha >= beta:
+                self.cutoffs += 1
+                if i == 0:
+                    self.first_move_cutoffs += 1
+                self._store_cutoff(move, depth, ply)
+                break
+        if table is not None:
+            if best_score <= original_alpha:
+                bound = UPPER
+            elif best_score >= beta:
+                bound = LOWER
+            else:
+                bound = EXACT
+            table.store(board.key, depth, score_to_table(best_score, ply),
+                        bound, best_move)
+        return best_score
+
+    # @param moves: ordered legal moves of the player to move
+    # @return: best move and its score for the player to move
+    def _search_root(self, depth, moves):
+        board = self.board
+        alpha, beta = -math.inf, math.inf
+        best_move = None
+        for i, move in enumerate(moves):
+            board.make_move(move)
+            if i == 0:
+                score = -self._search(depth - 1, -beta, -alpha, 1)
+            else:
+                score = -self._search(depth - 1, -alpha - 1, -alpha, 1)
+                if score > alpha:
+                    score = -self._search(depth - 1, -beta, -alpha, 1)
+            board.unmake_move()
+            if best_move is None or score > alpha:
+                alpha = score
+                best_move = move
+        if self.table is not None and best_move is not None:
+            self.table.store(board.key, depth, score_to_table(alpha, 0),
+                             EXACT, best_move)
+        return best_move, alpha
+
+    # Searches a root move within a window and budget
+    # @return: (score of the move for the root player or None if the budget
+    #          ran out, nodes searched)
+    def _search_move(self, move, depth, alpha, beta, seconds, max_nodes):
+        self.nodes = 0
+        self.deadline = (time.perf_counter() + seconds if seconds is not None
+                         else math.inf)
+        self.node_limit = max_nodes if max_nodes is not None else math.inf
+        self.board.make_move(move)
+        try:
+            score = -self._search(depth - 1, -beta, -alpha, 1)
+        except SearchAbortedException:
+            return None, self.nodes
+        self.board.unmake_move()
+        return score, self.nodes
+
+    def start_workers(self):
+        if self.threads > 1:
+            self._worker_pool()
+
+    # @return: pool of the processes searching root moves
+    def _worker_pool(self):
+        return self._get_pool(self.threads, init_search_worker,
+                              (type(self), (self.heuristic, self.depth,
+                                            self.hash_mb, None, None,
+                                            self.quiescence, 1,
+                                            self.null_move, self.lmr,
+                                            self.futility)))
+
+    # @param moves: root moves
+    # @param alpha, beta: window of the searches
+    # @return: scores of the moves searched in worker processes
+    def _parallel_scores(self, moves, depth, alpha, beta):
+        pool = self._worker_pool()
+        fen = self.board.fen()
+        seconds = (self.deadline - time.perf_counter()
+                   if self.deadline != math.inf else None)
+        max_nodes = (self.node_limit - self.nodes
+                     if self.node_limit != math.inf else None)
+        results = pool.map(search_move_task,
+                           [(type(self.board), fen, move, depth, alpha, beta,
+                             seconds, max_nodes) for move in moves])
+        self.nodes += sum(nodes for _, nodes in results)
+        if any(score is None for score, _ in results):
+            raise SearchAbortedException("search budget exhausted")
+        return [score for score, _ in results]
+
+    # Root splitting, see the class comment
+    # @param moves: ordered legal moves of the player to move
+    # @return: best move and its score for the player to move
+    def _search_root_parallel(self, depth, moves):
+        board = self.board
+        best_move = moves[0]
+        board.make_move(best_move)
+        alpha = -self._search(depth - 1, -math.inf, math.inf, 1)
+        board.unmake_move()
+        others = moves[1:]
+        if others:
+            scores = self._parallel_scores(others, depth, alpha, alpha + 1)
+            fail_high = [move for move, score in zip(others, scores)
+                         if score > alpha]
+            if fail_high:
+                scores = self._parallel_scores(fail_high, depth, alpha,
+                                               math.inf)
+                for move, score in zip(fail_high, scores):
+                    if score > alpha:
+                        alpha = score
+                        best_move = move
+        if self.table is not None:
+            self.table.store(board.key, depth, score_to_table(alpha, 0),
+                             EXACT, best_move)
+        return best_move, alpha
+
+    # @return: legal moves of the root ordered by the table and last search
+    def _root_moves(self):
+        table_move = None
+        if self.table is not None:
+            entry = self.table.probe(self.board.key)
+            table_move = entry[4] if entry is not None else None
+        return self._order_moves(self.board.generate_legal_moves(), 0,
+                                 table_move)
+
+    def _new_search(self):
+        self.nodes = 1
+        self.killers = []
+        self.completed_depth = 0
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.iterations = []
+        if self.table is not None:
+            self.table.new_search()
+
+    # @param depth: depth of search, at least 1
+    # @return: best move and its score for the player to move
+    def search(self, depth):
+        self._new_search()
+        moves = self._root_moves()
+        if self.threads > 1 and moves:
+            best_move, self.score = self._search_root_parallel(depth, moves)
+        else:
+            best_move, self.score = self._search_root(depth, moves)
+        self.completed_depth = depth
+        return best_move, self.score
+
+    # Searches at depth 1, 2, ... until a budget runs out. An unfinished
+    # iteration is dropped and the board restored.
+    # @param depth: maximal depth or None
+    # @param movetime: time budget in milliseconds or None
+    # @param max_nodes: node budget or None
+    # @return: best move and score of the last completed iteration. If not
+    #          even depth 1 completed, the first ordered move and None.
+    def iterative_search(self, depth = None, movetime = None, max_nodes = None):
+        board = self.board
+        self._new_search()
+        self.deadline = (time.perf_counter() + movetime / 1000
+                         if movetime is not None else math.inf)
+        self.node_limit = max_nodes if max_nodes is not None else math.inf
+        root_records = board.record_count
+        moves = self._root_moves()
+        if not moves:
+            return None, None
+        best_move, self.score = moves[0], None
+        search_root = (self._search_root_parallel if self.threads > 1
+                       else self._search_root)
+        start = time.perf_counter()
+        try:
+            for iteration in range(1, (depth or MAX_DEPTH) + 1):
+                nodes = self.nodes
+                best_move, self.score = search_root(iteration, moves)
+                self.completed_depth = iteration
+                self.iterations.append((iteration, self.nodes - nodes,
+                                        time.perf_counter() - start))
+                if self.on_iteration is not None:
+                    self.on_iteration(self)
+                # The best move is searched first in the next iteration
+                moves.remove(best_move)
+                moves.insert(0, best_move)
+        except SearchAbortedException:
+            while board.record_count > root_records:
+                board.unmake_move()
+        finally:
+            self.deadline = math.inf
+            self.node_limit = math.inf
+        return best_move, self.score
+
+    # @param length: maximal number of moves
+    # @return: best line of the position, following the moves stored in the
+    #          table
+    def principal_variation(self, length):
+        board = self.board
+        line = []
+        keys = set()
+        while self.table is not None and len(line) < length:
+            entry = self.table.probe(board.key)
+            if (entry is None or entry[4] is None or board.key in keys or
+                entry[4] not in board.generate_legal_moves()
+            ):
+                break
+            keys.add(board.key)
+            line.append(entry[4])
+            board.make_move(entry[4])
+        for _ in line:
+            board.unmake_move()
+        return line
+
+    # Searches the position after the reply predicted by the table, or the
+    # opponent's position when there is no prediction, until interrupted.
+    # Its entries in the shared table speed up the next search, and its
+    # move is played as is if the prediction was right and it reached the
+    # depth of a move.
+    def _ponder(self, board):
+        if self.table is None:
+            return
+        # Created quiet, redirecting stdout here would swallow the output
+        # of the main thread
+        if self.ponder_searcher is None:
+            self.ponder_searcher = NegaMax(
+                None, not self.is_white, self.heuristic,
+                quiescence = self.quiescence, null_move = self.null_move,
+                lmr = self.lmr, futility = self.futility, quiet = True)
+        searcher = self.ponder_searcher
+        searcher.table = self.table
+        searcher.tablebase = self.tablebase
+        entry = self.table.probe(board.key)
+        if entry is not None and entry[4] in board.generate_legal_moves():
+            board.make_move(entry[4])
+        searcher.board = board
+        self.ponder_key = board.key
+        self.ponder_result = None
+        if self.pondering:
+            self.ponder_result = searcher.iterative_search()
+
+    def _interrupt_ponder(self):
+        if self.ponder_searcher is not None:
+            self.ponder_searcher.node_limit = 0
+
+    # @return: move of the background search if it searched the position
+    #          to the depth of a move, else None
+    def _ponder_move(self):
+        searcher = self.ponder_searcher
+        if (self.ponder_result is None or self.ponder_key != self.board.key or
+            self.depth is None or searcher.completed_depth < self.depth
+        ):
+            return None
+        print("ponder hit, depth:", searcher.completed_depth)
+        self.move_source = "ponder"
+        move, self.score = self.ponder_result
+        self.nodes = searcher.nodes
+        self.completed_depth = searcher.completed_depth
+        self.cutoffs = searcher.cutoffs
+        self.first_move_cutoffs = searcher.first_move_cutoffs
+        self.iterations = searcher.iterations
+        self.ponder_result = None
+        return move
+
+    def _select_move(self):
+        move = (self._book_move() or self._tablebase_move() or
+                self._ponder_move())
+        if move is not None:
+            return move
+        print("calculating move...")
+        return self.iterative_search(self.depth, self.movetime,
+                                     self.max_nodes)[0]
+
+    def _fill_stats(self, stats):
+        stats.nodes = self.nodes
+        stats.depth = self.completed_depth
+        stats.score = self.score
+        stats.cutoffs = self.cutoffs
+        stats.first_move_cutoffs = self.first_move_cutoffs
+        stats.iterations = list(self.iterations)
+
+
+# Playout policies: return a legal move of the player to move or None
+# when there is none
+def random_policy(board, rand):
+    moves = board.generate_legal_moves()
+    return rand.choice(moves) if moves else None
+
+# Plays the capture of the most valuable victim by the least valuable
+# attacker when there is one, else a random move
+def greedy_policy(board, rand):
+    captures = board.generate_legal_moves(captures_only = True)
+    if not captures:
+        return random_policy(board, rand)
+    best_value, best_moves = None, []
+    for move in captures:
+        origin, target, promotion = move
+        victim = board.piece_type_at(target) or Pawn
+        value = (order_value[victim] * 100 - order_value[board.piece_type_at(origin)]
+                 + (order_value[promotion] * 100 if promotion else 0))
+        if best_value is None or value > best_value:
+            best_value, best_moves = value, [move]
+        elif value == best_value:
+            best_moves.append(move)
+    return rand.choice(best_moves)
+
+PLAYOUT_POLICIES = {"random": random_policy, "greedy": greedy_policy}
+
+
+# @param score: heuristic score for the player to move
+# @return: expected result in [0, 1]
+def score_to_result(score, scale):
+    return 1 / (1 + math.exp(max(-50, min(50, -score / scale))))
+
+
+# Plays moves by policy until the game ends or max_plies were played, then
+# unmakes them. Status is evaluated only when no move is left.
+# @param heuristic: scores positions cut off by max_plies, None for a draw
+# @return: result for the player to move: 1 win, 0 loss, 0.5 draw
+def playout(board, policy, max_plies, heuristic, scale, rand):
+    white_turn = board.white_turn
+    result = None
+    plies = 0
+    while plies < max_plies and board.halfmove_clock < 100:
+        move = policy(board, rand)
+        if move is None:
+            if board.status() == BoardStatus.Checkmate:
+                # The player to move lost
+                result = 0 if board.white_turn == white_turn else 1
+            else:
+                result = 0.5
+            break
+        board.make_move(move)
+        plies += 1
+    if result is None:
+        if heuristic is None or board.halfmove_clock >= 100:
+            result = 0.5
+        else:
+            score = heuristic(board)
+            result = score_to_result(score if white_turn else -score, scale)
+    for _ in range(plies):
+        board.unmake_move()
+    return result
+
+
+# Runs playouts in a worker process
+# @param task: (board type, fen, policy name, playouts, max plies,
+#               heuristic, scale, seed)
+# @return: sum of the results for the player to move
+def playout_batch(task):
+    board_type, fen, policy, playouts, max_plies, heuristic, scale, seed = task
+    board = board_type.from_fen(fen)
+    rand = random.Random(seed)
+    return sum(playout(board, PLAYOUT_POLICIES[policy], max_plies, heuristic,
+                       scale, rand) for _ in range(playouts))
+
+
+class Node:
+    __slots__ = ("move", "parent", "children", "untried", "visits", "wins",
+                 "key")
+
+    # @param move: move that leads to the node from its parent
+    # @param key: Zobrist key of the position
+    def __init__(self, move, parent, key):
+        self.move = move
+        self.parent = parent
+        self.children = []
+        # Legal moves without a child yet, None until the node is expanded
+        self.untried = None
+        self.visits = 0
+        # Results of the player who made the move
+        self.wins = 0.0
+        self.key = key
+
+
+# Monte Carlo tree search with UCT selection. Each iteration selects a leaf,
+# adds one child and scores it with a batch of playouts, which run in a
+# process pool when workers > 1. The subtree of the position reached after
+# the opponent's reply is reused on the next move.
 class MonteCarlo(BaseAI):
-    pass
+    # Pawns that make a result of 1 / (1 + e^-1)
+    score_scale = 2
+
+    # @param heuristic: scores playouts cut off by playout_plies, None for
+    #                   a draw
+    # @param playouts: playout budget of a move, None for no limit
+    # @param movetime: time budget of a move in milliseconds or None
+    # @param policy: playout policy, "random" or "greedy"
+    # @param playout_plies: maximal length of a playout
+    # @param exploration: UCT exploration constant
+    # @param workers: number of processes running playouts
+    # @param batch: playouts per iteration (default: workers)
+    def __init__(self, board, is_white, heuristic = None, playouts = 1000,
+                 movetime = None, policy = "random", playout_plies = 40,
+                 exploration = math.sqrt(2), workers = 1, batch = None):
+        super().__init__(board, is_white, "monte carlo player")
+        if policy not in PLAYOUT_POLICIES:
+            raise ValueError(f"unknown playout policy {policy}")
+        self.heuristic = heuristic
+        # score_scale in heuristic units
+        self.scale = self.score_scale * pawn_value(heuristic)
+        self.playouts = playouts
+        self.movetime = movetime
+        self.policy = policy
+        self.playout_plies = playout_plies
+        self.exploration = exploration
+        self.workers = workers
+        self.batch = batch or workers
+        self.rand = random.Random()
+        self.root = None
+        # Playouts of the last search and their rate
+        self.playout_count = 0
+        self.playouts_per_second = 0
+        print("initialize monte carlo player\nplayouts:", playouts,
+              "policy:", policy)
 
+    # @return: root node of the current position, reused from the last
+    #          search if the position was in its tree
+    def _find_root(self):
+        key = self.board.key
+        if self.root is not None:
+            for node in [self.root] + self.root.children:
+                if node.key == key:
+                    node.parent = None
+                    return node
+                for child in node.children:
+                    if child.key == key:
+                        child.parent = None
+                        return child
+        return Node(None, None, key)
 
-class MinMaxMonteCarlo(BaseAI):
-    pass
+    # @return: child of node with the highest UCT value
+    def _select_child(self, node):
+        log_visits = math.log(node.visits)
+        exploration = self.exploration
+        return max(node.children, key=lambda child:
+                   child.wins / child.visits +
+                   exploration * math.sqrt(log_visits / child.visits))
 
-material_value = {Pawn: 1, Knight: 3, Bishop: 3, Rook: 5, Queen: 9, King: 0}
+    # @param count: number of playouts
+    # @return: sum of the results for the player to move
+    def _simulate(self, count):
+        if self.workers <= 1:
+            policy = PLAYOUT_POLICIES[self.policy]
+            return sum(playout(self.board, policy, self.playout_plies,
+                               self.heuristic, self.scale, self.rand)
+                       for _ in range(count))
+        pool = self._get_pool(self.workers)
+        fen = self.board.fen()
+        shares = [count // self.workers + (i < count % self.workers)
+                  for i in range(self.workers)]
+        tasks = [(type(self.board), fen, self.policy, share, self.playout_plies,
+                  self.heuristic, self.scale, self.rand.getrandbits(32))
+                 for share in shares if share]
+        return sum(pool.map(playout_batch, tasks))
+
+    # Selects a leaf, expands it by one move, simulates and backs up
+    # @return: number of playouts run
+    def _iterate(self, root):
+        board = self.board
+        node = root
+        made = 0
+        while node.untried == [] and node.children:
+            node = self._select_child(node)
+            board.make_move(node.move)
+            made += 1
+        if node.untried is None:
+            node.untried = board.generate_legal_moves()
+            self.rand.shuffle(node.untried)
+        if node.untried:
+            move = node.untried.pop()
+            board.make_move(move)
+            made += 1
+            child = Node(move, node, board.key)
+            node.children.append(child)
+            node = child
+        count = self.batch
+        # Results of the player to move at the leaf
+        total = self._simulate(count)
+        for _ in range(made):
+            board.unmake_move()
+        while node is not None:
+            node.visits += count
+            node.wins += count - total
+            total = count - total
+            node = node.parent
+        return count
+
+    # @param playouts: playout budget or None
+    # @param movetime: time budget in milliseconds or None
+    # @return: most visited move of the root or None if there is none
+    def search(self, playouts = None, movetime = None):
+        root = self._find_root()
+        self.root = root
+        start = time.perf_counter()
+        deadline = start + movetime / 1000 if movetime is not None else math.inf
+        limit = playouts if playouts is not None else math.inf
+        count = 0
+        while count < limit and time.perf_counter() < deadline:
+            count += self._iterate(root)
+            if not root.children and root.untried == []:
+                break
+        elapsed = time.perf_counter() - start
+        self.playout_count = count
+        self.playouts_per_second = count / elapsed if elapsed else 0
+        if not root.children:
+            return None
+        return max(root.children, key=lambda child: child.visits).move
+
+    # @return: shallow copy of the player searching board in this process
+    def _copy_for(self, board):
+        player = copy.copy(self)
+        player.board = board
+        player.workers = 1
+        player.pool = None
+        return player
+
+    # Grows the tree of the opponent's position until interrupted, the
+    # subtree of the reply is reused by the next search
+    def _ponder(self, board):
+        searcher = self._copy_for(board)
+        root = searcher._find_root()
+        self.root = root
+        while self.pondering:
+            searcher._iterate(root)
+            if not root.children and root.untried == []:
+                break
+
+    def _select_move(self):
+        move = self._book_move() or self._tablebase_move()
+        if move is not None:
+            return move
+        print("calculating move...")
+        playouts = self.playouts
+        if self.ponder and playouts is not None:
+            # Playouts of the background search count for the move
+            root = self._find_root()
+            self.root = root
+            playouts = max(1, playouts - root.visits)
+        move = self.search(playouts, self.movetime)
+        print(f"playouts: {self.playout_count} "
+              f"playouts/sec: {self.playouts_per_second:.0f}")
+        return move
+
+    # Nodes are playouts, depth is the length of the most visited line, the
+    # score the result expected for the player and the branching factor the
+    # mean number of children of the expanded nodes
+    def _fill_stats(self, stats):
+        stats.nodes = self.playout_count
+        node = self.root
+        while node is not None and node.children:
+            node = max(node.children, key=lambda child: child.visits)
+            stats.depth += 1
+            if stats.score is None:
+                stats.score = node.wins / node.visits
+        expanded = children = 0
+        nodes = [self.root] if self.root is not None else []
+        while nodes:
+            node = nodes.pop()
+            if node.children:
+                expanded += 1
+                children += len(node.children)
+                nodes += node.children
+        if expanded:
+            stats.branching_factor = children / expanded
+
+
+# Monte Carlo tree search that scores leaves with a quiescence search
+# instead of playouts
+class MinMaxMonteCarlo(MonteCarlo):
+    # @param heuristic: scores the quiet positions at the leaves
+    # @param depth: depth of the negamax search at the leaves
+    def __init__(self, board, is_white, heuristic, depth = 0,
+                 playouts = 1000, movetime = None,
+                 exploration = math.sqrt(2)):
+        super().__init__(board, is_white, heuristic, playouts, movetime,
+                         exploration = exploration)
+        self.name = "minmax monte carlo player"
+        self.depth = depth
+        self.searcher = NegaMax(board, is_white, heuristic, depth,
+                                quiet = True)
+
+    def _simulate(self, count):
+        searcher = self.searcher
+        searcher.nodes = 0
+        score = searcher._search(self.depth, -math.inf, math.inf, 0)
+        return count * score_to_result(score, self.scale)
+
+    def _copy_for(self, board):
+        player = super()._copy_for(board)
+        player.searcher = copy.copy(self.searcher)
+        player.searcher.board = board
+        return player
 
 def material_heuristic(board: Board):
     score = 0
-    for piece_type in board.white_pieces:
-        score += len(board.white_pieces[piece_type]) * material_value[piece_type]
-    for piece_type in board.black_pieces:
-            score -= len(board.black_pieces[piece_type]) * material_value[piece_type]
+    for piece_type in board.piece_types:
+        score += (board.piece_count(Colors.White, piece_type) -
+                  board.piece_count(Colors.Black, piece_type)
+                 ) * material_value[piece_type]
     return score
 
+# Centipawns per square a piece attacks
+MOBILITY_WEIGHT = 4
+
+# Piece-square tables tapered between middlegame and endgame (maintained by
+# the board, see evaluation.py) and mobility, in centipawns
+def pst_heuristic(board: Board):
+    return board.psq_score() + MOBILITY_WEIGHT * (
+        board.mobility(Colors.White) - board.mobility(Colors.Black))
+
+# Heuristics by name, for the command line
+HEURISTICS = {"material": material_heuristic, "pst": pst_heuristic}
+# Score of a pawn in the units of each heuristic
+PAWN_VALUES = {material_heuristic: 1, pst_heuristic: 100}
+
+# @return: score of a pawn in the units of heuristic, 1 if unknown
+def pawn_value(heuristic):
+    return PAWN_VALUES.get(heuristic, 1)
+
@@ -157,19 +157,15 @@ class BoardWindow(QtWidgets.QWidget):
         self.computer_player = RandomPlayer(self.board)
 
     def play_ai_move(self):
-        # TODO change so player's class performs move (no while)
-        while True and not self.locked:
-            try:
-                move = self.computer_player.get_ai_move()
-                origin, target, promotion = move
-                game_status = self.board.move_piece(origin, target, promotion)
-            except Exception as e:
-                continue
-            else:
-                self.handle_game_status(game_status)
-                self.set_pieces(self.board.get_state())
-                self.computer_turn = False
-                break
+        # AI players only return legal moves
+        if not self.locked:
+            origin, target, promotion = self.computer_player.get_ai_move()
+            game_status = self.board.move_piece(origin, target, promotion)
+            self.handle_game_status(game_status)
+            self.set_pieces(self.board.get_state())
+            self.computer_turn = False
+            # Search on the human's time, get_ai_move stops it
+            self.computer_player.start_pondering()
 
     # @param coords: a tuple of gui board coordinates
     # @return: coordinates on logic board as Coords.
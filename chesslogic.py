@@ -1,38 +1,65 @@
 from typing import Union
 from definitions import *
+from evaluation import PSQ, PHASE_WEIGHT, tapered_score
 from exceptions import *
-from functools import partial
-from collections import deque
 
 
 # Search "API START" for interface functions
+#
+# Squares are ints 0..63 (r * DIM + c) inside the board, moves are
+# generated from the tables in definitions.py. The API takes and returns
+# Coords.
 
 class Board:
     piece_types = [Pawn, Rook, Knight, Bishop, Queen, King]
     player_colors = { True: Colors.White, False: Colors.Black }
+    # Directions (indices of RAY_SQUARES) of sliding pieces
+    slider_rays = { Rook: STRAIGHT_RAYS, Bishop: DIAGONAL_RAYS, Queen: ALL_RAYS }
 
-    # @param white_turn: Whose turn is it
-    # @param fen_position: a board position in FEN format
+    # @param white_turn: Whose turn is it, unless the position has it
+    # @param position: a board position in FEN format
     def __init__(self, white_turn = True, position = None):
         self.white_turn = white_turn
-        self.passant_pawn = None
-        self.moves_record = deque()
+        self.passant_square = None
+        self.key = 0
+        self.moves_record = [None] * 64
+        self.record_count = 0
         self.game_status = BoardStatus.Normal
+        # Plies since the start of the game and since the last capture or
+        # pawn move (FEN fullmove number and halfmove clock)
         self.moves_counter = 0
+        self.halfmove_clock = 0
 
-        # Store coordinates for each piece type 
+        # Store squares for each piece type
         self.white_pieces = dict((piece, set()) for piece in self.piece_types)
         self.black_pieces = dict((piece, set()) for piece in self.piece_types)
         self.pieces = {Colors.White: self.white_pieces,
                        Colors.Black: self.black_pieces
         }
 
-        # Set board
-        self.board = tuple([tuple([Square(Coords(r, c))
-                            for c in range(DIM)]) for r in range(DIM)]
-        )
+        # Set board, indexed by square
+        self.board = tuple([Square(coords) for coords in SQUARE_COORDS])
+        # Number of pieces of each color threatening each square
+        self.threat_counts = {Colors.White: [0] * (DIM * DIM),
+                              Colors.Black: [0] * (DIM * DIM)
+        }
+        # Piece-square score of the pieces (white minus black, packed as in
+        # evaluation.pack_score) and game phase
+        self.psq = 0
+        self.phase = 0
         self.start_position = position if position else START_POSITION
-        self._set_pieces(self.start_position)
+        self.set_fen(self.start_position, white_turn)
+
+    @classmethod
+    def from_fen(cls, fen):
+        return cls(position=fen)
+
+    # @return: coordinates of a pawn that may be captured en passant or None
+    @property
+    def passant_pawn(self):
+        if self.passant_square is None:
+            return None
+        return SQUARE_COORDS[self.passant_square]
 
     def __str__(self):
         cols = "abcdefgh"
@@ -41,100 +68,139 @@ class Board:
         for c in cols:
             output_str += c + "  "
         output_str += "\n"
-        
-        for row, row_num in zip(self.board[::-1], rows[::-1]):
+
+        for r, row_num in zip(range(DIM_ZERO, -1, -1), rows[::-1]):
+            row = self.board[r * DIM:(r + 1) * DIM]
             output_str += row_num + " "
             row_str = "|" + "|".join([str(square) for square in row]) + "|\n"
             output_str += row_str
         return output_str
 
     def _clear_board(self):
-        for row in self.board:
-            for square in row:
-                piece = square.piece
-                coords = square.coords
-                if piece:
-                    self.pieces[piece.color][type(piece)].remove(coords)
-                    square.piece = None
+        for sq, square in enumerate(self.board):
+            piece = square.piece
+            if piece:
+                self.pieces[piece.color][type(piece)].remove(sq)
+                square.piece = None
 
-    def _set_piece(self, coords, piece):
-        self.board[coords[0]][coords[1]].piece = piece
-        self.pieces[piece.color][type(piece)].add(coords)
+    def _set_piece(self, sq, piece):
+        self.board[sq].piece = piece
+        self.pieces[piece.color][type(piece)].add(sq)
 
-    # TODO process a complete FEN record
-    # @param board_str: A FEN-format piece placement string (first field only)
-    def _set_pieces(self, board_str):
+    # @param squares: 64 piece characters indexed r * DIM + c ('.' empty)
+    def _set_pieces(self, squares):
         self._clear_board()
-        # Black ranks first
-        position = [DIM_ZERO, 0]
-        char_to_piece = {
-            "P": Pawn,
-            "R": Rook,
-            "N": Knight,
-            "B": Bishop,
-            "Q": Queen,
-            "K": King
-        }
-        for c in board_str:
-            # Create piece and place on board
-            if c.upper() in char_to_piece:
+        for sq, c in enumerate(squares):
+            if c != ".":
                 color = Colors.White if c.isupper() else Colors.Black
-                piece = char_to_piece[c.upper()](color)
-                coords = Coords(position[0], position[1])
-
-                self._set_piece(coords, piece)
-                position[1] = (position[1] + 1) % DIM
-            # Skip empty squares in rank
-            if c in "12345678":
-                empty_squares = int(c)
-                position[1] = (position[1] + empty_squares) % DIM
-            # Next rank
-            if c == "/":
-                position[0] -= 1
-            # In order to be able to read a full FEN record - change later
-            if c ==" ":
-                break
-
-    def _get_square(self, coords) -> Square:
-        return self.board[coords[0]][coords[1]]
-    
-    def _get_piece(self, coords):
-        return self.board[coords[0]][coords[1]].piece        
-
-    # @param coords: The target coordinate where eating could occur
+                piece = CHAR_PIECE[c.upper()](color)
+                self._set_piece(sq, piece)
+
+    # @param castling: castling rights bits in ZOBRIST_CASTLING order.
+    #                  Rooks without castling rights are marked as moved.
+    def _set_castling(self, castling):
+        for i, (row, color) in enumerate(((0, Colors.White),
+                                          (DIM_ZERO, Colors.Black))):
+            for j, rook_column in enumerate((DIM_ZERO, 0)):
+                rook = self._get_piece(row * DIM + rook_column)
+                if (isinstance(rook, Rook) and rook.color == color and
+                    not castling >> (2 * i + j) & 1
+                ):
+                    rook.moves_counter = 1
+
+    # Loads a FEN record into the board and clears the moves record
+    # @param fen: FEN record. Without castling field kings and rooks on
+    #             their home squares may castle.
+    # @param white_turn: Whose turn is it if the record has no side to move
+    def set_fen(self, fen, white_turn = True):
+        (squares, fen_white_turn, castling, passant,
+         halfmove, fullmove) = parse_fen(fen)
+        self._set_pieces(squares)
+        if fen_white_turn is not None:
+            white_turn = fen_white_turn
+        self.white_turn = white_turn
+        if castling is not None:
+            self._set_castling(castling)
+        self.passant_square = None
+        if passant:
+            pawn_sq = square_index(passant) + (-DIM if white_turn else DIM)
+            pawn = self._get_piece(pawn_sq) if 0 <= pawn_sq < DIM * DIM else None
+            if isinstance(pawn, Pawn) and pawn.color != self.player_colors[white_turn]:
+                self.passant_square = pawn_sq
+        self.halfmove_clock = halfmove
+        self.moves_counter = 2 * (fullmove - 1) + (0 if white_turn else 1)
+        self.moves_record = [None] * 64
+        self.record_count = 0
+        self.game_status = None
+        self._init_threats()
+        self.key = self._compute_key()
+        self.psq, self.phase = self._compute_psq()
+
+    # @return: FEN record of the position
+    def fen(self):
+        squares = []
+        for square in self.board:
+            piece = square.piece
+            if not piece:
+                squares.append(".")
+            elif piece.color == Colors.White:
+                squares.append(piece.text)
+            else:
+                squares.append(piece.text.lower())
+        passant = None
+        if self.passant_square is not None:
+            pawn = self._get_piece(self.passant_square)
+            passant = SQUARE_COORDS[self.passant_square -
+                                    DIM * self._pawn_direction(pawn.color)]
+        return make_fen("".join(squares), self.white_turn,
+                        self._castling_rights(), passant,
+                        self.halfmove_clock, self.moves_counter // 2 + 1)
+
+    def _get_square(self, sq) -> Square:
+        return self.board[sq]
+
+    def _get_piece(self, sq):
+        return self.board[sq].piece
+
+    # @param sq: The target square where eating could occur
     # @param attacker_color: The color of the attack piece
     # @return: True if there is a piece that can be eaten on the square.
-    def _eatable(self, coords, attacker_color):
-        piece = self._get_piece(coords)
+    def _eatable(self, sq, attacker_color):
+        piece = self.board[sq].piece
         if not piece or piece.color == attacker_color:
             return False
         return True
 
-    # @param coords: coordinates of straight lines piece (Q, B, R)
+    # @param sq: square of straight lines piece (Q, B, R)
     # @param color: color of piece
-    # @param directions: list of direction tuples [(-1,1),...] based on piece
-    # @return: set of legal moves and all squares threatened by piece
-    def _linear_moves(self, directions, coords, color):
-        moves = set()           # Possible moves
-        threatens = set()       # Squares threatened by piece
-        for direction in directions:
-            for i in range(1, DIM):
-                new_coords = Coords(coords[0] + direction[0] * i,
-                                    coords[1] + direction[1] * i)               
-                if not on_board(new_coords):
-                    break         
+    # @param rays: directions of the piece, indices of RAY_SQUARES
+    # @return: list of legal moves
+    def _linear_moves(self, rays, sq, color):
+        moves = []
+        board = self.board
+        for ray in rays:
+            for target in RAY_SQUARES[ray][sq]:
+                piece = board[target].piece
                 # Check if not empty
-                piece = self._get_piece(new_coords)
                 if piece:
                     # Check if there's piece that can be eaten
-                    if self._eatable(new_coords, color):
-                        moves.add((new_coords, None))
-                    threatens.add(new_coords)
+                    if piece.color != color:
+                        moves.append((target, None))
                     break
-                else:
-                    moves.add((new_coords, None))
-                    threatens.add(new_coords)
-        return moves, threatens
+                moves.append((target, None))
+        return moves
+
+    # @return: list of squares threatened by a straight lines piece
+    #          (includes same color or empty)
+    def _linear_threats(self, rays, sq):
+        threatens = []
+        board = self.board
+        for ray in rays:
+            for target in RAY_SQUARES[ray][sq]:
+                threatens.append(target)
+                if board[target].piece:
+                    break
+        return threatens
 
     def final_row(self, row, color: Colors):
         return ((color == Colors.White and row == DIM_ZERO) or
@@ -144,216 +210,309 @@ class Board:
     def _pawn_direction(self, color):
         return 1 if color == Colors.White else -1
 
-    # @param coords: coordinates of pawn
+    # @param sq: square of pawn
     # @param color: color of pawn
-    # @return: set of legal moves pawn can make, and squares threatened by it
-    #          does not include en passant
-    def _pawn_moves(self, coords, color):
-        vertical = self._pawn_direction(color)
-        moves, threatens = set(), set()
-        
-        promote = self.final_row(coords.r + 1 * vertical, color)
+    # @return: list of legal moves pawn can make, does not include en passant
+    def _pawn_moves(self, sq, color):
+        moves = []
+        board = self.board
+        promotions = [None]
+        if self.final_row(sq // DIM + self._pawn_direction(color), color):
+            promotions = PROMOTE
+
         # Forward movement
-        steps = 1
-        if ((coords.r == 1 and color == Colors.White) or
-            (coords.r == DIM_ZERO - 1 and color == Colors.Black)):
-           steps = 2
-        for i in range(1, steps + 1):
-            new_coords = Coords((coords.r + i * vertical), coords.c)
-            if not on_board(new_coords) or self._get_piece(new_coords):
+        for target in PAWN_PUSHES[color][sq]:
+            if board[target].piece:
                 break
-            if promote:
-                for promote_type in PROMOTE:
-                    moves.add((new_coords, promote_type))
-            else:
-                moves.add((new_coords, None))
+            for promote_type in promotions:
+                moves.append((target, promote_type))
 
         # Pawn attack moves (except en passant)
-        horizontal_directions = [-1, 1]
-        for horizontal_direction in horizontal_directions:
-            new_coords = Coords((coords.r + 1 * vertical),
-                    (coords.c + horizontal_direction))
-            if on_board(new_coords):
-                if self._eatable(new_coords, color):
-                    if promote:
-                        for promote_type in PROMOTE:
-                            moves.add((new_coords, promote_type))
-                    else:
-                        moves.add((new_coords, None))
-                threatens.add(new_coords)
-        return moves, threatens
+        for target in PAWN_CAPTURES[color][sq]:
+            if self._eatable(target, color):
+                for promote_type in promotions:
+                    moves.append((target, promote_type))
+        return moves
 
     def _king_moves(self, origin, color):
-        directions = ALL_DIRECTIONS
-        moves, threatens = set(), set()
-        for dir in directions:
-            new_coords = Coords(origin[0] + dir[0], origin[1] + dir[1])
-            if not on_board(new_coords):
-                continue
-            threatens.add(new_coords)
-            target_piece = self._get_piece(new_coords)
+        moves = []
+        board = self.board
+        for target in KING_TARGETS[origin]:
+            target_piece = board[target].piece
             if not target_piece or target_piece.color != color:
-                moves.add((new_coords, None))
-        
-        # Check if castling physically could be possible.
+                moves.append((target, None))
+
+        # Check if castling physically could be possible: unmoved king and
+        # rook and empty squares between them.
         # Does not check if king threatened.
-        # TODO refactor (separate to functions)
-        piece = self._get_piece(origin)
-        if piece.moves_counter == 0:
-            king_dirs, r_positions = (-1, 1), (0, DIM_ZERO)
-            for king_dir, rook_pos in zip(king_dirs, r_positions):
-                castle_allowed = True
-                for i in range(1,3):
-                    new_coords = Coords(origin[0], origin[1] + i * king_dir)
-                    target_piece = self._get_piece(new_coords)
-                    if target_piece:
-                        castle_allowed = False
-                # Check square next to rook
-                rook_coords = Coords(origin.r, rook_pos)
-                rook = self._get_piece(rook_coords)
-                if isinstance(rook, Rook) and rook.moves_counter == 0:
-                    next_to_rook = Coords(origin[0], rook_pos + king_dir * (-1))
-                    if self._get_piece(next_to_rook):
-                        castle_allowed = False
-                    if castle_allowed:
-                        # Calculate target square of king
-                        target = Coords(origin[0], origin[1] + 2 * king_dir)
-                        moves.add((target, None))
-        return moves, threatens
-
-    # @param origin: starting coordinates of knight
+        home = 4 if color == Colors.White else DIM_ZERO * DIM + 4
+        if board[origin].piece.moves_counter == 0 and origin == home:
+            for king_dir, rook_sq in ((-1, origin - 4), (1, origin + 3)):
+                rook = board[rook_sq].piece
+                if not isinstance(rook, Rook) or rook.moves_counter > 0:
+                    continue
+                if all(not board[sq].piece
+                       for sq in SQUARES_BETWEEN[origin][rook_sq]):
+                    moves.append((origin + 2 * king_dir, None))
+        return moves
+
+    # @param origin: starting square of knight
     # @param color: color of knight
-    # @return: moves list and squares threatened
+    # @return: moves list
     def _knight_moves(self, origin, color):
-        moves = set()
-        threatens = set()
-        for dr, dc in KNIGHT:
-            target = Coords(origin[0] + dr, origin[1] + dc)
-            if on_board(target):
-                threatens.add(target)
-                if (
-                    not self._get_piece(target) or
-                    self._get_piece(target).color != color
-                ):
-                    moves.add((target, None))
-        return moves, threatens
-
-    # @param coords: coordinates of a square with a piece on it
-    # Updates following sets in a piece:
-    #   moves: set of potential moves
-    #   threatens: set of squares threatened (includes same color or empty)
-    def _update_moves(self, coords):
-        # Dictionary of functions that return the two sets
-        piece_functions = {
-            Pawn: self._pawn_moves,
-            Knight: self._knight_moves,
-            Rook: partial(self._linear_moves, HORIZONTAL_VERTICAL),
-            Bishop: partial(self._linear_moves, DIAGONAL),
-            Queen: partial(self._linear_moves, ALL_DIRECTIONS),
-            King: self._king_moves
-        }
-        piece = self._get_piece(coords)
-        piece_function = piece_functions[type(piece)]
-        piece.moves, piece.threatens = piece_function(coords, piece.color)
-
-    # Update moves and threatens of all pieces of a certain color
-    def _update_all_moves(self, color):
-        pieces = self.pieces[color]
-        for piece_type in pieces:
-            for coords in pieces[piece_type]:
-                self._update_moves(coords)
-
-    def _coords_under_threat(self, player_color: Colors, coords: Coords):
-        enemy_color = player_color.other_color()
-        for row in self.board:
-            for sq in row:
-                enemy_piece = sq.piece
-                if enemy_piece and enemy_piece.color == enemy_color:
-                    self._update_moves(sq.coords)
-                    if coords in enemy_piece.threatens:
-                        return True
-        return False
-               
-    def _find_king_coords(self, king_color: Colors):
-        for r in range(DIM):
-            for c in range(DIM):
-                piece = self._get_piece(Coords(r, c))
-                if isinstance(piece, King) and piece.color == king_color:
-                    return Coords(r, c)
+        moves = []
+        board = self.board
+        for target in KNIGHT_TARGETS[origin]:
+            target_piece = board[target].piece
+            if not target_piece or target_piece.color != color:
+                moves.append((target, None))
+        return moves
+
+    # @param sq: square with a piece on it
+    # @return: list of potential (target, promotion) moves of the piece
+    def _piece_moves(self, sq):
+        piece = self.board[sq].piece
+        piece_type = type(piece)
+        if piece_type is Pawn:
+            return self._pawn_moves(sq, piece.color)
+        if piece_type is Knight:
+            return self._knight_moves(sq, piece.color)
+        if piece_type is King:
+            return self._king_moves(sq, piece.color)
+        return self._linear_moves(self.slider_rays[piece_type], sq, piece.color)
+
+    # @param sq: square with a piece on it
+    # @return: squares threatened by the piece (includes same color or empty)
+    def _piece_threats(self, sq, piece):
+        piece_type = type(piece)
+        if piece_type is Pawn:
+            return PAWN_CAPTURES[piece.color][sq]
+        if piece_type is Knight:
+            return KNIGHT_TARGETS[sq]
+        if piece_type is King:
+            return KING_TARGETS[sq]
+        return self._linear_threats(self.slider_rays[piece_type], sq)
+
+    # Threat counts are kept up to date by _move_no_checks and _revert.
+    # Only sliding pieces depend on other squares, so a move only
+    # recalculates the pieces on the changed squares and the sliding pieces
+    # threatening one of them.
+
+    def _init_threats(self):
+        for color in self.threat_counts:
+            self.threat_counts[color][:] = [0] * (DIM * DIM)
+        for color in self.pieces:
+            for squares in self.pieces[color].values():
+                for sq in squares:
+                    self._count_threats(sq, 1)
+
+    # @param sq: square of a piece
+    # @param delta: 1 to add the threats of the piece, -1 to remove them
+    def _count_threats(self, sq, delta):
+        piece = self.board[sq].piece
+        counts = self.threat_counts[piece.color]
+        for target in self._piece_threats(sq, piece):
+            counts[target] += delta
+
+    # @param changed: set of squares about to change
+    # @return: squares of pieces whose threats depend on changed squares.
+    #          Their threats are removed from the counts.
+    def _lift_threats(self, changed):
+        affected = set()
+        board = self.board
+        slider_rays = self.slider_rays
+        for sq in changed:
+            if board[sq].piece:
+                affected.add(sq)
+            # Sliding pieces seeing the square
+            for ray in ALL_RAYS:
+                for target in RAY_SQUARES[ray][sq]:
+                    piece = board[target].piece
+                    if piece:
+                        if (type(piece) in slider_rays and
+                            ray in slider_rays[type(piece)]
+                        ):
+                            affected.add(target)
+                        break
+        for sq in affected:
+            self._count_threats(sq, -1)
+        return affected
+
+    # @param affected: result of _lift_threats before the change
+    # @param changed: the changed squares
+    def _restore_threats(self, affected, changed):
+        for sq in affected | changed:
+            if self.board[sq].piece:
+                self._count_threats(sq, 1)
+
+    def _square_under_threat(self, player_color: Colors, sq):
+        return self.threat_counts[player_color.other_color()][sq] > 0
+
+    def _find_king_square(self, king_color: Colors):
+        for sq in self.pieces[king_color][King]:
+            return sq
         raise NoKingError(f"No {king_color} king on board - cannot continue")
 
     def _check_en_passant(self, origin, target):
+        if self.passant_square is None:
+            return False
         origin_piece = self._get_piece(origin)
-        target_piece = self._get_piece(target)
-        forward = 1 if origin_piece.color == Colors.White else -1
-        if self.passant_pawn:
-            if (
-                origin[0] == self.passant_pawn[0] and
-                origin[0] + forward == target[0] and
-                target[1] == self.passant_pawn[1] and
-                abs(target[1] - origin[1]) == 1 and
-                isinstance(origin_piece, Pawn) and
-                not target_piece
-            ):
-                return True
-        return False
+        forward = DIM * self._pawn_direction(origin_piece.color)
+        return (isinstance(origin_piece, Pawn) and
+                not self._get_piece(target) and
+                target == self.passant_square + forward and
+                abs(origin - self.passant_square) == 1 and
+                origin // DIM == self.passant_square // DIM
+        )
 
-    def _save_coords(self, coords, piece):
+    def _save_square(self, sq, piece):
         if piece:
-            coords_list = self.pieces[piece.color][type(piece)]
-            coords_list.add(coords)
+            self.pieces[piece.color][type(piece)].add(sq)
 
-    def _remove_coords(self, coords, piece):
+    def _remove_square(self, sq, piece):
         if piece:
             try:
-                coords_list = self.pieces[piece.color][type(piece)]
-                coords_list.remove(coords)
+                self.pieces[piece.color][type(piece)].remove(sq)
             # TODO change back to ValueError?
             except Exception as e:
-                print("attempt to remove coords not in pieces", coords, piece)
+                print("attempt to remove square not in pieces", sq, piece)
                 print(type(e).__name__, e)
 
 
-    # @param move: List of origin, target tuples of Coords.
+    # Zobrist key of the position. Pieces are updated as they move, castling
+    # rights and en passant are xored out before a move and in after it.
+
+    def _piece_key(self, sq, piece):
+        if not piece:
+            return 0
+        return ZOBRIST_PIECES[(piece.color, type(piece))][sq]
+
+    # @return: piece-square score and phase of the pieces
+    def _compute_psq(self):
+        psq = phase = 0
+        for sq, square in enumerate(self.board):
+            piece = square.piece
+            if piece:
+                psq += PSQ[(piece.color, type(piece))][sq]
+                phase += PHASE_WEIGHT[type(piece)]
+        return psq, phase
+
+    # @return: castling rights bits in ZOBRIST_CASTLING order
+    def _castling_rights(self):
+        rights = 0
+        for i, (row, color) in enumerate(((0, Colors.White),
+                                          (DIM_ZERO, Colors.Black))):
+            king = self._get_piece(row * DIM + 4)
+            if (not isinstance(king, King) or king.color != color or
+                king.moves_counter > 0
+            ):
+                continue
+            for j, rook_column in enumerate((DIM_ZERO, 0)):
+                rook = self._get_piece(row * DIM + rook_column)
+                if (isinstance(rook, Rook) and rook.color == color and
+                    rook.moves_counter == 0
+                ):
+                    rights |= 1 << (2 * i + j)
+        return rights
+
+    # @return: key of en passant file if a pawn can capture en passant
+    def _passant_key(self):
+        if self.passant_square is None:
+            return 0
+        sq = self.passant_square
+        color = self._get_piece(sq).color
+        c = sq % DIM
+        for dc in (-1, 1):
+            if 0 <= c + dc < DIM:
+                piece = self._get_piece(sq + dc)
+                if isinstance(piece, Pawn) and piece.color != color:
+                    return ZOBRIST_PASSANT[c]
+        return 0
+
+    def _compute_key(self):
+        key = ZOBRIST_WHITE_TURN if self.white_turn else 0
+        for sq, square in enumerate(self.board):
+            key ^= self._piece_key(sq, square.piece)
+        return key ^ zobrist_castling(self._castling_rights()) ^ self._passant_key()
+
+    # Undo records are flat tuples on a preallocated stack:
+    #   (passant_square, key, halfmove_clock, psq, phase,
+    #    origin, moved piece, target, captured piece, ...)
+    # with one origin, piece, target, piece group per move step. The
+    # piece objects themselves are kept, so revert allocates nothing.
+
+    def _push_record(self, record):
+        if self.record_count == len(self.moves_record):
+            self.moves_record.extend([None] * len(self.moves_record))
+        self.moves_record[self.record_count] = record
+        self.record_count += 1
+
+    def _pop_record(self):
+        if self.record_count == 0:
+            raise RevertException("cannot revert start position")
+        self.record_count -= 1
+        record = self.moves_record[self.record_count]
+        self.moves_record[self.record_count] = None
+        return record
+
+    # @param move: List of origin, target tuples of squares.
     #              (origin, None) for an en passant victim pawn.
     # @return: None. Performs move on board and updates the moves record
     def _move_no_checks(self, move, promote_type = None):
         move_steps = move
-        move_record = (self.passant_pawn, [])
+        move_record = [self.passant_square, self.key, self.halfmove_clock,
+                       self.psq, self.phase]
+        self.halfmove_clock += 1
+        changed = set(sq for step in move_steps for sq in step if sq is not None)
+        affected = self._lift_threats(changed)
+        key = (self.key ^ zobrist_castling(self._castling_rights()) ^
+               self._passant_key())
+        psq = self.psq
         for step in move_steps:
             origin, target = step
-            if target:
-                origin_square = self._get_square(origin)
-                move_record[1].append(Record(origin, origin_square.piece))
-                self._remove_coords(origin, origin_square.piece)
-                
-                target_square = self._get_square(target)
-                move_record[1].append(Record(target, target_square.piece))
-                self._remove_coords(target, target_square.piece)
-
+            origin_square = self.board[origin]
+            piece = origin_square.piece
+            self._remove_square(origin, piece)
+            key ^= self._piece_key(origin, piece)
+            psq -= PSQ[(piece.color, type(piece))][origin]
+            origin_square.piece = None
+            if target is not None:
+                target_square = self.board[target]
+                captured = target_square.piece
+                if captured or isinstance(piece, Pawn):
+                    self.halfmove_clock = 0
+                self._remove_square(target, captured)
+                key ^= self._piece_key(target, captured)
+                if captured:
+                    psq -= PSQ[(captured.color, type(captured))][target]
+                    self.phase -= PHASE_WEIGHT[type(captured)]
+
+                piece.moves_counter += 1
                 if promote_type == None:
-                    target_square.piece = origin_square.piece
-                    target_square.piece.moves_counter += 1
+                    target_square.piece = piece
                 else:
-                    target_square.piece = promote_type(origin_square.piece.color)
-                self._save_coords(target, target_square.piece)
-                origin_square.piece = None
+                    target_square.piece = promote_type(piece.color)
+                    self.phase += PHASE_WEIGHT[promote_type]
+                self._save_square(target, target_square.piece)
+                key ^= self._piece_key(target, target_square.piece)
+                psq += PSQ[(piece.color, type(target_square.piece))][target]
+                move_record += (origin, piece, target, captured)
             else:
                 # This is the en passant victim pawn
-                origin_square = self._get_square(origin)
-                move_record[1].append(Record(origin, origin_square.piece))
-                self._remove_coords(origin, origin_square.piece)
-                origin_square.piece = None
-        self.moves_record.append(move_record)
+                move_record += (origin, piece, None, None)
+        self.psq = psq
+        # If pawn double-traveled en passant may be possible next move
+        self.passant_square = self._pawn_two_squares(*move_steps[0])
+        self._restore_threats(affected, changed)
+        self.key = (key ^ zobrist_castling(self._castling_rights()) ^
+                    self._passant_key() ^ ZOBRIST_WHITE_TURN)
+        self._push_record(tuple(move_record))
 
     def _move_castle(self, origin, target):
-        castling_options = {2: (DIM_ZERO, -2, 1), -2: (0, 3, -1)}
-        column_diff = target.c - origin.c
-        rook_column, rook_delta, king_dir = castling_options[column_diff]
+        king_dir = 1 if target > origin else -1
         king = self._get_piece(origin)
         color = king.color
-        rook_coords = Coords(origin.r, rook_column)
-        rook = self._get_piece(rook_coords)
+        rook = self._get_piece(origin + 3 if king_dir > 0 else origin - 4)
         if (rook.moves_counter > 0 or
             king.moves_counter > 0 or
             rook.color != color
@@ -361,157 +520,295 @@ class Board:
             raise IllegalMoveException("cannot castle")
         # Check king's path for threats
         for i in range(3):
-            new_coords = Coords(origin.r, origin.c + i * king_dir)
-            if self._coords_under_threat(color, new_coords):
+            if self._square_under_threat(color, origin + i * king_dir):
                 raise KingThreatenedException("cannot castle under threat")
 
         # Perform castling
-        rook_target = Coords(rook_coords.r, rook_coords.c + rook_delta)
-        self._move_no_checks([(origin, target), (rook_coords, rook_target)])
+        self._move_no_checks(self._castle_steps(origin, target))
 
-    def _revert(self):
-        if len(self.moves_record) == 0:
-            raise RevertException("cannot revert start position")
-        passant_pawn, prev_move = self.moves_record.pop()
-        self.passant_pawn = passant_pawn
-        for record in prev_move:
-            square = self._get_square(record.coords)
-            self._remove_coords(record.coords, square.piece)
-            if record.piece_type:
-                square.piece = record.piece_type(record.color,
-                                                 record.moves_counter)
-                self._save_coords(record.coords, square.piece)
-            else:
-                square.piece = None
+    # @return: move steps of king and rook for castling
+    def _castle_steps(self, origin, target):
+        king_dir = 1 if target > origin else -1
+        rook_sq = origin + 3 if king_dir > 0 else origin - 4
+        return [(origin, target), (rook_sq, origin + king_dir)]
 
-    # @param origin, target: coordinates of a quasi-legal move
-    # @param passant_victim: coordinates of en passant victim
-    def _perform_move(self, origin, target_tuple, passant_coords = None):
+    def _revert(self):
+        record = self._pop_record()
+        (self.passant_square, self.key, self.halfmove_clock,
+         self.psq, self.phase) = record[:5]
+        changed = set(sq for sq in record[5::2] if sq is not None)
+        affected = self._lift_threats(changed)
+        for i in range(5, len(record), 4):
+            origin, piece, target, captured = record[i:i + 4]
+            if target is not None:
+                target_square = self.board[target]
+                self._remove_square(target, target_square.piece)
+                target_square.piece = captured
+                self._save_square(target, captured)
+                piece.moves_counter -= 1
+            self.board[origin].piece = piece
+            self._save_square(origin, piece)
+        self._restore_threats(affected, changed)
+
+    # @param origin, target: squares of a quasi-legal move
+    # @param passant_square: square of en passant victim
+    def _perform_move(self, origin, target_tuple, passant_square = None):
         target, promote_type = target_tuple
         origin_piece = self._get_piece(origin)
         move = [(origin, target)]
 
         # Castle
-        if isinstance(origin_piece, King) and abs(target[1] - origin[1]) == 2:
+        if isinstance(origin_piece, King) and abs(target - origin) == 2:
             # King safety checked inside
             self._move_castle(origin, target)
         else:
             # En passant
-            if passant_coords:
-                move.append((passant_coords, None))
+            if passant_square is not None:
+                move.append((passant_square, None))
             self._move_no_checks(move, promote_type)
             # Check king safety and revert if needed
-            king_coords = self._find_king_coords(origin_piece.color)
-            if self._coords_under_threat(origin_piece.color, king_coords):
+            king_sq = self._find_king_square(origin_piece.color)
+            if self._square_under_threat(origin_piece.color, king_sq):
                 self._revert()
                 raise KingThreatenedException("king under threat")
 
     def _pawn_two_squares(self, origin, target):
         if isinstance(self._get_piece(target), Pawn):
-            if abs(origin[0] - target[0]) == 2:
+            if abs(origin - target) == 2 * DIM:
                 return target
         return None
 
-    def _check_promotion(self, origin: Coords, target: Coords, piece) -> Union[Coords, None]:
+    def _check_promotion(self, origin, target, piece) -> Union[int, None]:
         # TODO add origin too
         legal_promotion = {
             Colors.White: (DIM_ZERO - 1, DIM_ZERO),
             Colors.Black: (1, 0)
         }
         if isinstance(piece, Pawn):
-            if (origin.r, target.r) == legal_promotion[piece.color]:
+            if (origin // DIM, target // DIM) == legal_promotion[piece.color]:
                 return target
         return None
 
-    def _legal_move_exists(self, color):
-        self._update_all_moves(color)
-        for row in self.board:
-            for square in row:
-                piece = square.piece
-                if piece and piece.color == color:
-                    for move in piece.moves:
-                        try:
-                            self._perform_move(square.coords, move)
-                        except ValueError as e:
-                            continue
-                        else:
-                            # Legal move found - revert it.
-                            self._revert()
-                            return True
-        return False        
-
-    def _check_mate(self, king_color):
-        # TODO write more efficient version:
-            # Check if double threat
-            # Check pinned pieces
-            # Check if any piece can block or eat
-            # Check if king can move
-        return not self._legal_move_exists(king_color)
-
-    # TODO this might be redundant if threats are checked anyway
-    # @param coords: Coordinates of king
+    # @param sq: square of king
     # @param king_color: Color of king
-    # @return: lists of pieces that threaten king
-    #          and pinned pieces with (Coords, Piece) tuples
-    def _check_king_threats(self, coords: Coords, king_color: Colors):
-        piece_dir = {
-            Rook: HORIZONTAL_VERTICAL,
-            Bishop: DIAGONAL,
-            Queen: ALL_DIRECTIONS                    
-        }
-        # Tuples of (coords, piece)
-        pinned_pieces = []
+    # @return: list of (square, Piece) tuples of pieces that threaten king,
+    #          and dictionary of pinned pieces squares to the set of
+    #          squares they may move to without leaving the pin line
+    def _check_king_threats(self, sq, king_color: Colors):
+        board = self.board
+        slider_rays = self.slider_rays
+        enemy_color = king_color.other_color()
+        pinned_pieces = {}
         threats = []
 
         # Check long distance threats and pins
-        for dir in ALL_DIRECTIONS:
+        for ray in ALL_RAYS:
             potential_pin = None
-            for i in range(1, DIM):
-                new_coords = Coords(coords.r + dir[0] * i, coords.c + dir[1])
-                if not on_board(new_coords):
-                    break
-                piece = self._get_piece(new_coords)
-                if piece:
-                    if piece.color == king_color:
-                        potential_pin = (new_coords, piece)
-                    if (piece.color == king_color.other_color() and
-                        type(piece) in piece_dir and
-                        dir in piece_dir[type(piece)]  
-                    ):
-                        if potential_pin:
-                            pinned_pieces.append(potential_pin)
-                        else:
-                            threats.append((new_coords, piece))
+            line = set()
+            for target in RAY_SQUARES[ray][sq]:
+                line.add(target)
+                piece = board[target].piece
+                if not piece:
+                    continue
+                if piece.color == king_color:
+                    if potential_pin is not None:
                         break
+                    potential_pin = target
+                    continue
+                if type(piece) in slider_rays and ray in slider_rays[type(piece)]:
+                    if potential_pin is not None:
+                        pinned_pieces[potential_pin] = line
+                    else:
+                        threats.append((target, piece))
+                break
         # Check knight threats
-        for delta in KNIGHT:
-            new_coords = Coords(coords.r + delta[0], coords.c + delta[1])
-            if on_board(new_coords):
-                piece = self._get_piece(new_coords)
-                if type(piece) is Knight:
-                    threats.append((new_coords, piece))
+        for target in KNIGHT_TARGETS[sq]:
+            piece = board[target].piece
+            if type(piece) is Knight and piece.color == enemy_color:
+                threats.append((target, piece))
         # Check pawn threat
-        direction = 1 if king_color == Colors.White else -1
-        left_right = [-1, 1]
-        for horizontal_dir in left_right:
-            new_coords = (coords.r + direction, coords.c + horizontal_dir)
-            if on_board(new_coords):
-                piece = self._get_piece(new_coords)
-                if (type(piece) is Pawn and
-                    piece.color == king_color.other_color()
-                ):
-                    threats.append((new_coords, piece))
-        
+        for target in PAWN_CAPTURES[king_color][sq]:
+            piece = board[target].piece
+            if type(piece) is Pawn and piece.color == enemy_color:
+                threats.append((target, piece))
+
         return threats, pinned_pieces
 
+    # @param king_sq: square of the king of the moving color
+    # @param vacated: squares emptied by the move
+    # @param filled: squares occupied by the move
+    # @return: True if an enemy sliding piece sees the king after the move
+    def _exposes_king(self, king_sq, color, vacated, filled):
+        board = self.board
+        slider_rays = self.slider_rays
+        for ray in ALL_RAYS:
+            for target in RAY_SQUARES[ray][king_sq]:
+                if target in filled:
+                    break
+                if target in vacated:
+                    continue
+                piece = board[target].piece
+                if piece:
+                    if (piece.color != color and type(piece) in slider_rays and
+                        ray in slider_rays[type(piece)]
+                    ):
+                        return True
+                    break
+        return False
 
-    def _calc_threats(self, color: Colors):
-        pieces = self.pieces[color]
-        for piece_type in pieces:
-            coords_list = pieces[piece_type]
-            for coords in coords_list:
-                piece = self._get_piece(coords)
-                
+    # @param origin: square of king
+    # @param target: castling target of king
+    # @return: True if castling rook is in place and king path not threatened
+    def _castle_allowed(self, origin, target, color):
+        king_dir = 1 if target > origin else -1
+        rook = self._get_piece(origin + 3 if king_dir > 0 else origin - 4)
+        if (not isinstance(rook, Rook) or rook.color != color or
+            rook.moves_counter > 0
+        ):
+            return False
+        for i in range(3):
+            if self._square_under_threat(color, origin + i * king_dir):
+                return False
+        return True
+
+    # @param threats: (square, piece) of the pieces threatening the king
+    # @return: generator of legal (origin, target, promotion) king moves.
+    #          The king may not step back along the line of a threatening
+    #          sliding piece (the square is hidden by the king itself).
+    def _legal_king_moves(self, king_sq, color, threats, captures_only):
+        board = self.board
+        behind_king = set()
+        king_r, king_c = SQUARE_COORDS[king_sq]
+        for threat_sq, piece in threats:
+            if type(piece) in self.slider_rays:
+                threat_r, threat_c = SQUARE_COORDS[threat_sq]
+                dr = (king_r > threat_r) - (king_r < threat_r)
+                dc = (king_c > threat_c) - (king_c < threat_c)
+                behind_king.add((king_r + dr) * DIM + king_c + dc)
+        for target, promotion in self._king_moves(king_sq, color):
+            if captures_only and not board[target].piece:
+                continue
+            if abs(target - king_sq) == 2:
+                if threats or not self._castle_allowed(king_sq, target, color):
+                    continue
+            elif (self._square_under_threat(color, target) or
+                  target in behind_king
+            ):
+                continue
+            yield (king_sq, target, None)
+
+    # @param color: color of player to move
+    # @param captures_only: only captures (en passant too) and promotions
+    # @param piece_type: only moves of this piece type, None for all
+    # @return: generator of legal (origin, target, promotion) square moves.
+    #          Board must not change while iterating.
+    def _legal_moves(self, color, captures_only = False, piece_type = None):
+        board = self.board
+        king_sq = self._find_king_square(color)
+        threats, pinned = self._check_king_threats(king_sq, color)
+
+        if piece_type in (None, King):
+            yield from self._legal_king_moves(king_sq, color, threats,
+                                              captures_only)
+        if len(threats) > 1 or piece_type is King:
+            return
+
+        # Other pieces must capture or block a single threat
+        block = None
+        if threats:
+            threat_sq, piece = threats[0]
+            block = SQUARES_BETWEEN[king_sq][threat_sq] | {threat_sq}
+        for moving_type, squares in self.pieces[color].items():
+            if (moving_type is King or
+                (piece_type is not None and moving_type is not piece_type)
+            ):
+                continue
+            for sq in squares:
+                for target, promotion in self._piece_moves(sq):
+                    if (captures_only and not promotion and
+                        not board[target].piece
+                    ):
+                        continue
+                    if block is not None and target not in block:
+                        continue
+                    if sq in pinned and target not in pinned[sq]:
+                        continue
+                    yield (sq, target, promotion)
+
+        # En passant
+        victim = self.passant_square
+        if victim is not None and piece_type in (None, Pawn):
+            target = victim + DIM * self._pawn_direction(color)
+            for dc in (-1, 1):
+                if not 0 <= victim % DIM + dc < DIM:
+                    continue
+                origin = victim + dc
+                piece = self._get_piece(origin)
+                if not isinstance(piece, Pawn) or piece.color != color:
+                    continue
+                if block is not None and not (target in block or victim in block):
+                    continue
+                if origin in pinned and target not in pinned[origin]:
+                    continue
+                # Both pawns leave the line of the king
+                if self._exposes_king(king_sq, color, {origin, victim},
+                                      {target}):
+                    continue
+                yield (origin, target, None)
+
+    def _legal_move_exists(self, color):
+        for _ in self._legal_moves(color):
+            return True
+        return False
+
+    def _check_mate(self, king_color):
+        return not self._legal_move_exists(king_color)
+
+    # @param move: a legal (origin, target, promotion) square move
+    def _make(self, origin, target, promotion):
+        piece = self._get_piece(origin)
+        if isinstance(piece, King) and abs(target - origin) == 2:
+            self._move_no_checks(self._castle_steps(origin, target))
+        elif (isinstance(piece, Pawn) and (target - origin) % DIM != 0 and
+              not self._get_piece(target)
+        ):
+            self._move_no_checks([(origin, target), (self.passant_square, None)])
+        else:
+            self._move_no_checks([(origin, target)], promotion)
+
+    def _perft(self, depth, color):
+        moves = list(self._legal_moves(color))
+        if depth == 1:
+            return len(moves)
+        nodes = 0
+        other_color = color.other_color()
+        for move in moves:
+            self._make(*move)
+            nodes += self._perft(depth - 1, other_color)
+            self._revert()
+        return nodes
+
+    # @return: piece-square score in centipawns from white's view, tapered
+    #          by game phase. Kept up to date by make/unmake.
+    def psq_score(self):
+        return tapered_score(self.psq, self.phase)
+
+    # @return: number of squares attacked by knights, bishops, rooks and
+    #          queens of color that do not hold own pieces
+    def mobility(self, color):
+        count = 0
+        board = self.board
+        for piece_type in (Knight, Bishop, Rook, Queen):
+            for sq in self.pieces[color][piece_type]:
+                piece = board[sq].piece
+                for target in self._piece_threats(sq, piece):
+                    other = board[target].piece
+                    if not other or other.color != color:
+                        count += 1
+        return count
+
+    def piece_count(self, color, piece_type):
+        return len(self.pieces[color][piece_type])
 
 ########################### API START ###########################
 
@@ -519,10 +816,10 @@ class Board:
     # @return: status of game (check, checkmate, stalemate)
     def update_status(self, color):
         opponent_color = color.other_color()
-        opponent_king = self._find_king_coords(opponent_color)
+        opponent_king = self._find_king_square(opponent_color)
 
         self.game_status = BoardStatus.Normal
-        if self._coords_under_threat(opponent_color, opponent_king):
+        if self._square_under_threat(opponent_color, opponent_king):
             self.game_status = BoardStatus.Check
             if self._check_mate(opponent_color):
                 self.game_status = BoardStatus.Checkmate
@@ -532,24 +829,97 @@ class Board:
             self.game_status = BoardStatus.Stalemate
         return self.game_status
 
+    # @param color: Colors of the king
+    # @return: True if the king is attacked
+    def in_check(self, color):
+        return self._square_under_threat(color, self._find_king_square(color))
+
+    # @return: number of pieces of both colors, kings included
+    def piece_total(self):
+        return (sum(map(len, self.white_pieces.values())) +
+                sum(map(len, self.black_pieces.values())))
+
+    # @return: list of (square, FEN character) of the pieces
+    def piece_squares(self):
+        return [(sq, PIECE_CHAR[piece_type] if color == Colors.White
+                 else PIECE_CHAR[piece_type].lower())
+                for color, pieces in self.pieces.items()
+                for piece_type, squares in pieces.items()
+                for sq in squares]
+
+    # @return: castling rights bits in ZOBRIST_CASTLING order
+    def castling_rights(self):
+        return self._castling_rights()
+
+    # @return: True if the player to move may capture en passant
+    def passant_capture(self):
+        return self._passant_key() != 0
+
     # @return: Board with (color, piece-type) tuples or (None, None)
     def get_state(self):
         board_state = [[] for _ in range(DIM)]
-        for i, row in enumerate(self.board):
-            for square in row:
-                color = square.piece.color if square.piece else None
-                piece_type = type(square.piece) if square.piece else None
-                board_state[i].append(((color, piece_type)))
+        for sq, square in enumerate(self.board):
+            color = square.piece.color if square.piece else None
+            piece_type = type(square.piece) if square.piece else None
+            board_state[sq // DIM].append(((color, piece_type)))
         return board_state
 
+    # @return: type of the piece on coordinates or None
+    def piece_type_at(self, coords):
+        piece = self.board[square_index(coords)].piece
+        return type(piece) if piece else None
+
     def revert_last_move(self):
         try:
             self._revert()
             self.white_turn = not self.white_turn
             self.moves_counter -= 1
+            self.game_status = None
         except Exception as e:
             print(e)
 
+    # Fast move functions for search. Status is not evaluated, call status()
+    # when needed.
+    # @param move: a legal (origin, target, promotion) move from
+    #              generate_legal_moves
+    def make_move(self, move):
+        origin, target, promotion = move
+        self._make(square_index(origin), square_index(target), promotion)
+        self.white_turn = not self.white_turn
+        self.moves_counter += 1
+        self.game_status = None
+
+    def unmake_move(self):
+        self._revert()
+        self.white_turn = not self.white_turn
+        self.moves_counter -= 1
+        self.game_status = None
+
+    # Passes the turn without moving, for null-move pruning in the search.
+    # Not for a player in check. Undo with unmake_null_move.
+    def make_null_move(self):
+        self._push_record((self.passant_square, self.key,
+                           self.halfmove_clock))
+        self.key ^= self._passant_key() ^ ZOBRIST_WHITE_TURN
+        self.passant_square = None
+        self.halfmove_clock += 1
+        self.white_turn = not self.white_turn
+        self.moves_counter += 1
+        self.game_status = None
+
+    def unmake_null_move(self):
+        (self.passant_square, self.key,
+         self.halfmove_clock) = self._pop_record()
+        self.white_turn = not self.white_turn
+        self.moves_counter -= 1
+        self.game_status = None
+
+    # @return: status of the player to move, evaluated once per position
+    def status(self):
+        if self.game_status is None:
+            self.update_status(self.player_colors[not self.white_turn])
+        return self.game_status
+
     # @param origin: start coordinate of move
     # @param target: end coordinate
     # @param promotion: type of promotion piece or None
@@ -558,45 +928,70 @@ class Board:
             raise NotOnBoardException("coordinates not on board")
         if origin == target:
             raise SameSquareException("same square")
-        origin_piece = self._get_piece(origin)
+        origin_sq, target_sq = square_index(origin), square_index(target)
+        origin_piece = self._get_piece(origin_sq)
         if not origin_piece:
             raise NoPieceException(f"no piece in {origin}")
         if origin_piece.color != Board.player_colors[self.white_turn]:
             raise WrongTurnException("not your piece")
 
-        target_piece = self._get_piece(target)
+        target_piece = self._get_piece(target_sq)
         if target_piece and target_piece.color == origin_piece.color:
             raise SameColorException("same color")
 
-        self._update_moves(origin)
-        do_en_passant = self._check_en_passant(origin, target)
-        if (any(target in move for move in origin_piece.moves)) or do_en_passant:
-            if self._check_promotion(origin, target, origin_piece):
+        do_en_passant = self._check_en_passant(origin_sq, target_sq)
+        if (any(target_sq == move[0] for move in self._piece_moves(origin_sq)) or
+            do_en_passant
+        ):
+            if self._check_promotion(origin_sq, target_sq, origin_piece):
                 if promotion not in PROMOTE:
                     raise MissingPromotionChoice("retry move with promotion choice")
             if do_en_passant:
-                self._perform_move(origin, (target, promotion), passant_coords=self.passant_pawn)
+                self._perform_move(origin_sq, (target_sq, promotion),
+                                   passant_square=self.passant_square)
             else:
-                self._perform_move(origin, (target, promotion))
-            # If pawn double-traveled en passant may be possible next move
-            self.passant_pawn = self._pawn_two_squares(origin, target)
+                self._perform_move(origin_sq, (target_sq, promotion))
             self.white_turn = not self.white_turn
-            target_piece = self._get_piece(target)
             game_status = self.update_status(origin_piece.color)
             self.moves_counter += 1
             return game_status
         else:
             raise IllegalMoveException(f"illegal move {origin, target}")
 
+    # @param captures_only: only captures (en passant too) and promotions
+    # @param piece_type: only moves of this piece type, None for all
+    # @return: list of legal (origin, target, promotion) moves of current player
+    def generate_legal_moves(self, captures_only = False, piece_type = None):
+        return [(SQUARE_COORDS[origin], SQUARE_COORDS[target], promotion)
+                for origin, target, promotion in
+                self._legal_moves(self.player_colors[self.white_turn],
+                                  captures_only, piece_type)]
+
+    # @param depth: number of plies
+    # @return: number of leaf nodes of the legal move tree
+    def perft(self, depth):
+        if depth == 0:
+            return 1
+        return self._perft(depth, self.player_colors[self.white_turn])
+
+    # @param depth: number of plies, at least 1
+    # @return: dictionary of legal moves to their perft(depth - 1) counts
+    def divide(self, depth):
+        counts = {}
+        for move in self.generate_legal_moves():
+            self.make_move(move)
+            counts[move] = self.perft(depth - 1)
+            self.unmake_move()
+        return counts
+
     def generate_moves(self):
         player_color = self.player_colors[self.white_turn]
-        self._update_all_moves(player_color)
         all_moves = []
         colored_pieces = self.pieces[player_color]
         for piece_type in colored_pieces:
-            for coords in colored_pieces[piece_type]:
-                piece = self._get_piece(coords)
-                moves = [(coords, target, promotion) for target, promotion in piece.moves]
+            for sq in colored_pieces[piece_type]:
+                moves = [(SQUARE_COORDS[sq], SQUARE_COORDS[target], promotion)
+                         for target, promotion in self._piece_moves(sq)]
                 all_moves.extend(moves)
         return all_moves
 
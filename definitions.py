@@ -1,5 +1,7 @@
 from enum import Enum, auto
 from collections import namedtuple
+from exceptions import InvalidFenException
+import random
 
 INTRO = '''
         ##########################
@@ -72,14 +74,73 @@ def on_board(coords):
     return True
 
 
+# Squares are ints 0..63, r * DIM + c (a1 = 0, h1 = 7, a8 = 56). Coords are
+# used at the API, the tables below are computed once for all boards.
+SQUARE_COORDS = tuple(Coords(sq // DIM, sq % DIM) for sq in range(DIM * DIM))
+
+# @return: square index of coordinates
+def square_index(coords):
+    return coords[0] * DIM + coords[1]
+
+def _square_steps(deltas):
+    return tuple(tuple((r + dr) * DIM + c + dc for dr, dc in deltas
+                       if on_board((r + dr, c + dc)))
+                 for r, c in SQUARE_COORDS)
+
+def _ray_squares(direction):
+    rays = []
+    for r, c in SQUARE_COORDS:
+        ray = []
+        r, c = r + direction[0], c + direction[1]
+        while on_board((r, c)):
+            ray.append(r * DIM + c)
+            r, c = r + direction[0], c + direction[1]
+        rays.append(tuple(ray))
+    return tuple(rays)
+
+def _squares_between():
+    empty = frozenset()
+    table = [[empty] * (DIM * DIM) for _ in range(DIM * DIM)]
+    for rays in RAY_SQUARES:
+        for a, ray in enumerate(rays):
+            for i, b in enumerate(ray):
+                table[a][b] = frozenset(ray[:i])
+    return tuple(tuple(row) for row in table)
+
+KNIGHT_TARGETS = _square_steps(KNIGHT)
+KING_TARGETS = _square_steps(ALL_DIRECTIONS)
+# RAY_SQUARES[direction][square]: squares along a direction of
+# ALL_DIRECTIONS, nearest first
+RAY_SQUARES = tuple(_ray_squares(d) for d in ALL_DIRECTIONS)
+DIAGONAL_RAYS = tuple(ALL_DIRECTIONS.index(d) for d in DIAGONAL)
+STRAIGHT_RAYS = tuple(ALL_DIRECTIONS.index(d) for d in HORIZONTAL_VERTICAL)
+ALL_RAYS = tuple(range(len(ALL_DIRECTIONS)))
+# SQUARES_BETWEEN[a][b]: squares strictly between two aligned squares
+SQUARES_BETWEEN = _squares_between()
+# Pawn moves by color: squares attacked, and squares pushed to (two from
+# the starting row)
+PAWN_CAPTURES = {Colors.White: _square_steps([(1, -1), (1, 1)]),
+                 Colors.Black: _square_steps([(-1, -1), (-1, 1)])}
+PAWN_PUSHES = {
+    Colors.White: tuple(((sq + DIM, sq + 2 * DIM) if sq // DIM == 1 else
+                         (sq + DIM,) if sq // DIM < DIM_ZERO else ())
+                        for sq in range(DIM * DIM)),
+    Colors.Black: tuple(((sq - DIM, sq - 2 * DIM) if sq // DIM == DIM_ZERO - 1 else
+                         (sq - DIM,) if sq // DIM > 0 else ())
+                        for sq in range(DIM * DIM))
+}
+
+
+# Pieces, squares and records are slotted, many boards may be alive at once.
+# Moves are generated by the board when needed, not stored in the pieces.
 class Piece:
+    __slots__ = ("color", "text", "moves_counter")
+
     def __init__(self, color, text, moves_counter = 0):
         self.color = color
         self.text = text
         self.moves_counter = moves_counter
-        self.moves = set()
-        self.threatens = set()
-    
+
     def __str__(self):
         color = "w" if self.color == Colors.White else "b"
         return color + self.text
@@ -88,44 +149,58 @@ class Piece:
 
 
 class Pawn(Piece):
+    __slots__ = ()
+
     def __init__(self, color, moves_counter = 0):
-        super().__init__(color, "P", moves_counter = 0)
+        super().__init__(color, "P", moves_counter)
 
 class Rook(Piece):
+    __slots__ = ()
+
     def __init__(self, color, moves_counter = 0):
-        super().__init__(color, "R", moves_counter = 0)
-        self.can_castle = True
+        super().__init__(color, "R", moves_counter)
 
 class Knight(Piece):
+    __slots__ = ()
+
     def __init__(self, color, moves_counter = 0):
-        super().__init__(color, "N", moves_counter = 0)
+        super().__init__(color, "N", moves_counter)
 
 class Bishop(Piece):
+    __slots__ = ()
+
     def __init__(self, color, moves_counter = 0):
-        super().__init__(color, "B", moves_counter = 0)
+        super().__init__(color, "B", moves_counter)
 
 class Queen(Piece):
+    __slots__ = ()
+
     def __init__(self, color, moves_counter = 0):
-        super().__init__(color, "Q", moves_counter = 0)
+        super().__init__(color, "Q", moves_counter)
 
 class King(Piece):
+    __slots__ = ()
+
     def __init__(self, color, moves_counter = 0):
-        super().__init__(color, "K", moves_counter = 0)
-        self.can_castle = True
+        super().__init__(color, "K", moves_counter)
 
 
 class Square:
+    __slots__ = ("piece", "coords")
+
     def __init__(self, coords: Coords):
         self.piece = None
         self.coords = coords
 
     def __str__(self):
         return self.piece.__str__() if self.piece else "  "
-    
+
     __repr__ = __str__
 
 
 class Record:
+    __slots__ = ("coords", "piece_type", "color", "moves_counter")
+
     def __init__(self, coords: Coords, piece):
         self.coords = coords
         self.piece_type = type(piece) if piece else None
@@ -138,12 +213,138 @@ class Record:
                                    self.color,
                                    self.moves_counter]))
         )
-    
+
     __repr__ = __str__
 
 
 PROMOTE = [Queen, Rook, Bishop, Knight]
 CHAR_PROMOTE = dict([(c, piece) for (c, piece) in zip("QRBN", PROMOTE)])
+CHAR_PIECE = dict([(c, piece) for (c, piece) in
+                   zip("PRNBQK", [Pawn, Rook, Knight, Bishop, Queen, King])])
+PIECE_CHAR = dict((piece, c) for c, piece in CHAR_PIECE.items())
+
+
+# FEN castling field in ZOBRIST_CASTLING bit order
+CASTLING_CHARS = "KQkq"
+_FEN_EXPAND = [(str(n), "." * n) for n in range(2, DIM + 1)]
+_FEN_COMPRESS = [("." * n, str(n)) for n in range(DIM, 0, -1)]
+_FEN_PIECE_CHARS = set("PRNBQKprnbqk.")
+_FEN_CASTLING = dict(("".join(c for i, c in enumerate(CASTLING_CHARS)
+                              if rights >> i & 1) or "-", rights)
+                     for rights in range(16))
+_FEN_CASTLING_FIELD = dict((rights, field) for field, rights in _FEN_CASTLING.items())
+
+
+# @param rank: one rank of a FEN placement field, e.g. 'r3k2r'
+# @return: its 8 piece characters, '.' for an empty square
+def expand_fen_rank(rank):
+    expanded = rank.replace("1", ".")
+    for digit, empty in _FEN_EXPAND:
+        expanded = expanded.replace(digit, empty)
+    if len(expanded) != DIM or not _FEN_PIECE_CHARS.issuperset(expanded):
+        raise InvalidFenException(f"invalid FEN rank {rank}")
+    return expanded
+
+
+# @param fields: the whitespace separated fields of a FEN record
+# @return: (white_turn, castling, passant, halfmove, fullmove) as parse_fen
+def parse_fen_fields(fen, fields):
+    try:
+        white_turn = None
+        if len(fields) > 1:
+            white_turn = "wb".index(fields[1]) == 0
+        castling = None
+        if len(fields) > 2:
+            castling = _FEN_CASTLING.get(fields[2])
+            if castling is None:
+                castling = 0
+                for c in fields[2]:
+                    castling |= 1 << CASTLING_CHARS.index(c)
+        passant = None
+        if len(fields) > 3 and fields[3] != "-":
+            passant = Coords("12345678".index(fields[3][1]),
+                             "abcdefgh".index(fields[3][0]))
+        halfmove = int(fields[4]) if len(fields) > 4 else 0
+        fullmove = int(fields[5]) if len(fields) > 5 else 1
+    except (ValueError, IndexError):
+        raise InvalidFenException(f"invalid FEN fields {fen}")
+    return white_turn, castling, passant, halfmove, fullmove
+
+
+# Checks the pieces of a position both boards rely on: one king of each
+# color and no pawns on the first or last rank
+# @param placement: piece placement field of a FEN record
+def check_fen_placement(placement):
+    if placement.count("K") != 1 or placement.count("k") != 1:
+        raise InvalidFenException(f"FEN needs one king of each color "
+                                  f"{placement}")
+    ranks = placement.split("/")
+    if any(c in "Pp" for c in ranks[0] + ranks[-1]):
+        raise InvalidFenException(f"FEN has pawns on the first or last "
+                                  f"rank {placement}")
+
+
+# @param fen: a FEN record. Missing side to move and castling fields are
+#             None, missing clocks get their default values.
+# @return: (squares, white_turn, castling, passant, halfmove, fullmove)
+#          squares: string of 64 piece characters indexed r * DIM + c,
+#                   '.' for an empty square
+#          castling: rights bits in ZOBRIST_CASTLING order or None
+#          passant: en passant target square Coords or None
+def parse_fen(fen):
+    fields = fen.split()
+    if not fields:
+        raise InvalidFenException("empty FEN")
+    placement = fields[0].replace("1", ".")
+    for digit, empty in _FEN_EXPAND:
+        placement = placement.replace(digit, empty)
+    ranks = placement.split("/")
+    if len(ranks) != DIM or set(map(len, ranks)) != {DIM}:
+        raise InvalidFenException(f"invalid FEN placement {fields[0]}")
+    squares = "".join(reversed(ranks))
+    if not _FEN_PIECE_CHARS.issuperset(squares):
+        raise InvalidFenException(f"invalid FEN placement {fields[0]}")
+    check_fen_placement(fields[0])
+    return (squares,) + parse_fen_fields(fen, fields)
+
+
+# @param squares: 64 piece characters as returned by parse_fen
+# @return: FEN record
+def make_fen(squares, white_turn, castling, passant, halfmove, fullmove):
+    placement = "/".join([squares[r * DIM:(r + 1) * DIM]
+                          for r in range(DIM_ZERO, -1, -1)])
+    for empty, digit in _FEN_COMPRESS:
+        placement = placement.replace(empty, digit)
+    passant_field = ("abcdefgh"[passant[1]] + str(passant[0] + 1)
+                     if passant else "-")
+    return " ".join([placement, "w" if white_turn else "b",
+                     _FEN_CASTLING_FIELD[castling], passant_field,
+                     str(halfmove), str(fullmove)])
+
+
+# Zobrist hashing keys, laid out like Polyglot: a key per color, piece type
+# and square (r * DIM + c), castling rights (white kingside, white queenside,
+# black kingside, black queenside), en passant file and white to move.
+# Fixed seed so keys are the same in every process.
+_zobrist_random = random.Random(0x5EED)
+ZOBRIST_PIECES = dict(
+    ((color, piece_type),
+     tuple(_zobrist_random.getrandbits(64) for _ in range(DIM * DIM)))
+    for color in Colors for piece_type in [Pawn, Rook, Knight, Bishop, Queen, King]
+)
+ZOBRIST_CASTLING = tuple(_zobrist_random.getrandbits(64) for _ in range(4))
+ZOBRIST_PASSANT = tuple(_zobrist_random.getrandbits(64) for _ in range(DIM))
+ZOBRIST_WHITE_TURN = _zobrist_random.getrandbits(64)
+
+
+# @param rights: castling rights bits in ZOBRIST_CASTLING order
+# @return: xor of their keys
+def zobrist_castling(rights):
+    key = 0
+    for i in range(4):
+        if rights >> i & 1:
+            key ^= ZOBRIST_CASTLING[i]
+    return key
 
 
 if __name__=="__main__":
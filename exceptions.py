@@ -23,9 +23,19 @@ class KingThreatenedException(ValueError):
 class MissingPromotionChoice(ValueError):
     pass
 
+class InvalidFenException(ValueError):
+    pass
+
+class InvalidSanException(ValueError):
+    pass
+
 class RevertException(IndexError):
     pass
 
 # A missing king means program should terminate
 class NoKingError(RuntimeError):
     pass
+
+# A search ran out of time or nodes, its board is restored by the searcher
+class SearchAbortedException(Exception):
+    pass
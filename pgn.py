@@ -0,0 +1,312 @@
+from bitboard import BitBoard
+from chesslogic import Board
+from collections import deque
+from definitions import *
+from exceptions import *
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import sys
+import time
+
+# Games in PGN (Portable Game Notation) with moves in SAN (Standard
+# Algebraic Notation), e.g. 'Nf3', 'exd5', 'O-O', 'e8=Q+'.
+#
+# Files are read line by line, one game at a time. validate_games replays
+# the games of a file on a board and reports illegal moves and final
+# positions. With several workers, batches of game texts are sent to a
+# process pool, which parses and replays them; the main process only splits
+# the file into games.
+
+RESULTS = ("1-0", "0-1", "1/2-1/2", "*")
+SAN_PIECES = {"N": Knight, "B": Bishop, "R": Rook, "Q": Queen, "K": King}
+_HEADER = re.compile(r'\[\s*(\w+)\s+"(.*)"\s*\]')
+# Movetext tokens: comments to the closing brace or the end of the line,
+# parentheses of variations, and words
+_TOKEN = re.compile(r"\{[^}]*\}?|;[^\n]*|[()]|[^\s{};()]+")
+# Games sent to a worker process at a time
+GAMES_PER_BATCH = 200
+BOARDS = {"bitboard": BitBoard, "grid": Board}
+
+
+# @param text: movetext of a game
+# @return: list of SAN moves and the result token or None. Comments,
+#          variations, move numbers and annotation glyphs are skipped.
+def parse_movetext(text):
+    moves = []
+    result = None
+    depth = 0
+    for token in _TOKEN.findall(text):
+        c = token[0]
+        if c == "{" or c == ";":
+            continue
+        if c == "(":
+            depth += 1
+        elif c == ")":
+            depth -= 1
+        elif depth > 0 or c == "$":
+            continue
+        elif token in RESULTS:
+            result = token
+        else:
+            # Move numbers, also when written together with the move: '1.e4'
+            token = token.lstrip("0123456789.")
+            if token:
+                moves.append(token)
+    return moves, result
+
+
+# @param lines: iterable of PGN lines, e.g. an open file
+# @return: generator of the text of each game, headers and movetext. Only
+#          one game is held in memory at a time.
+def split_games(lines):
+    game = []
+    in_movetext = False
+    for line in lines:
+        stripped = line.strip()
+        if stripped.startswith("["):
+            # A header after the movetext starts the next game
+            if in_movetext:
+                yield "".join(game)
+                game = []
+                in_movetext = False
+        elif stripped:
+            in_movetext = True
+        game.append(line)
+    if any(line.strip() for line in game):
+        yield "".join(game)
+
+# @param text: a game as split_games
+# @return: (headers, SAN moves, result). The result is taken from the
+#          movetext or the Result header.
+def parse_game(text):
+    headers = {}
+    lines = text.splitlines(True)
+    start = 0
+    for line in lines:
+        stripped = line.strip()
+        if stripped and not stripped.startswith("["):
+            break
+        match = _HEADER.match(stripped)
+        if match:
+            headers[match.group(1)] = match.group(2)
+        start += 1
+    moves, result = parse_movetext("".join(lines[start:]))
+    if result is None:
+        result = headers.get("Result")
+    return headers, moves, result
+
+# @param lines: iterable of PGN lines, e.g. an open file
+# @return: generator of (headers, SAN moves, result) of each game
+def read_games(lines):
+    for text in split_games(lines):
+        yield parse_game(text)
+
+
+# @param text: square in algebraic notation, e.g. 'e4'
+# @return: its Coords
+def _san_square(text, san):
+    c, r = "abcdefgh".find(text[0]), "12345678".find(text[1])
+    if c < 0 or r < 0:
+        raise InvalidSanException(f"invalid move {san}")
+    return Coords(r, c)
+
+# @param board: Board or BitBoard with the player of the move to move
+# @param san: move in SAN
+# @return: the legal (origin, target, promotion) move
+def san_to_move(board, san):
+    text = san.rstrip("+#!?")
+    if text in ("O-O", "0-0", "O-O-O", "0-0-0"):
+        queenside = len(text) == 5
+        for move in board.generate_legal_moves(piece_type = King):
+            origin, target, _ = move
+            if (abs(target[1] - origin[1]) == 2 and
+                (target[1] < origin[1]) == queenside
+            ):
+                return move
+        raise InvalidSanException(f"illegal move {san}")
+
+    promotion = None
+    if "=" in text:
+        text, choice = text.split("=", 1)
+        if choice not in CHAR_PROMOTE:
+            raise InvalidSanException(f"invalid promotion {san}")
+        promotion = CHAR_PROMOTE[choice]
+    elif len(text) > 2 and text[-1] in CHAR_PROMOTE and text[-2].isdigit():
+        promotion = CHAR_PROMOTE[text[-1]]
+        text = text[:-1]
+    piece_type = Pawn
+    if text and text[0] in SAN_PIECES:
+        piece_type = SAN_PIECES[text[0]]
+        text = text[1:]
+    text = text.replace("x", "").replace(":", "")
+    if len(text) < 2 or len(text) > 4:
+        raise InvalidSanException(f"invalid move {san}")
+    target = _san_square(text[-2:], san)
+    # Disambiguation by origin file, rank or both
+    hint_file, hint_rank = None, None
+    for c in text[:-2]:
+        if c in "abcdefgh":
+            hint_file = "abcdefgh".index(c)
+        elif c in "12345678":
+            hint_rank = "12345678".index(c)
+        else:
+            raise InvalidSanException(f"invalid move {san}")
+
+    # Only the moves of the piece type are generated
+    found = None
+    for move in board.generate_legal_moves(piece_type = piece_type):
+        origin, move_target, move_promotion = move
+        if (move_target != target or move_promotion is not promotion or
+            (hint_file is not None and origin[1] != hint_file) or
+            (hint_rank is not None and origin[0] != hint_rank)
+        ):
+            continue
+        if found is not None:
+            raise InvalidSanException(f"ambiguous move {san}")
+        found = move
+    if found is None:
+        raise InvalidSanException(f"illegal move {san}")
+    return found
+
+
+# Replay of a game by validate_game
+class GameReport:
+    # @param index: number of the game in its file, from 0
+    def __init__(self, index, headers, result):
+        self.index = index
+        self.headers = headers
+        self.result = result
+        # Moves replayed, up to the first illegal one
+        self.plies = 0
+        # Why the replay stopped before the end, None for a legal game
+        self.error = None
+        # Position after the moves replayed and its BoardStatus name
+        self.fen = None
+        self.status = None
+
+    # @return: dictionary of the report, for JSON
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        if self.error is not None:
+            return f"game {self.index + 1}: {self.error}"
+        return (f"game {self.index + 1}: {self.plies} plies {self.result} "
+                f"{self.status} {self.fen}")
+
+
+# @param text: a game as split_games
+# @param board: Board or BitBoard to replay on, its position is replaced
+# @return: GameReport of the game
+def validate_game(text, index = 0, board = None):
+    if board is None:
+        board = BitBoard()
+    report = GameReport(index, {}, None)
+    try:
+        report.headers, moves, report.result = parse_game(text)
+        _replay(board, moves, report)
+    except Exception as e:
+        # Any other failure is the game's error too, a bulk run goes on
+        # with the next game
+        report.error = f"{type(e).__name__}: {e}"
+    return report
+
+# Replays the moves of a game, filling its report
+def _replay(board, moves, report):
+    try:
+        board.set_fen(report.headers.get("FEN",
+                                         START_POSITION + " w KQkq - 0 1"))
+    except InvalidFenException as e:
+        report.error = f"invalid FEN: {e}"
+        return
+    for san in moves:
+        try:
+            move = san_to_move(board, san)
+        except InvalidSanException as e:
+            report.error = f"ply {report.plies + 1}: {e}"
+            break
+        board.make_move(move)
+        report.plies += 1
+    report.fen = board.fen()
+    report.status = board.status().name
+
+# @param task: (board class, index of the first game, game texts)
+# @return: list of GameReport of the games
+def _validate_batch(task):
+    board_class, first, texts = task
+    board = board_class()
+    return [validate_game(text, first + i, board)
+            for i, text in enumerate(texts)]
+
+def _batches(texts, board_class, size):
+    batch = []
+    first = 0
+    for text in texts:
+        batch.append(text)
+        if len(batch) == size:
+            yield board_class, first, batch
+            first += size
+            batch = []
+    if batch:
+        yield board_class, first, batch
+
+# @param lines: iterable of PGN lines, e.g. an open file
+# @param workers: processes replaying the games, 1 for none
+# @param board_class: Board or BitBoard
+# @return: generator of GameReport of each game, in file order
+def validate_games(lines, workers = 1, board_class = BitBoard,
+                   batch_size = GAMES_PER_BATCH):
+    tasks = _batches(split_games(lines), board_class, batch_size)
+    if workers <= 1:
+        for task in tasks:
+            yield from _validate_batch(task)
+        return
+    # A few batches per worker are in flight at a time, Pool.imap would
+    # read the whole file ahead
+    with multiprocessing.Pool(workers) as pool:
+        pending = deque()
+        for task in tasks:
+            pending.append(pool.apply_async(_validate_batch, (task,)))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+        while pending:
+            yield from pending.popleft().get()
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="replay PGN files and "
+                                     "report illegal moves and final "
+                                     "positions")
+    parser.add_argument("files", nargs="+")
+    parser.add_argument("-w", "--workers", type=int, default=os.cpu_count())
+    parser.add_argument("-b", "--board", choices=sorted(BOARDS),
+                        default="bitboard", help="board implementation "
+                        "(default bitboard)")
+    parser.add_argument("-e", "--errors", action="store_true",
+                        help="report only games with illegal moves")
+    parser.add_argument("-j", "--json", action="store_true",
+                        help="reports as JSON lines")
+    args = parser.parse_args()
+
+    games = errors = plies = 0
+    start = time.perf_counter()
+    for path in args.files:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            for report in validate_games(f, args.workers, BOARDS[args.board]):
+                games += 1
+                plies += report.plies
+                if report.error is not None:
+                    errors += 1
+                elif args.errors:
+                    continue
+                if args.json:
+                    print(json.dumps(dict(report.as_dict(), file=path)))
+                else:
+                    print(f"{path} {report}")
+    seconds = time.perf_counter() - start
+    print(f"{games} games {errors} with errors {plies} plies "
+          f"{seconds:.2f}s {games / seconds * 3600 if seconds else 0:.0f} "
+          "games/hour", file=sys.stderr)
@@ -0,0 +1,157 @@
+import contextlib
+import json
+import time
+
+# Statistics of the moves of the AI players in chessai.py. get_ai_move
+# leaves a SearchStats in player.stats and writes it to player.stats_log if
+# one is set, a StatsLog writes one JSON object per line.
+#
+# With player.profile set, the board's move generation, status and check
+# tests, make/unmake calls and the heuristic are timed during the search.
+# Timing every call slows the search down, so the shares matter more than
+# the totals. Work done in worker processes is counted in nodes, but not
+# timed.
+
+# Board methods timed when profiling, by category
+PROFILED_METHODS = {
+    "movegen": ("generate_legal_moves",),
+    "legality": ("status", "in_check"),
+    "make": ("make_move", "unmake_move", "make_null_move",
+             "unmake_null_move"),
+}
+
+
+class SearchStats:
+    # @param player: name of the player
+    def __init__(self, player):
+        self.player = player
+        self.move = None
+        # "book", "tablebase", "ponder" or "search"
+        self.source = None
+        # Seconds of get_ai_move
+        self.time = 0.0
+        # Positions searched, playouts for Monte Carlo players
+        self.nodes = 0
+        self.nodes_per_second = 0.0
+        self.depth = 0
+        self.branching_factor = None
+        # Score of the move for the player, in the units of the search
+        self.score = None
+        # Beta cutoffs, those by the first move searched, and their rates
+        self.cutoffs = 0
+        self.first_move_cutoffs = 0
+        self.cutoff_rate = None
+        self.first_move_cutoff_rate = None
+        # Transposition table probes and hits during the move
+        self.table_probes = 0
+        self.table_hits = 0
+        self.table_hit_rate = None
+        # Completed iterations: (depth, nodes of the iteration, seconds since
+        # the start of the search) of each
+        self.iterations = []
+        # Category to [seconds, calls] when profiling, else None
+        self.profile = None
+
+    # Computes the rates from the counts
+    def finish(self):
+        if self.time > 0:
+            self.nodes_per_second = self.nodes / self.time
+        if self.nodes:
+            self.cutoff_rate = self.cutoffs / self.nodes
+        if self.cutoffs:
+            self.first_move_cutoff_rate = self.first_move_cutoffs / self.cutoffs
+        if self.table_probes:
+            self.table_hit_rate = self.table_hits / self.table_probes
+        iteration_nodes = [nodes for _, nodes, _ in self.iterations]
+        if len(iteration_nodes) >= 2 and iteration_nodes[-2]:
+            self.branching_factor = iteration_nodes[-1] / iteration_nodes[-2]
+        elif self.branching_factor is None and self.depth and self.nodes > 1:
+            self.branching_factor = self.nodes ** (1 / self.depth)
+
+    # @return: dictionary of the statistics, for JSON
+    def as_dict(self):
+        return dict(vars(self))
+
+    def __str__(self):
+        text = (f"{self.source} move {self.move} time {self.time:.2f}s "
+                f"nodes {self.nodes} nps {self.nodes_per_second:.0f} "
+                f"depth {self.depth}")
+        if self.branching_factor is not None:
+            text += f" ebf {self.branching_factor:.2f}"
+        if self.first_move_cutoff_rate is not None:
+            text += f" first move cutoffs {self.first_move_cutoff_rate:.0%}"
+        if self.table_hit_rate is not None:
+            text += f" table hits {self.table_hit_rate:.0%}"
+        if self.profile:
+            shares = ", ".join(f"{category} {seconds / self.time:.0%}"
+                               for category, (seconds, _) in
+                               self.profile.items() if self.time > 0)
+            text += f" ({shares})"
+        return text
+
+
+# JSON lines sink of SearchStats
+class StatsLog:
+    # @param path: file appended to, "-" for standard output
+    def __init__(self, path):
+        self.path = path
+        self.file = None if path == "-" else open(path, "a")
+
+    def write(self, stats):
+        line = json.dumps(stats.as_dict(), default=str)
+        if self.file is None:
+            print(line)
+        else:
+            self.file.write(line + "\n")
+            self.file.flush()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+# Times calls of a function into a category of a profile. A class rather
+# than a closure, so a timed heuristic may be sent to worker processes.
+class TimedCall:
+    def __init__(self, function, totals):
+        self.function = function
+        self.totals = totals
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.function(*args, **kwargs)
+        finally:
+            totals = self.totals
+            totals[0] += time.perf_counter() - start
+            totals[1] += 1
+
+
+# Times the board methods and the heuristic of a player while in the block
+# @param stats: SearchStats whose profile is filled
+@contextlib.contextmanager
+def profiled(player, stats):
+    board = player.board
+    stats.profile = dict((category, [0.0, 0]) for category in
+                         list(PROFILED_METHODS) + ["eval"])
+    for category, names in PROFILED_METHODS.items():
+        for name in names:
+            # Instance attributes hide the methods until deleted
+            setattr(board, name, TimedCall(getattr(board, name),
+                                           stats.profile[category]))
+    # Workers are created before the heuristic is timed, or they would
+    # keep the timed one after the block
+    if hasattr(player, "start_workers"):
+        player.start_workers()
+    heuristic = getattr(player, "heuristic", None)
+    if heuristic is not None:
+        player.heuristic = TimedCall(heuristic, stats.profile["eval"])
+    try:
+        yield stats
+    finally:
+        for names in PROFILED_METHODS.values():
+            for name in names:
+                delattr(board, name)
+        if heuristic is not None:
+            player.heuristic = heuristic
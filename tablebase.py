@@ -0,0 +1,475 @@
+from array import array
+from bitboard import BitBoard
+from definitions import *
+from exceptions import *
+import argparse
+import mmap
+import multiprocessing
+import os
+import time
+
+# Endgame tablebases: the distance to mate of every position of a material
+# signature of up to MAX_PIECES pieces, e.g. 'KQvK' or 'KRvKP', generated by
+# retrograde analysis.
+#
+# A table file has one byte per index (side to move, then the square of
+# each piece in signature order): DRAW, ILLEGAL, or 1 + plies to mate. Odd
+# plies are a win of the side to move, even plies a loss (0: checkmated).
+# The stronger side of a signature is white, positions with the colors the
+# other way round are probed mirrored. Positions with castling rights or a
+# possible en passant capture are not covered, and generation does not see
+# en passant captures after a double push. Files are memory-mapped.
+#
+# Generation first scans every position with the board's move generator,
+# in parallel: illegal positions, mates, moves that stay in the table and
+# results of captures and promotions, which lead to smaller tables that are
+# generated before. Then results spread from mates to the positions one
+# move before ("unmoves"), in order of distance to mate.
+
+DRAW = 0
+ILLEGAL = 255
+MAX_PIECES = 4
+# Piece letters in signature order, and their weights for finding the
+# stronger side
+PIECE_ORDER = "KQRBNP"
+SIGNATURE_VALUES = {"K": 0, "Q": 9, "R": 5, "B": 3, "N": 3, "P": 1}
+SLIDER_RAYS = {"Q": ALL_RAYS, "R": STRAIGHT_RAYS, "B": DIAGONAL_RAYS}
+# Scan results: a position with moves, and no capture or promotion
+_OPEN = 2
+_NONE = 255
+
+
+# @param white, black: piece letters of each side, e.g. 'KQ' and 'K'
+# @return: signature of the table and True if colors are swapped in it
+def canonical_signature(white, black):
+    white = "".join(sorted(white, key=PIECE_ORDER.index))
+    black = "".join(sorted(black, key=PIECE_ORDER.index))
+    def strength(side):
+        return (sum(SIGNATURE_VALUES[c] for c in side), len(side), side)
+    if strength(black) > strength(white):
+        return black + "v" + white, True
+    return white + "v" + black, False
+
+# @return: list of (color, letter) of the pieces of a signature in order
+def signature_pieces(signature):
+    white, black = signature.split("v")
+    return ([(Colors.White, c) for c in white] +
+            [(Colors.Black, c) for c in black])
+
+# @return: number of indices of a table
+def table_size(signature):
+    return 2 * (DIM * DIM) ** len(signature_pieces(signature))
+
+# @return: signatures reached by a capture or promotion, kings-only excluded
+def successor_signatures(signature):
+    white, black = signature.split("v")
+    successors = set()
+    for i, c in enumerate(white):
+        if c != "K":
+            successors.add(canonical_signature(white[:i] + white[i + 1:], black))
+        if c == "P":
+            for promoted in "QRBN":
+                successors.add(canonical_signature(
+                    white[:i] + promoted + white[i + 1:], black))
+    for i, c in enumerate(black):
+        if c != "K":
+            successors.add(canonical_signature(white, black[:i] + black[i + 1:]))
+        if c == "P":
+            for promoted in "QRBN":
+                successors.add(canonical_signature(
+                    white, black[:i] + promoted + black[i + 1:]))
+    return sorted(sig for sig, _ in successors if sig != "KvK")
+
+# @return: all signatures of pieces pieces
+def all_signatures(pieces):
+    signatures = set()
+    others = PIECE_ORDER[1:]
+    def extend(white, black, count):
+        if count == 0:
+            signatures.add(canonical_signature(white, black)[0])
+            return
+        for c in others:
+            extend(white + c, black, count - 1)
+            extend(white, black + c, count - 1)
+    extend("K", "K", pieces - 2)
+    return sorted(signatures)
+
+
+# @return: (white to move, squares) of an index
+def decode_index(index, count):
+    squares = [0] * count
+    for i in range(count - 1, -1, -1):
+        index, squares[i] = divmod(index, DIM * DIM)
+    return index == 0, squares
+
+def encode_index(white_turn, squares):
+    index = 0 if white_turn else 1
+    for sq in squares:
+        index = index * DIM * DIM + sq
+    return index
+
+
+class Tablebase:
+    # @param directory: directory of the table files
+    def __init__(self, directory):
+        self.directory = directory
+        # Signature to its memory map, None if there is no file
+        self.tables = {}
+        self.files = []
+        # (white, black) piece letters to (signature, colors swapped, FEN
+        # characters of the signature's pieces in order)
+        self.signatures = {}
+
+    def close(self):
+        for table in self.tables.values():
+            if table is not None:
+                table.close()
+        for f in self.files:
+            f.close()
+        self.tables = {}
+        self.files = []
+
+    # @return: path of the file of a signature
+    def path(self, signature):
+        return os.path.join(self.directory, signature + ".tb")
+
+    def _table(self, signature):
+        if signature not in self.tables:
+            table = None
+            if os.path.exists(self.path(signature)):
+                f = open(self.path(signature), "rb")
+                self.files.append(f)
+                table = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            self.tables[signature] = table
+        return self.tables[signature]
+
+    # @return: (signature, index) of the position of a board, or None if
+    #          the tables do not cover it
+    def locate(self, board):
+        if board.piece_total() > MAX_PIECES:
+            return None
+        # Not covered with castling rights or if the player to move may
+        # capture en passant
+        if board.castling_rights() or board.passant_capture():
+            return None
+        white_turn = board.white_turn
+        pieces = sorted(board.piece_squares())
+        white = "".join(c for _, c in pieces if c.isupper())
+        black = "".join(c.upper() for _, c in pieces if c.islower())
+        entry = self.signatures.get((white, black))
+        if entry is None:
+            signature, flip = canonical_signature(white, black)
+            chars = [letter if color == Colors.White else letter.lower()
+                     for color, letter in signature_pieces(signature)]
+            entry = self.signatures[(white, black)] = signature, flip, chars
+        signature, flip, chars = entry
+        if signature == "KvK":
+            return signature, None
+        if flip:
+            # Swap colors and mirror the board vertically
+            pieces = [(sq ^ 56, c.swapcase()) for sq, c in pieces]
+            white_turn = not white_turn
+        table_squares = []
+        for char in chars:
+            for i, (sq, c) in enumerate(pieces):
+                if c == char:
+                    table_squares.append(sq)
+                    pieces[i] = (sq, None)
+                    break
+        return signature, encode_index(white_turn, table_squares)
+
+    # @return: table byte of the position (DRAW or 1 + plies to mate of the
+    #          player to move), or None if it is not covered
+    def probe(self, board):
+        location = self.locate(board)
+        if location is None:
+            return None
+        signature, index = location
+        if index is None:
+            return DRAW
+        table = self._table(signature)
+        if table is None:
+            return None
+        return table[index]
+
+    # @return: (move, table byte of the position) of a best move: the
+    #          fastest win, else a draw, else the slowest loss. None if a
+    #          position is not covered or there are no moves.
+    def best_move(self, board):
+        value = self.probe(board)
+        if value is None:
+            return None
+        best_move, best_rank = None, None
+        for move in board.generate_legal_moves():
+            board.make_move(move)
+            child = self.probe(board)
+            board.unmake_move()
+            if child is None:
+                return None
+            if child == DRAW:
+                rank = 0
+            elif (child - 1) % 2 == 0:
+                # The opponent loses, sooner is better
+                rank = 1000 - child
+            else:
+                rank = -1000 + child
+            if best_rank is None or rank > best_rank:
+                best_move, best_rank = move, rank
+        if best_move is None:
+            return None
+        return best_move, value
+
+
+# Tables of the running generation in a worker process
+_worker_tables = None
+
+def _init_scan_worker(directory):
+    global _worker_tables
+    _worker_tables = Tablebase(directory)
+
+# Scans a range of indices of a table with the move generator
+# @param task: (signature, first index, end index)
+# @return: arrays of the range: state (ILLEGAL, DRAW for stalemate, 1 for
+#          checkmated, _OPEN otherwise), moves staying in the table, fastest
+#          win and slowest loss through a capture or promotion in table
+#          bytes (_NONE if none) and 1 if one of them draws
+def _scan_range(task):
+    signature, start, end = task
+    tables = _worker_tables
+    pieces = signature_pieces(signature)
+    chars = [letter if color == Colors.White else letter.lower()
+             for color, letter in pieces]
+    count = len(pieces)
+    board = BitBoard()
+    states = bytearray([_OPEN]) * (end - start)
+    remaining = bytearray(end - start)
+    exit_wins = bytearray([_NONE]) * (end - start)
+    exit_losses = bytearray([_NONE]) * (end - start)
+    exit_draws = bytearray(end - start)
+    for index in range(start, end):
+        i = index - start
+        white_turn, squares = decode_index(index, count)
+        if len(set(squares)) != count:
+            states[i] = ILLEGAL
+            continue
+        placement = ["."] * (DIM * DIM)
+        illegal = False
+        for sq, char in zip(squares, chars):
+            if char in "Pp" and sq // DIM in (0, DIM_ZERO):
+                illegal = True
+            placement[sq] = char
+        if illegal or squares[chars.index("k")] in KING_TARGETS[squares[0]]:
+            states[i] = ILLEGAL
+            continue
+        board.set_fen(make_fen("".join(placement), white_turn, 0, None, 0, 1))
+        to_move = BitBoard.player_colors[white_turn]
+        if board.in_check(to_move.other_color()):
+            states[i] = ILLEGAL
+            continue
+        moves = board.generate_legal_moves()
+        if not moves:
+            states[i] = 1 if board.in_check(to_move) else DRAW
+            continue
+        in_table = 0
+        for move in moves:
+            origin, target, promotion = move
+            if promotion is None and board.piece_type_at(target) is None:
+                in_table += 1
+                continue
+            board.make_move(move)
+            child = tables.probe(board)
+            board.unmake_move()
+            if child is None:
+                raise FileNotFoundError(f"missing table for {board.fen()}")
+            if child == DRAW:
+                exit_draws[i] = 1
+            elif (child - 1) % 2 == 0:
+                # Child's player to move loses in child - 1 plies
+                exit_wins[i] = min(exit_wins[i], child + 1)
+            elif exit_losses[i] == _NONE:
+                exit_losses[i] = child + 1
+            else:
+                exit_losses[i] = max(exit_losses[i], child + 1)
+        remaining[i] = in_table
+    return states, remaining, exit_wins, exit_losses, exit_draws
+
+
+# @return: indices of the positions one move of the player not to move
+#          before the position of index, staying in the table
+def _unmoves(index, pieces, count):
+    white_turn, squares = decode_index(index, count)
+    occupied = set(squares)
+    mover = Colors.Black if white_turn else Colors.White
+    for i, (color, letter) in enumerate(pieces):
+        if color != mover:
+            continue
+        sq = squares[i]
+        if letter == "K":
+            origins = [o for o in KING_TARGETS[sq] if o not in occupied]
+        elif letter == "N":
+            origins = [o for o in KNIGHT_TARGETS[sq] if o not in occupied]
+        elif letter == "P":
+            step = -DIM if color == Colors.White else DIM
+            origins = []
+            single = sq + step
+            if 0 < single // DIM < DIM_ZERO and single not in occupied:
+                origins.append(single)
+                double = single + step
+                start_row = 1 if color == Colors.White else DIM_ZERO - 1
+                if double // DIM == start_row and double not in occupied:
+                    origins.append(double)
+        else:
+            origins = []
+            for ray in SLIDER_RAYS[letter]:
+                for o in RAY_SQUARES[ray][sq]:
+                    if o in occupied:
+                        break
+                    origins.append(o)
+        for o in origins:
+            squares[i] = o
+            yield encode_index(not white_turn, squares)
+        squares[i] = sq
+
+
+# Generates the table of a signature, the tables it leads to must exist
+# @param workers: processes scanning positions
+# @param chunk: indices per scan task
+# @return: table as a bytearray
+def generate_table(signature, directory, workers = 1, chunk = 1 << 14):
+    size = table_size(signature)
+    pieces = signature_pieces(signature)
+    count = len(pieces)
+    tasks = [(signature, start, min(start + chunk, size))
+             for start in range(0, size, chunk)]
+    if workers > 1:
+        with multiprocessing.Pool(workers, _init_scan_worker,
+                                  (directory,)) as pool:
+            results = pool.map(_scan_range, tasks)
+    else:
+        _init_scan_worker(directory)
+        results = [_scan_range(task) for task in tasks]
+    states, remaining = bytearray(), bytearray()
+    exit_wins, exit_losses, exit_draws = bytearray(), bytearray(), bytearray()
+    for result in results:
+        states += result[0]
+        remaining += result[1]
+        exit_wins += result[2]
+        exit_losses += result[3]
+        exit_draws += result[4]
+    del results
+
+    # buckets[plies]: indices that may be decided with plies to mate
+    buckets = [array("I") for _ in range(ILLEGAL)]
+    table = bytearray(size)
+    for index in range(size):
+        state = states[index]
+        if state == ILLEGAL:
+            table[index] = ILLEGAL
+        elif state == 1:
+            buckets[0].append(index)
+        elif state == _OPEN:
+            if exit_wins[index] != _NONE:
+                buckets[exit_wins[index] - 1].append(index)
+            elif (remaining[index] == 0 and not exit_draws[index] and
+                  exit_losses[index] != _NONE
+            ):
+                buckets[exit_losses[index] - 1].append(index)
+    decided = bytearray(size)
+    for plies in range(ILLEGAL - 1):
+        bucket = buckets[plies]
+        for index in bucket:
+            if decided[index]:
+                continue
+            decided[index] = 1
+            table[index] = plies + 1
+            for before in _unmoves(index, pieces, count):
+                if decided[before] or states[before] != _OPEN:
+                    continue
+                if plies % 2 == 0:
+                    # A move to a lost position wins
+                    buckets[plies + 1].append(before)
+                    continue
+                remaining[before] -= 1
+                if (remaining[before] == 0 and exit_wins[before] == _NONE and
+                    not exit_draws[before]
+                ):
+                    # All moves lose, the slowest loss counts
+                    loss = plies + 1
+                    if exit_losses[before] != _NONE:
+                        loss = max(loss, exit_losses[before] - 1)
+                    buckets[loss].append(before)
+        buckets[plies] = None
+    return table
+
+
+# Generates the tables of signatures and those they lead to, skipping
+# existing files
+# @return: list of the generated signatures
+def generate(signatures, directory, workers = 1, log = print):
+    os.makedirs(directory, exist_ok=True)
+    tables = Tablebase(directory)
+    generated = []
+    def visit(signature):
+        if os.path.exists(tables.path(signature)):
+            return
+        for successor in successor_signatures(signature):
+            visit(successor)
+        if os.path.exists(tables.path(signature)):
+            return
+        start = time.perf_counter()
+        table = generate_table(signature, directory, workers)
+        with open(tables.path(signature), "wb") as f:
+            f.write(table)
+        generated.append(signature)
+        values = set(table) - {DRAW, ILLEGAL}
+        wins = sum(table.count(value) for value in values if value % 2 == 0)
+        longest = max(values, default=1) - 1
+        log(f"{signature}: {len(table)} positions, {wins} wins for the player "
+            f"to move, longest mate {longest} plies, "
+            f"{time.perf_counter() - start:.1f}s")
+    for signature in signatures:
+        white, black = signature.split("v")
+        visit(canonical_signature(white, black)[0])
+    return generated
+
+
+if __name__=="__main__":
+    parser = argparse.ArgumentParser(description="generate or probe "
+                                     "endgame tablebases")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    generate_parser = subparsers.add_parser("generate", help="generate "
+                                            "tables with the ones they need")
+    generate_parser.add_argument("signatures", nargs="*",
+                                 help="e.g. KQvK KRvK KPvK")
+    generate_parser.add_argument("-a", "--all", type=int, metavar="PIECES",
+                                 help="all signatures of 3 or 4 pieces")
+    generate_parser.add_argument("-d", "--dir", default="tablebases")
+    generate_parser.add_argument("-w", "--workers", type=int,
+                                 default=os.cpu_count())
+    probe_parser = subparsers.add_parser("probe", help="probe a position")
+    probe_parser.add_argument("fen")
+    probe_parser.add_argument("-d", "--dir", default="tablebases")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        signatures = list(args.signatures)
+        if args.all:
+            if not 3 <= args.all <= MAX_PIECES:
+                parser.error(f"--all takes 3 to {MAX_PIECES} pieces")
+            signatures += all_signatures(args.all)
+        generate(signatures, args.dir, args.workers)
+    else:
+        tables = Tablebase(args.dir)
+        board = BitBoard.from_fen(args.fen)
+        value = tables.probe(board)
+        if value is None:
+            print("not covered")
+        elif value == DRAW:
+            print("draw")
+        else:
+            plies = value - 1
+            print(f"{'win' if plies % 2 else 'loss'} in {plies} plies")
+            best = tables.best_move(board)
+            if best is not None:
+                print("best move", best[0])
+        tables.close()
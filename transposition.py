@@ -0,0 +1,94 @@
+import sys
+
+# Transposition table for the searchers in chessai.py.
+#
+# Entries are (key, depth, score, bound, move, age) tuples in a flat list of
+# two-slot buckets, indexed by the Zobrist key of the position (board.key).
+# The first slot keeps the deepest entry of the current search, the second
+# is always replaced. Entries of older searches (see new_search) give way
+# to new ones regardless of depth.
+
+# Bound types of stored scores
+EXACT, LOWER, UPPER = 0, 1, 2
+
+# Approximate bytes of an entry: its slot, the tuple, the key, the score
+# and the move (its coordinates are shared)
+ENTRY_BYTES = (8 + sys.getsizeof((1 << 63, 0, 0, EXACT, None, 0)) +
+               sys.getsizeof(1 << 63) + sys.getsizeof(1000) +
+               sys.getsizeof((None, None, None)))
+
+
+class TranspositionTable:
+    # @param hash_mb: memory cap in megabytes
+    def __init__(self, hash_mb):
+        self.buckets = max(1, hash_mb * (1 << 20) // (2 * ENTRY_BYTES))
+        self.entries = [None] * (2 * self.buckets)
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+        self.misses = 0
+        # Probes of a bucket holding only other positions
+        self.collisions = 0
+        self.stores = 0
+        # Stores that overwrote another position
+        self.replacements = 0
+
+    # Starts a new search: entries stored so far become old
+    def new_search(self):
+        self.age = (self.age + 1) & 0xFF
+
+    def clear(self):
+        self.entries = [None] * (2 * self.buckets)
+
+    # @param key: Zobrist key of the position
+    # @return: stored entry of the position or None
+    def probe(self, key):
+        self.probes += 1
+        index = (key % self.buckets) * 2
+        entries = self.entries
+        for entry in (entries[index], entries[index + 1]):
+            if entry is not None and entry[0] == key:
+                self.hits += 1
+                return entry
+        self.misses += 1
+        if entries[index] is not None or entries[index + 1] is not None:
+            self.collisions += 1
+        return None
+
+    # @param key: Zobrist key of the position
+    # @param depth: remaining depth of the search that found the score
+    # @param bound: EXACT, LOWER or UPPER
+    # @param move: best move found or None
+    def store(self, key, depth, score, bound, move):
+        self.stores += 1
+        index = (key % self.buckets) * 2
+        entries = self.entries
+        deepest = entries[index]
+        if (deepest is None or deepest[0] == key or depth >= deepest[1] or
+            deepest[5] != self.age
+        ):
+            if deepest is not None and deepest[0] != key:
+                # The replaced entry may still be useful in the second slot
+                entries[index + 1] = deepest
+                self.replacements += 1
+            entries[index] = (key, depth, score, bound, move, self.age)
+        else:
+            replaced = entries[index + 1]
+            if replaced is not None and replaced[0] != key:
+                self.replacements += 1
+            entries[index + 1] = (key, depth, score, bound, move, self.age)
+
+    # @return: permille of slots holding entries of the current search
+    def usage(self):
+        used = sum(1 for entry in self.entries
+                   if entry is not None and entry[5] == self.age)
+        return used * 1000 // len(self.entries)
+
+    # @return: dictionary of counters
+    def stats(self):
+        return {"probes": self.probes, "hits": self.hits,
+                "misses": self.misses, "collisions": self.collisions,
+                "stores": self.stores, "replacements": self.replacements}
+
+    def __str__(self):
+        return " ".join(f"{name} {count}" for name, count in self.stats().items())
@@ -0,0 +1,339 @@
+from bitboard import BitBoard
+from book import OpeningBook
+from chessai import HEURISTICS, MATE_BOUND, MATE_SCORE, NegaMax, pawn_value
+from definitions import *
+from exceptions import *
+from tablebase import Tablebase
+from transposition import TranspositionTable
+import sys
+import threading
+import time
+
+# UCI (Universal Chess Interface) front end: the engine reads commands from
+# stdin and answers on stdout, so chess GUIs and tournament managers can
+# run it headless: python uci.py
+#
+# Searches run NegaMax on a BitBoard in a worker thread, the main thread
+# keeps reading commands. 'stop' interrupts the search at its next node,
+# and the best move of the last completed iteration is played.
+
+ENGINE_NAME = "chess-py"
+ENGINE_AUTHOR = "omer-g"
+PROMOTION_CHARS = {Queen: "q", Rook: "r", Bishop: "b", Knight: "n"}
+CHAR_PROMOTION = dict((c, piece) for piece, c in PROMOTION_CHARS.items())
+# Moves left in the game assumed by the time control without movestogo
+DEFAULT_MOVES_TO_GO = 30
+# Milliseconds kept back from each move for the overhead of the interface
+MOVE_OVERHEAD = 50
+
+# Options: name to (UCI type, default, minimum, maximum or choices)
+OPTIONS = {
+    "Hash": ("spin", 16, 0, 1024),
+    "Threads": ("spin", 1, 1, 64),
+    "Eval": ("combo", "pst", sorted(HEURISTICS)),
+    "NullMove": ("check", False),
+    "LMR": ("check", False),
+    "Futility": ("check", False),
+    "Quiescence": ("check", True),
+    "BookFile": ("string", ""),
+    "TablebaseDir": ("string", ""),
+}
+
+
+# @return: move in UCI notation, e.g. 'e2e4' or 'e7e8q'
+def move_to_uci(move):
+    origin, target, promotion = move
+    text = ("abcdefgh"[origin[1]] + str(origin[0] + 1) +
+            "abcdefgh"[target[1]] + str(target[0] + 1))
+    if promotion is not None:
+        text += PROMOTION_CHARS[promotion]
+    return text
+
+# @param text: move in UCI notation, castling as the king's move
+# @return: the legal move of the board or None
+def uci_to_move(board, text):
+    if len(text) not in (4, 5):
+        return None
+    try:
+        origin = Coords("12345678".index(text[1]), "abcdefgh".index(text[0]))
+        target = Coords("12345678".index(text[3]), "abcdefgh".index(text[2]))
+    except ValueError:
+        return None
+    promotion = CHAR_PROMOTION.get(text[4:].lower()) if len(text) == 5 else None
+    move = (origin, target, promotion)
+    return move if move in board.generate_legal_moves() else None
+
+
+# @param score: search score of the player to move
+# @return: UCI score, 'cp <centipawns>' or 'mate <moves>'
+def uci_score(score, unit):
+    if score >= MATE_BOUND:
+        return f"mate {(MATE_SCORE - score + 1) // 2}"
+    if score <= -MATE_BOUND:
+        return f"mate -{(MATE_SCORE + score + 1) // 2}"
+    return f"cp {round(score * 100 / unit)}"
+
+
+# @param limits: parameters of the 'go' command
+# @return: time budget of the move in milliseconds or None for no limit
+def move_time(limits, white_turn):
+    if "movetime" in limits:
+        return max(1, limits["movetime"] - MOVE_OVERHEAD)
+    left = limits.get("wtime" if white_turn else "btime")
+    if left is None:
+        return None
+    increment = limits.get("winc" if white_turn else "binc", 0)
+    moves = limits.get("movestogo") or DEFAULT_MOVES_TO_GO
+    budget = left / moves + increment * 3 / 4
+    return max(1, min(budget, left / 2) - MOVE_OVERHEAD)
+
+
+class UciEngine:
+    # @param output: stream of the answers
+    def __init__(self, output = sys.stdout):
+        self.output = output
+        self.options = dict((name, option[1])
+                            for name, option in OPTIONS.items())
+        self.board = BitBoard()
+        self.searcher = NegaMax(self.board, True, HEURISTICS["pst"],
+                                depth = None, hash_mb = 16, quiet = True)
+        self.book = None
+        self.tablebase = None
+        self.search_thread = None
+        self.search_start = 0
+        self.infinite = False
+        # Set by 'stop', an infinite search holds its best move until then
+        self.stopped = threading.Event()
+
+    def send(self, line):
+        print(line, file=self.output, flush=True)
+
+    # Reads commands until 'quit' or the end of input
+    def run(self, lines = sys.stdin):
+        for line in lines:
+            if not self.command(line.split()):
+                break
+        self.wait()
+        self.searcher.close()
+
+    # @param words: a command line split on whitespace
+    # @return: False on 'quit'
+    def command(self, words):
+        if not words:
+            return True
+        name, args = words[0], words[1:]
+        if name == "uci":
+            self.send(f"id name {ENGINE_NAME}")
+            self.send(f"id author {ENGINE_AUTHOR}")
+            for option_name, option in OPTIONS.items():
+                self.send(self._option_line(option_name, option))
+            self.send("uciok")
+        elif name == "isready":
+            self.send("readyok")
+        elif name == "ucinewgame":
+            self.wait()
+            if self.searcher.table is not None:
+                self.searcher.table.clear()
+        elif name == "setoption":
+            self.wait()
+            self.set_option(args)
+        elif name == "position":
+            self.wait()
+            self.set_position(args)
+        elif name == "go":
+            self.wait()
+            self.go(args)
+        elif name == "stop":
+            self.stop()
+        elif name == "quit":
+            self.stop()
+            return False
+        return True
+
+    @staticmethod
+    def _option_line(name, option):
+        kind, default = option[0], option[1]
+        line = f"option name {name} type {kind} default "
+        if kind == "check":
+            return line + ("true" if default else "false")
+        if kind == "spin":
+            return line + f"{default} min {option[2]} max {option[3]}"
+        if kind == "combo":
+            return line + default + "".join(f" var {choice}"
+                                             for choice in option[2])
+        return line + (default or "<empty>")
+
+    # @param args: 'name <name> value <value>', names may have spaces
+    def set_option(self, args):
+        if "name" not in args:
+            return
+        value_index = args.index("value") if "value" in args else len(args)
+        name = " ".join(args[args.index("name") + 1:value_index])
+        value = " ".join(args[value_index + 1:])
+        option = OPTIONS.get(name)
+        if option is None:
+            self.send(f"info string unknown option {name}")
+            return
+        kind = option[0]
+        try:
+            if kind == "spin":
+                value = min(max(int(value), option[2]), option[3])
+            elif kind == "check":
+                value = value.lower() == "true"
+            elif kind == "combo" and value not in option[2]:
+                raise ValueError(value)
+        except ValueError:
+            self.send(f"info string invalid value {value} for {name}")
+            return
+        self.options[name] = value
+        self._apply_option(name, value)
+
+    def _apply_option(self, name, value):
+        searcher = self.searcher
+        if name == "Hash":
+            searcher.hash_mb = value
+            searcher.table = TranspositionTable(value) if value else None
+        elif name == "Threads":
+            # Workers are created with the options of the first search
+            searcher.close()
+            searcher.threads = value
+        elif name == "Eval":
+            searcher.heuristic = HEURISTICS[value]
+            searcher.pawn_value = pawn_value(searcher.heuristic)
+        elif name in ("NullMove", "LMR", "Futility", "Quiescence"):
+            setattr(searcher, {"NullMove": "null_move", "LMR": "lmr",
+                               "Futility": "futility",
+                               "Quiescence": "quiescence"}[name], value)
+        elif name == "BookFile":
+            if self.book is not None:
+                self.book.close()
+            self.book = OpeningBook(value) if value else None
+        elif name == "TablebaseDir":
+            if self.tablebase is not None:
+                self.tablebase.close()
+            self.tablebase = Tablebase(value) if value else None
+            searcher.tablebase = self.tablebase
+        if name in ("Hash", "Eval", "NullMove", "LMR", "Futility",
+                    "Quiescence"):
+            searcher.close()
+
+    # @param args: 'startpos' or 'fen <fen>', then 'moves <moves>'
+    def set_position(self, args):
+        moves_index = args.index("moves") if "moves" in args else len(args)
+        if args and args[0] == "fen":
+            fen = " ".join(args[1:moves_index])
+        else:
+            fen = START_POSITION + " w KQkq - 0 1"
+        try:
+            self.board.set_fen(fen)
+        except InvalidFenException as e:
+            self.send(f"info string {e}")
+            self.board.set_fen(START_POSITION + " w KQkq - 0 1")
+            return
+        for text in args[moves_index + 1:]:
+            move = uci_to_move(self.board, text)
+            if move is None:
+                self.send(f"info string illegal move {text}")
+                break
+            self.board.make_move(move)
+
+    # @param args: search limits: depth, nodes, movetime, wtime, btime,
+    #              winc, binc, movestogo, infinite
+    def go(self, args):
+        limits = {}
+        i = 0
+        while i < len(args):
+            if args[i] == "infinite":
+                limits["infinite"] = True
+            elif i + 1 < len(args) and args[i + 1].lstrip("-").isdigit():
+                limits[args[i]] = int(args[i + 1])
+                i += 1
+            i += 1
+        self.infinite = limits.get("infinite", False)
+        self.stopped.clear()
+        self.search_start = time.perf_counter()
+        self.search_thread = threading.Thread(target=self._search,
+                                              args=(limits,), daemon=True)
+        self.search_thread.start()
+
+    # Stops a running search, which then sends its best move
+    def stop(self):
+        thread = self.search_thread
+        if thread is None:
+            return
+        self.stopped.set()
+        while thread.is_alive():
+            self.searcher.node_limit = 0
+            thread.join(0.01)
+        self.search_thread = None
+        self.infinite = False
+
+    # Waits for a running search to end, stops it when it is infinite
+    def wait(self):
+        if self.infinite:
+            self.stop()
+        elif self.search_thread is not None:
+            self.search_thread.join()
+            self.search_thread = None
+
+    # Searches in the worker thread and sends the best move. A failing
+    # search still answers, with a legal move or '0000', so the interface
+    # does not wait forever.
+    def _search(self, limits):
+        board = self.board
+        root_records = board.record_count
+        try:
+            move = self._best_move(limits)
+        except Exception as e:
+            self.send(f"info string search failed: {type(e).__name__}: {e}")
+            move = None
+            try:
+                while board.record_count > root_records:
+                    board.unmake_move()
+                moves = board.generate_legal_moves()
+                move = moves[0] if moves else None
+            except Exception:
+                pass
+        if limits.get("infinite"):
+            self.stopped.wait()
+        self.send(f"bestmove {move_to_uci(move) if move else '0000'}")
+
+    # @return: move of the book, the tablebases or the search, None if
+    #          there are no moves
+    def _best_move(self, limits):
+        board = self.board
+        move = None
+        if self.book is not None:
+            move = self.book.choose(board)
+        if move is None and self.tablebase is not None:
+            best = self.tablebase.best_move(board)
+            if best is not None:
+                move, value = best
+                score = self.searcher._tablebase_score(value, 0)
+                self.send(f"info depth 0 score "
+                          f"{uci_score(score, self.searcher.pawn_value)} "
+                          f"pv {move_to_uci(move)}")
+        if move is None:
+            searcher = self.searcher
+            searcher.board = board
+            searcher.on_iteration = self._send_info
+            movetime = (None if limits.get("infinite") else
+                        move_time(limits, board.white_turn))
+            move, _ = searcher.iterative_search(limits.get("depth"), movetime,
+                                                limits.get("nodes"))
+        return move
+
+    # Sends the progress of the search after an iteration
+    def _send_info(self, searcher):
+        elapsed = time.perf_counter() - self.search_start
+        line = searcher.principal_variation(searcher.completed_depth)
+        self.send(f"info depth {searcher.completed_depth} "
+                  f"score {uci_score(searcher.score, searcher.pawn_value)} "
+                  f"nodes {searcher.nodes} "
+                  f"nps {int(searcher.nodes / elapsed) if elapsed else 0} "
+                  f"time {int(elapsed * 1000)} "
+                  f"pv {' '.join(move_to_uci(move) for move in line)}")
+
+
+if __name__=="__main__":
+    UciEngine().run()